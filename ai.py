@@ -1,19 +1,17 @@
 import os
-from sentence_transformers import SentenceTransformer
+import hashlib
 import numpy as np
 import logging
 from typing import List, Dict, Any
 import json
-from app.services.vector_db import VectorDB
+from app.services.vector_db import get_vector_db
+from app.services.embeddings import get_embedding_model
 
 logger = logging.getLogger(__name__)
 
-# Инициализируем модель для embeddings
-model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-mpnet-base-v2')
-
 def get_embedding(text: str) -> np.ndarray:
     """Получить векторное представление текста"""
-    return model.encode([text])[0]
+    return get_embedding_model().encode([text])[0]
 
 def add_file_to_vector_db(file_path: str, save_path: str) -> bool:
     """
@@ -28,20 +26,19 @@ def add_file_to_vector_db(file_path: str, save_path: str) -> bool:
             return False
 
         # Создаем или получаем экземпляр VectorDB
-        vector_db = VectorDB(
-            os.path.join(save_path, "vector_index.faiss"),
-            os.path.join(save_path, "documents.json")
-        )
+        vector_db = get_vector_db(save_path)
 
-        # Добавляем документы в базу
+        # Добавляем все чанки в базу одним пакетом
+        chunks = []
         for doc in documents:
-            if isinstance(doc, str):
-                text = doc
-            else:
-                text = doc.get('text', '')
-
+            text = doc.page_content
             if text:
-                vector_db.add_document(text, file_path)
+                chunk_id = hashlib.md5(f"{file_path}:{doc.metadata.get('chunk_index')}:{text}".encode()).hexdigest()
+                chunks.append({'id': chunk_id, 'text': text, **doc.metadata})
+
+        if not vector_db.add_documents(chunks):
+            logger.error(f"No chunks indexed for {file_path}")
+            return False
 
         logger.info(f"Successfully processed and indexed file: {file_path}")
         return True
@@ -56,10 +53,7 @@ def answer_question(question: str, vector_db_path: str) -> str:
     """
     try:
         # Создаем или получаем экземпляр VectorDB
-        vector_db = VectorDB(
-            os.path.join(vector_db_path, "vector_index.faiss"),
-            os.path.join(vector_db_path, "documents.json")
-        )
+        vector_db = get_vector_db(vector_db_path)
 
         # Ищем похожие документы
         results = vector_db.search(question, top_k=3)
@@ -1,5 +1,6 @@
 from flask import Flask
 from flask_sqlalchemy import SQLAlchemy
+from flask_login import LoginManager
 import logging
 import os
 
@@ -9,6 +10,8 @@ logger = logging.getLogger(__name__)
 
 # Инициализация расширений
 db = SQLAlchemy()
+login_manager = LoginManager()
+login_manager.login_view = 'auth.login'
 
 def create_app():
     app = Flask(__name__)
@@ -24,6 +27,7 @@ def create_app():
 
     # Инициализация расширений
     db.init_app(app)
+    login_manager.init_app(app)
 
     with app.app_context():
         # Создание необходимых директорий
@@ -45,10 +49,24 @@ def create_app():
         try:
             from app.routes import main
             app.register_blueprint(main)
+            from app.auth import auth
+            app.register_blueprint(auth)
+            from app.api.search import search_api
+            app.register_blueprint(search_api)
+            from app.api.metrics import metrics_api
+            app.register_blueprint(metrics_api)
             logger.info("Blueprints registered successfully")
         except Exception as e:
             logger.error(f"Error registering blueprints: {e}")
 
+        # Сбор времени этапов конвейера в гистограммы для /metrics
+        from app.services.metrics import install as install_metrics
+        install_metrics()
+
+        # Регистрация CLI-команд
+        from app.cli import register_commands
+        register_commands(app)
+
         # Создаем тестового админа если его нет
         try:
             admin_user = User.query.filter_by(username='admin').first()
@@ -1,20 +1,25 @@
 import os
-from sentence_transformers import SentenceTransformer
 import numpy as np
 import logging
-from typing import List, Dict, Any
+import time
+from typing import List, Dict, Any, Optional, Tuple
 import json
-from app.services.vector_db import VectorDB
+from app.services.vector_db import get_vector_db
 from app.services.gigachat import GigaChatAPI
+from app.services.embeddings import get_embedding_model
+from app.services.reranker import rerank
+from app.services.search_scope import resolve_scope
+from app.services.timing import span, timed
 
 logger = logging.getLogger(__name__)
 
-# Инициализируем модель для embeddings
-model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-mpnet-base-v2')
-
 MAX_RESPONSE_LENGTH = 3000  # Maximum length for a single response message
 MAX_RESULTS = 2  # Limit number of results to keep response concise
 MAX_CONTEXT_LENGTH = 15000  # Maximum length of context in characters
+HYBRID_SEARCH = os.environ.get('HYBRID_SEARCH', '1') != '0'  # BM25 + векторный поиск с RRF-слиянием
+RERANK_ENABLED = os.environ.get('RERANK_ENABLED', '1') != '0'  # Второй этап: cross-encoder
+RETRIEVAL_CANDIDATES = 20  # Кандидатов первого этапа для переранжирования
+RERANK_SCORE_MARGIN = 3.0  # Чанки, сильно уступающие лучшему по оценке, не попадают в промпт
 
 SYSTEM_PROMPT = """
 Ты интеллектуальный помощник, который отвечает на вопросы по контексту. 
@@ -29,7 +34,7 @@ SYSTEM_PROMPT = """
 def get_embedding(text: str) -> np.ndarray:
     """Получить векторное представление текста"""
     try:
-        return model.encode([text])[0]
+        return get_embedding_model().encode([text])[0]
     except Exception as e:
         logger.error(f"Error creating embedding: {str(e)}")
         raise
@@ -47,21 +52,59 @@ def truncate_text(text: str, max_length: int = MAX_RESPONSE_LENGTH) -> str:
         return truncated[:last_period + 1]
     return truncated[:max_length] + "..."
 
-def answer_question(question: str, vector_db_path: str) -> str:
+def retrieve(vector_db, question: str, top_k: int = MAX_RESULTS, selected=None) -> List[Dict[str, Any]]:
+    """
+    Двухэтапный поиск: широкий набор кандидатов из индекса, затем переранжирование
+    cross-encoder'ом в пределах бюджета времени. Если бюджет превышен, остается
+    порядок первого этапа. selected ограничивает поиск позициями чанков (VectorDB.select).
+    """
+    search = vector_db.hybrid_search if HYBRID_SEARCH else vector_db.search
+    if not RERANK_ENABLED:
+        with span('search'):
+            return search(question, top_k=top_k, selected=selected)
+
+    with span('search'):
+        candidates = search(question, top_k=max(top_k, RETRIEVAL_CANDIDATES), selected=selected)
+    with span('rerank'):
+        reranked = rerank(question, candidates)
+    if not reranked:
+        return candidates[:top_k]
+
+    # Отправляем в модель только чанки, сопоставимые по релевантности с лучшим
+    best_score = reranked[0]['rerank_score']
+    return [doc for doc in reranked[:top_k] if doc['rerank_score'] >= best_score - RERANK_SCORE_MARGIN]
+
+@timed('answer')
+def answer_question(question: str, vector_db_path: str, course_id: Optional[int] = None,
+                    material_id: Optional[int] = None, file_id: Optional[int] = None,
+                    pages: Optional[Tuple[int, int]] = None) -> str:
     """
-    Ответить на вопрос, используя векторную базу данных и нейросеть
+    Ответить на вопрос, используя векторную базу данных и нейросеть.
+
+    course_id / material_id / file_id и диапазон страниц pages ограничивают поиск
+    чанками выбранных файлов (нужен контекст приложения).
     """
     try:
         logger.info(f"Попытка ответить на вопрос: {question}")
 
-        # Создаем или получаем экземпляр VectorDB
-        vector_db = VectorDB(
-            os.path.join(vector_db_path, "vector_index.faiss"),
-            os.path.join(vector_db_path, "documents.json")
-        )
-
-        # Ищем похожие документы
-        results = vector_db.search(question, top_k=MAX_RESULTS)
+        # Получаем общий экземпляр VectorDB активного поколения индекса
+        vector_db = get_vector_db(vector_db_path)
+
+        # Ограничиваем поиск выбранным курсом, материалом или файлом
+        selected = None
+        scope = resolve_scope(course_id, material_id, file_id)
+        # Позиции из select() действительны, пока индекс не изменился - держим его на чтение до конца поиска
+        with vector_db.reading():
+            if scope is not None or pages is not None:
+                start = time.perf_counter()
+                with span('filter'):
+                    selected = vector_db.select(scope if scope is not None else vector_db.content_index, pages)
+                live = max(1, len(vector_db.documents) - vector_db.tombstone_count)
+                logger.info(f"Фильтр поиска: {len(selected)} из {live} чанков "
+                            f"({len(selected) / live:.1%}), {(time.perf_counter() - start) * 1000:.1f} мс")
+
+            # Ищем похожие документы
+            results = retrieve(vector_db, question, selected=selected)
         logger.info(f"Найдено документов: {len(results)}")
 
         if not results:
@@ -105,7 +148,8 @@ def answer_question(question: str, vector_db_path: str) -> str:
 
         # Получаем ответ от нейросети
         gigachat = GigaChatAPI()
-        ai_response = gigachat.generate_response(prompt)
+        with span('generation'):
+            ai_response = gigachat.generate_response(prompt)
 
         if not ai_response:
             logger.warning("Не удалось получить ответ от нейросети")
@@ -120,52 +164,15 @@ def answer_question(question: str, vector_db_path: str) -> str:
         logger.error(f"Ошибка в answer_question: {str(e)}")
         return "Извините, произошла ошибка при поиске ответа на ваш вопрос. Пожалуйста, попробуйте еще раз или обратитесь к администратору системы."
 
-def generate_document_id(file_path: str, text: str, index: int) -> str:
-    """Генерирует уникальный ID документа"""
-    text_hash = hashlib.md5(text.encode()).hexdigest()[:8]
-    return f"{file_path}_{index}_{text_hash}"
-
 def add_file_to_vector_db(file_path: str, save_path: str) -> bool:
     """Обработать файл и добавить его содержимое в векторную базу данных"""
     try:
         logger.info(f"Начало обработки файла для добавления в векторную БД: {file_path}")
         os.makedirs(save_path, exist_ok=True)
 
-        from app.file_processing import process_file
-        documents = process_file(file_path)
-
-        if not documents:
-            logger.error(f"Не удалось извлечь документы из файла: {file_path}")
-            return False
-
-        logger.info(f"Извлечено {len(documents)} документов из файла")
-
-        vector_db = VectorDB(
-            os.path.join(save_path, "vector_index.faiss"),
-            os.path.join(save_path, "documents.json")
-        )
-
-        success_count = 0
-        for idx, doc in enumerate(documents):
-            try:
-                if isinstance(doc, str):
-                    text = doc
-                else:
-                    text = doc.get('text', '')
-
-                if text:
-                    document_id = generate_document_id(file_path, text, idx)
-                    if vector_db.add_document(text, document_id):
-                        success_count += 1
-                        logger.info(f"Документ {idx + 1}/{len(documents)} успешно добавлен")
-                    else:
-                        logger.warning(f"Не удалось добавить документ {idx + 1}/{len(documents)}")
-            except Exception as e:
-                logger.error(f"Ошибка при добавлении документа {idx + 1}: {str(e)}")
-                continue
-
-        logger.info(f"Успешно добавлено {success_count} из {len(documents)} документов в векторную БД")
-        return success_count > 0
+        # Используем общий конвейер: извлечение -> разбиение на чанки по токенам -> пакетная индексация
+        from app.services.file_processor import FileProcessor
+        return FileProcessor(vector_db_path=save_path).process_file(file_path)
 
     except Exception as e:
         logger.error(f"Ошибка в add_file_to_vector_db: {str(e)}")
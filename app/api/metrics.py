@@ -0,0 +1,10 @@
+from flask import Blueprint, Response
+from app.services.metrics import render, CONTENT_TYPE
+
+metrics_api = Blueprint('metrics_api', __name__)
+
+
+@metrics_api.route('/metrics')
+def metrics():
+    """Гистограммы времени этапов RAG-конвейера в формате Prometheus"""
+    return Response(render(), content_type=CONTENT_TYPE)
@@ -0,0 +1,134 @@
+from flask import Blueprint, jsonify, request
+from flask_login import current_user
+from app.models import Course
+from app.services.vector_db import get_vector_db
+from app.services.search_scope import resolve_scope, parse_page_range
+import hmac
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+search_api = Blueprint('search_api', __name__)
+
+MAX_BATCH_QUERIES = 256  # Ограничение на число запросов в одном пакете
+MAX_TOP_K = 50
+
+# Токен для сервисных клиентов (Authorization: Bearer ...): поиск по всем курсам без входа
+SEARCH_API_TOKEN = os.environ.get('SEARCH_API_TOKEN')
+
+# Поля чанка, которые отдаются наружу (пути файлов на сервере не раскрываем)
+RESULT_FIELDS = ('id', 'text', 'content_hash', 'chunk_index', 'page', 'page_end', 'paragraph', 'paragraph_end')
+
+
+def _token_valid():
+    header = request.headers.get('Authorization', '')
+    return bool(SEARCH_API_TOKEN) and hmac.compare_digest(header, f'Bearer {SEARCH_API_TOKEN}')
+
+
+def _accessible_courses(user):
+    """Ids of the courses a user created or was granted"""
+    granted = {course_id for (course_id,) in user.courses.with_entities(Course.id)}
+    return granted | {course.id for course in user.courses_created}
+
+
+def _optional_id(value):
+    """None or a positive integer id from a JSON field; ValueError on anything else"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (bool, float)):
+        raise ValueError(value)
+    value = int(value)
+    if value <= 0:
+        raise ValueError(value)
+    return value
+
+
+def _serialize(doc):
+    result = {key: doc[key] for key in RESULT_FIELDS if key in doc}
+    result['duplicates'] = len(doc.get('aliases', []))
+    return result
+
+
+@search_api.route('/api/search/batch', methods=['POST'])
+def search_batch():
+    """Пакетный поиск по индексу: все запросы кодируются и ищутся за один проход"""
+    try:
+        data = request.get_json(silent=True)
+        if not isinstance(data, dict) or not isinstance(data.get('queries'), list):
+            return jsonify({
+                'success': False,
+                'error': 'Поле queries должно быть списком строк'
+            }), 400
+
+        queries = data['queries']
+        if not all(isinstance(query, str) for query in queries):
+            return jsonify({
+                'success': False,
+                'error': 'Поле queries должно быть списком строк'
+            }), 400
+        if len(queries) > MAX_BATCH_QUERIES:
+            return jsonify({
+                'success': False,
+                'error': f'Не более {MAX_BATCH_QUERIES} запросов за раз'
+            }), 400
+
+        try:
+            top_k = min(max(int(data.get('top_k', 5)), 1), MAX_TOP_K)
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'error': 'top_k должно быть числом'
+            }), 400
+
+        try:
+            course_id, material_id, file_id = (_optional_id(data.get(key))
+                                               for key in ('course_id', 'material_id', 'file_id'))
+        except (TypeError, ValueError):
+            return jsonify({
+                'success': False,
+                'error': 'course_id, material_id и file_id должны быть целыми числами'
+            }), 400
+
+        # Сервисный токен или администратор ищут по всему индексу, остальные - только по своим курсам
+        allowed_courses = None
+        if not (_token_valid() or (current_user.is_authenticated and current_user.is_admin)):
+            if not current_user.is_authenticated:
+                return jsonify({
+                    'success': False,
+                    'error': 'Требуется вход в систему или токен API'
+                }), 401
+            allowed_courses = _accessible_courses(current_user)
+            if course_id and course_id not in allowed_courses:
+                return jsonify({
+                    'success': False,
+                    'error': 'Нет доступа к курсу'
+                }), 403
+
+        start = time.perf_counter()
+        vector_db = get_vector_db(os.path.join(os.getcwd(), 'app', 'data'))
+
+        # Необязательный фильтр по курсу, материалу, файлу и страницам
+        selected = None
+        scope = resolve_scope(course_id, material_id, file_id, allowed_courses=allowed_courses)
+        pages = parse_page_range(data.get('page_from'), data.get('page_to'))
+        with vector_db.reading():
+            if scope is not None or pages is not None:
+                selected = vector_db.select(scope if scope is not None else vector_db.content_index, pages)
+            results = vector_db.search_batch(queries, top_k=top_k, selected=selected)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        logger.info(f"Пакетный поиск: {len(queries)} запросов за {elapsed_ms:.1f} мс")
+
+        return jsonify({
+            'success': True,
+            'results': [[_serialize(doc) for doc in docs] for docs in results],
+            'elapsed_ms': round(elapsed_ms, 1)
+        })
+
+    except Exception as e:
+        logger.error(f"Ошибка пакетного поиска: {str(e)}")
+        return jsonify({
+            'success': False,
+            'error': 'Ошибка при выполнении поиска'
+        }), 500
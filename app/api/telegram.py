@@ -1,5 +1,5 @@
 from flask import Blueprint, jsonify, request
-from app.models import User, db
+from app.models import User, CacheVersion, db
 from werkzeug.security import generate_password_hash
 import logging
 
@@ -52,6 +52,7 @@ def register():
         user.set_password(temp_password)
 
         db.session.add(user)
+        CacheVersion.bump('access')
         db.session.commit()
 
         logger.info(f"Пользователь {username} успешно зарегистрирован через Telegram")
@@ -1,19 +1,34 @@
 import os
 import logging
-import asyncio
 from aiogram import Bot, Dispatcher, types
 from aiogram.filters import Command
-from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
-from app.models import Course, db, User
+from aiogram.fsm.context import FSMContext
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton, InlineQueryResultsButton
 from flask import Flask
 import requests
 from app.services.vector_db import VectorDB
 from app.ai import answer_question
+from app.services.timing import timed
+from app.services.profiler import profile
+from app.bot.workers import WorkerPool
+from app.services.fair_queue import QuestionRejected
+from app.bot.storage import create_storage
+from app.bot.outbox import OutboundQueue
+from app.bot.catalog import CourseCatalog
+from app.bot.database import BotDatabase
+from app.bot.inline import InlineSearch, MIN_QUERY_LENGTH
+from app.services import metrics
 
 logger = logging.getLogger(__name__)
 
 API_BASE_URL = "http://127.0.0.1:5000/api/telegram"  # Адрес вашего Flask API
 
+
+class QuestionStates(StatesGroup):
+    waiting_for_question = State()  # Курс выбран (course_id в данных состояния), ждем вопрос
+
+
 class CourseBot:
     def __init__(self, app: Flask):
         if not app:
@@ -26,14 +41,25 @@ class CourseBot:
 
         logger.info("Initializing Telegram bot...")
         self.bot = Bot(token=self.token)
-        self.dp = Dispatcher()
-        self.user_states = {}
+        # Все исходящие сообщения проходят через очередь с лимитами Telegram (см. app.bot.outbox)
+        self.outbox = OutboundQueue()
+        self.bot.session.middleware(self.outbox)
+        metrics.register(self.outbox)
+        # Состояние диалогов хранится вне процесса и переживает перезапуск (см. app.bot.storage)
+        self.dp = Dispatcher(storage=create_storage())
+        self.workers = WorkerPool(app)
+        # Чтение курсов, материалов и пользователей - через асинхронный пул соединений, без потоков
+        self.database = BotDatabase.from_app(app)
+        self.catalog = CourseCatalog(self.database)
+        self.profile_next = set()  # Администраторы, чей следующий вопрос будет профилирован
         self._register_handlers()
         logger.info("Bot handlers registered successfully")
 
         # Инициализация VectorDB
         self.vector_db_path = os.path.join(os.getcwd(), "app", "data")
         logger.info(f"Vector DB path: {self.vector_db_path}")
+        # Быстрый поиск фрагментов для inline-запросов (@bot вопрос)
+        self.inline = InlineSearch(self.database, self.vector_db_path)
 
     def _register_handlers(self):
         """Регистрация обработчиков команд"""
@@ -42,6 +68,7 @@ class CourseBot:
             self.dp.message.register(self.list_courses_handler, Command("courses"))
             self.dp.message.register(self.help_handler, Command("help"))
             self.dp.message.register(self.ask_handler, Command("ask"))  # Обработчик команды /ask
+            self.dp.message.register(self.profile_handler, Command("profile"))
             self.dp.message.register(self.process_question)  # Обработчик для вопросов после выбора курса
             self.dp.callback_query.register(
                 self.course_callback_handler,
@@ -59,6 +86,7 @@ class CourseBot:
                 self.after_question_callback_handler,
                 lambda c: c.data in ['end_dialog']
             )
+            self.dp.inline_query.register(self.inline_query_handler)
         except Exception as e:
             logger.error(f"Error registering handlers: {e}", exc_info=True)
             raise
@@ -67,6 +95,10 @@ class CourseBot:
         """Обработчик команды /start"""
         try:
             logger.info(f"Start command received from user {message.from_user.id}")
+            # Переход из inline-режима (кнопка «Выберите курс») сразу открывает выбор курса
+            if message.text and message.text.split()[1:] == ['ask']:
+                await self.ask_handler(message)
+                return
             welcome_text = (
                 "👋 Добро пожаловать в бот системы управления курсами!\n\n"
                 "Доступные команды:\n"
@@ -82,22 +114,13 @@ class CourseBot:
     async def ask_handler(self, message: types.Message):
         """Обработчик команды /ask - показывает список курсов для выбора"""
         try:
-            with self.app.app_context():
-                courses = Course.query.all()
-                if not courses:
-                    await message.answer("📚 На данный момент нет доступных курсов")
-                    return
-
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(
-                        text=f"📘 {course.title}",
-                        callback_data=f"ask_course_{course.id}"
-                    )]
-                    for course in courses
-                ])
+            keyboard = await self.catalog.keyboard('ask_course_')
+            if not keyboard:
+                await message.answer("📚 На данный момент нет доступных курсов")
+                return
 
-                await message.answer("📚 Выберите курс, по которому хотите задать вопрос:", reply_markup=keyboard)
-                logger.info(f"Ask command processed for user {message.from_user.id}")
+            await message.answer("📚 Выберите курс, по которому хотите задать вопрос:", reply_markup=keyboard)
+            logger.info(f"Ask command processed for user {message.from_user.id}")
 
         except Exception as e:
             logger.error(f"Error in ask handler: {e}", exc_info=True)
@@ -106,22 +129,13 @@ class CourseBot:
     async def list_courses_handler(self, message: types.Message):
         """Обработчик команды /courses"""
         try:
-            with self.app.app_context():
-                courses = Course.query.all()
-                if not courses:
-                    await message.answer("📚 На данный момент нет доступных курсов")
-                    return
-
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(
-                        text=f"📘 {course.title}",
-                        callback_data=f"course_{course.id}"
-                    )]
-                    for course in courses
-                ])
+            keyboard = await self.catalog.keyboard('course_')
+            if not keyboard:
+                await message.answer("📚 На данный момент нет доступных курсов")
+                return
 
-                await message.answer("📚 Доступные курсы:", reply_markup=keyboard)
-                logger.info(f"Courses listed for user {message.from_user.id}")
+            await message.answer("📚 Доступные курсы:", reply_markup=keyboard)
+            logger.info(f"Courses listed for user {message.from_user.id}")
         except Exception as e:
             logger.error(f"Error in list courses handler: {e}")
             await message.answer("❌ Произошла ошибка при получении списка курсов")
@@ -130,22 +144,21 @@ class CourseBot:
         """Обработчик выбора курса"""
         try:
             course_id = int(callback.data.split('_')[1])
-            with self.app.app_context():
-                course = Course.query.get(course_id)
-                if not course:
-                    await callback.answer("❌ Курс не найден")
-                    return
+            course = await self.catalog.course(course_id)
+            if not course:
+                await callback.answer("❌ Курс не найден")
+                return
 
-                text = f"📘 {course.title}\n\n{course.description or 'Описание отсутствует'}"
-                keyboard = InlineKeyboardMarkup(inline_keyboard=[
-                    [InlineKeyboardButton(
-                        text="📚 Материалы курса",
-                        callback_data=f"materials_{course_id}"
-                    )]
-                ])
+            text = f"📘 {course['title']}\n\n{course['description'] or 'Описание отсутствует'}"
+            keyboard = InlineKeyboardMarkup(inline_keyboard=[
+                [InlineKeyboardButton(
+                    text="📚 Материалы курса",
+                    callback_data=f"materials_{course_id}"
+                )]
+            ])
 
-                await callback.message.edit_text(text, reply_markup=keyboard)
-                await callback.answer()
+            await callback.message.edit_text(text, reply_markup=keyboard)
+            await callback.answer()
         except Exception as e:
             logger.error(f"Error in course callback handler: {e}")
             await callback.answer("❌ Произошла ошибка")
@@ -154,28 +167,25 @@ class CourseBot:
         """Обработчик просмотра материалов курса"""
         try:
             course_id = int(callback.data.split('_')[1])
-            with self.app.app_context():
-                course = Course.query.get(course_id)
-                if not course:
-                    await callback.answer("❌ Курс не найден")
-                    return
+            course_title, materials = await self.database.materials(course_id)
+            if course_title is None:
+                await callback.answer("❌ Курс не найден")
+                return
 
-                materials = course.materials
-                if not materials:
-                    await callback.message.edit_text("В этом курсе пока нет материалов")
-                    await callback.answer()
-                    return
+            if not materials:
+                await callback.message.edit_text("В этом курсе пока нет материалов")
+                await callback.answer()
+                return
 
-                text = f"📚 Материалы курса {course.title}:\n\n"
-                for material in materials:
-                    text += f"📝 {material.title}\n"
-                    if material.files:
-                        for file in material.files:
-                            text += f"📎 {file.filename}\n"
-                    text += "\n"
+            text = f"📚 Материалы курса {course_title}:\n\n"
+            for material_title, filenames in materials:
+                text += f"📝 {material_title}\n"
+                for filename in filenames:
+                    text += f"📎 {filename}\n"
+                text += "\n"
 
-                await callback.message.edit_text(text)
-                await callback.answer()
+            await callback.message.edit_text(text)
+            await callback.answer()
         except Exception as e:
             logger.error(f"Error in materials callback handler: {e}")
             await callback.answer("❌ Произошла ошибка")
@@ -194,24 +204,38 @@ class CourseBot:
                 "2. Выберите курс из списка\n"
                 "3. Введите ваш вопрос\n"
                 "4. Получите ответ с релевантной информацией\n"
-                "5. Продолжайте задавать вопросы"
+                "5. Продолжайте задавать вопросы\n\n"
+                "🔎 Быстрый поиск: наберите в любом чате @имя_бота и вопрос - "
+                "бот покажет подходящие фрагменты материалов выбранного курса"
             )
             await message.reply(help_text)
         except Exception as e:
             logger.error(f"Error in help handler: {e}", exc_info=True)
             await message.reply("❌ Произошла ошибка при обработке команды")
 
-    async def process_question(self, message: types.Message):
+    async def profile_handler(self, message: types.Message):
+        """Обработчик команды /profile: профилировать следующий вопрос администратора"""
+        try:
+            if not (await self.catalog.access(message.from_user.id)).is_admin:
+                await message.reply("❌ Команда доступна только администраторам")
+                return
+
+            self.profile_next.add(message.from_user.id)
+            await message.reply("🔬 Следующий вопрос будет обработан с профилированием")
+        except Exception as e:
+            logger.error(f"Error in profile handler: {e}", exc_info=True)
+            await message.reply("❌ Произошла ошибка при обработке команды")
+
+    async def process_question(self, message: types.Message, state: FSMContext):
         """Обработчик вопросов после выбора курса"""
         try:
             user_id = message.from_user.id
-            user_state = self.user_states.get(user_id)
 
             # Проверяем, ожидаем ли мы вопрос от этого пользователя
-            if not user_state or not user_state.get('waiting_for_question'):
+            if await state.get_state() != QuestionStates.waiting_for_question.state:
                 return
 
-            course_id = user_state['course_id']
+            course_id = (await state.get_data()).get('course_id')
             question = message.text
 
             # Создаем клавиатуру с кнопкой завершения
@@ -219,18 +243,46 @@ class CourseBot:
                 [InlineKeyboardButton(text="✅ Завершить диалог", callback_data="end_dialog")]
             ])
 
-            with self.app.app_context():
+            # Один вопрос пользователя обрабатывается за раз, остальные вежливо отклоняются
+            if not self.workers.begin_question(user_id):
+                await message.reply(
+                    "⏳ Я еще отвечаю на ваш предыдущий вопрос. "
+                    "Пожалуйста, дождитесь ответа и задайте следующий вопрос."
+                )
+                return
+
+            ticket = None
+            try:
                 # Проверяем существование курса
-                course = Course.query.get(course_id)
+                course = await self.catalog.course(course_id)
                 if not course:
                     await message.reply("❌ Курс не найден", reply_markup=keyboard)
                     return
 
+                # Место в очереди к RAG-конвейеру: справедливо между пользователями и курсами, с лимитом частоты
+                try:
+                    ticket = self.workers.admit(user_id, course_id)
+                except QuestionRejected as e:
+                    await message.reply(
+                        f"⏳ Вы задаете вопросы слишком часто. Попробуйте снова через {e.retry_after} с.",
+                        reply_markup=keyboard
+                    )
+                    return
+
                 # Поиск ответа с использованием векторной базы данных
-                await message.reply("🔍 Ищу ответ на ваш вопрос...")
+                if not ticket.granted:
+                    await message.reply("🔍 Сейчас много вопросов, ваш вопрос в очереди...")
+                else:
+                    await message.reply("🔍 Ищу ответ на ваш вопрос...")
 
                 try:
-                    answer = answer_question(question, self.vector_db_path)
+                    # Ищем только среди материалов выбранного курса (в пуле потоков, не блокируя бота)
+                    profiling = user_id in self.profile_next
+                    self.profile_next.discard(user_id)
+                    answer, profile_name = await self.workers.answer(self._answer, question, course_id, profiling,
+                                                                     ticket=ticket)
+                    if profile_name:
+                        await message.reply(f"🔬 Профиль сохранен: {profile_name}")
 
                     if not answer or "К сожалению, я не нашел информации" in answer:
                         await message.reply(
@@ -239,17 +291,14 @@ class CourseBot:
                             "Вы можете продолжать задавать вопросы по этому курсу.",
                             reply_markup=keyboard
                         )
-                        # Сохраняем состояние для продолжения диалога
-                        self.user_states[user_id] = {
-                            'waiting_for_question': True,
-                            'course_id': course_id
-                        }
+                        # Продлеваем состояние для продолжения диалога
+                        await state.set_state(QuestionStates.waiting_for_question)
                         return
 
                     # Формируем полный ответ с улучшенным форматированием
                     full_response = (
                         f"📚 <b>Результаты поиска по курсу</b>\n"
-                        f"<i>{course.title}</i>\n\n"
+                        f"<i>{course['title']}</i>\n\n"
                         f"❓ <b>Ваш вопрос:</b>\n{question}\n\n"
                         f"🔍 <b>Найденная информация:</b>\n{answer}\n\n"
                         "💡 Вы можете продолжать задавать вопросы по этому курсу\n"
@@ -266,10 +315,7 @@ class CourseBot:
                     logger.info(f"Answered question for user {message.from_user.id} about course {course_id}")
 
                     # Оставляем пользователя в режиме ожидания следующего вопроса
-                    self.user_states[user_id] = {
-                        'waiting_for_question': True,
-                        'course_id': course_id
-                    }
+                    await state.set_state(QuestionStates.waiting_for_question)
 
                 except Exception as e:
                     logger.error(f"Error processing question: {str(e)}", exc_info=True)
@@ -278,9 +324,12 @@ class CourseBot:
                         "Вы можете попробовать задать вопрос еще раз или завершить диалог.",
                         reply_markup=keyboard
                     )
+            finally:
+                if ticket is not None:
+                    self.workers.release(ticket)
+                self.workers.end_question(user_id)
 
         except Exception as e:
-            user_id = message.from_user.id
             logger.error(f"Error processing question: {e}", exc_info=True)
             await message.reply(
                 "❌ Произошла ошибка при обработке вашего вопроса. "
@@ -289,19 +338,47 @@ class CourseBot:
                     [InlineKeyboardButton(text="✅ Завершить диалог", callback_data="end_dialog")]
                 ])
             )
-            if user_id:
-                self.user_states.pop(user_id, None)
+            await state.clear()
+
+    async def inline_query_handler(self, inline_query: types.InlineQuery, state: FSMContext):
+        """Обработчик inline-запросов: фрагменты материалов текущего курса без обращения к GigaChat"""
+        try:
+            course_id = (await state.get_data()).get('course_id')
+            if not course_id:
+                await inline_query.answer(
+                    [], cache_time=0, is_personal=True,
+                    button=InlineQueryResultsButton(text="📚 Сначала выберите курс", start_parameter="ask")
+                )
+                return
+
+            query = inline_query.query.strip()
+            if len(query) < MIN_QUERY_LENGTH:
+                await inline_query.answer([], cache_time=0, is_personal=True)
+                return
+
+            results = await self.inline.lookup(course_id, query)
+            if results is None:
+                # Не уложились в бюджет: Telegram повторит запрос, а результат уже будет в кеше
+                await inline_query.answer([], cache_time=0, is_personal=True)
+                return
+            await inline_query.answer(results, cache_time=30, is_personal=True)
+        except Exception as e:
+            logger.error(f"Error in inline query handler: {e}", exc_info=True)
+
+    def _answer(self, question, course_id, profiling=False):
+        """Ответ на вопрос (выполняется в потоке пула); возвращает (ответ, имя файла профиля)"""
+        with profile('bot_question', enabled=profiling, meta={'course_id': course_id}) as profiled:
+            answer = answer_question(question, self.vector_db_path, course_id=course_id)
+        return answer, profiled.get('profile')
 
-    async def after_question_callback_handler(self, callback: types.CallbackQuery):
+    async def after_question_callback_handler(self, callback: types.CallbackQuery, state: FSMContext):
         """Обработчик действий после получения ответа на вопрос"""
         try:
             action = callback.data
-            user_id = callback.from_user.id
 
             if action == "end_dialog":
                 # Очищаем состояние пользователя и завершаем диалог
-                if user_id in self.user_states:
-                    self.user_states.pop(user_id)
+                await state.clear()
                 await callback.message.edit_text(
                     "✅ Диалог завершен.\n"
                     "Используйте /ask чтобы начать новый диалог с выбором курса."
@@ -313,6 +390,7 @@ class CourseBot:
             logger.error(f"Error in after question callback handler: {e}")
             await callback.answer("❌ Произошла ошибка")
 
+    @timed('telegram_send')
     async def send_split_message(self, chat_id: int, text: str, parse_mode=None, reply_markup=None):
         """Отправка длинного сообщения с разбиением на части"""
         MAX_MESSAGE_LENGTH = 3000
@@ -344,22 +422,15 @@ class CourseBot:
                 parts.append(text[:split_point])
                 text = text[split_point:].lstrip()
 
-            for i, part in enumerate(parts, 1):
-                if i == len(parts):  # Last part
+            # Части ответа уходят подряд, без пауз: темп задают лимиты очереди отправки
+            async with self.outbox.batch(chat_id):
+                for i, part in enumerate(parts, 1):
                     await self.bot.send_message(
                         chat_id=chat_id,
                         text=part,
                         parse_mode=parse_mode,
-                        reply_markup=reply_markup
+                        reply_markup=reply_markup if i == len(parts) else None
                     )
-                else:
-                    await self.bot.send_message(
-                        chat_id=chat_id,
-                        text=part,
-                        parse_mode=parse_mode
-                    )
-                if i < len(parts):
-                    await asyncio.sleep(0.5)
 
         except Exception as e:
             logger.error(f"Error in send_split_message: {str(e)}")
@@ -376,31 +447,41 @@ class CourseBot:
         except Exception as e:
             logger.error(f"Error starting bot: {e}")
             raise
-
-    async def ask_course_callback_handler(self, callback: types.CallbackQuery):
+        finally:
+            await self.close()
+
+    async def feed_raw_update(self, update: dict):
+        """Обработка обновления, полученного не через polling (например, вебхуком)"""
+        await self.dp.feed_raw_update(self.bot, update)
+
+    async def close(self):
+        """Освобождение ресурсов бота: пул потоков, соединения с БД, хранилище состояний, HTTP-сессия"""
+        self.workers.shutdown()
+        self.inline.shutdown()
+        await self.database.close()
+        await self.dp.storage.close()
+        await self.bot.session.close()
+
+    async def ask_course_callback_handler(self, callback: types.CallbackQuery, state: FSMContext):
         """Обработчик выбора курса для вопроса"""
         try:
             course_id = int(callback.data.split('_')[2])  # Используем индекс 2, так как формат 'ask_course_ID'
-            user_id = callback.from_user.id
 
-            with self.app.app_context():
-                course = Course.query.get(course_id)
-                if not course:
-                    await callback.answer("❌ Курс не найден")
-                    return
+            course = await self.catalog.course(course_id)
+            if not course:
+                await callback.answer("❌ Курс не найден")
+                return
 
-                # Сохраняем выбранный курс для пользователя
-                self.user_states[user_id] = {
-                    'waiting_for_question': True,
-                    'course_id': course_id
-                }
+            # Сохраняем выбранный курс для пользователя
+            await state.set_state(QuestionStates.waiting_for_question)
+            await state.set_data({'course_id': course_id})
 
-                await callback.message.edit_text(
-                    f"📝 Вы выбрали курс: {course.title}\n\n"
-                    "Теперь отправьте ваш вопрос в чат.\n"
-                    "Вы можете задавать вопросы непрерывно, пока не нажмете кнопку «Завершить диалог»"
-                )
-                await callback.answer()
+            await callback.message.edit_text(
+                f"📝 Вы выбрали курс: {course['title']}\n\n"
+                "Теперь отправьте ваш вопрос в чат.\n"
+                "Вы можете задавать вопросы непрерывно, пока не нажмете кнопку «Завершить диалог»"
+            )
+            await callback.answer()
 
         except Exception as e:
             logger.error(f"Error in ask course callback handler: {e}")
@@ -0,0 +1,98 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from app.bot.database import BotDatabase, UserAccess
+
+logger = logging.getLogger(__name__)
+
+# Как часто сверяться со счетчиками версий в БД: столько секунд изменения из веб-интерфейса могут быть не видны
+CHECK_SECONDS = float(os.environ.get('BOT_CATALOG_CHECK_SECONDS', '5'))
+MAX_CACHED_USERS = 10000
+KEYBOARD_PREFIXES = ('ask_course_', 'course_')
+
+
+def build_keyboard(courses: List[Dict], prefix: str) -> Optional[InlineKeyboardMarkup]:
+    if not courses:
+        return None
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [InlineKeyboardButton(text=f"📘 {course['title']}", callback_data=f"{prefix}{course['id']}")]
+        for course in courses
+    ])
+
+
+class CourseCatalog:
+    """
+    In-process cache of the course list, course details, prebuilt course
+    keyboards and per-user course access.
+
+    The web app bumps the 'courses' / 'access' counters in cache_versions
+    whenever courses or access grants change. The catalog compares them
+    with the versions it was built from at most every check_interval
+    seconds (one small read) and reloads only what changed, so commands
+    and callbacks normally never touch the DB.
+    """
+
+    def __init__(self, database: BotDatabase, check_interval: float = CHECK_SECONDS):
+        self.database = database
+        self.check_interval = check_interval
+        self.versions: Dict[str, int] = {}
+        self.checked_at = 0.0
+        self.courses: List[Dict] = []
+        self.by_id: Dict[int, Dict] = {}
+        self.keyboards: Dict[str, Optional[InlineKeyboardMarkup]] = {}
+        self.access_cache: "OrderedDict[str, UserAccess]" = OrderedDict()
+        self.loaded = False
+        self.lock = asyncio.Lock()
+
+    async def refresh(self, force: bool = False) -> None:
+        """Reload the parts whose version counter changed since the last check"""
+        if not force and self.loaded and time.monotonic() - self.checked_at < self.check_interval:
+            return
+        async with self.lock:
+            # Пока ждали замок, каталог мог обновить другой обработчик
+            if not force and self.loaded and time.monotonic() - self.checked_at < self.check_interval:
+                return
+            versions = await self.database.versions()
+            if not self.loaded or versions.get('courses') != self.versions.get('courses'):
+                courses = await self.database.courses()
+                self.courses = courses
+                self.by_id = {course['id']: course for course in courses}
+                self.keyboards = {prefix: build_keyboard(courses, prefix) for prefix in KEYBOARD_PREFIXES}
+                logger.info(f"Course catalog loaded: {len(courses)} courses (version {versions.get('courses', 0)})")
+            if self.loaded and (versions.get('access') != self.versions.get('access')
+                                or versions.get('courses') != self.versions.get('courses')):
+                self.access_cache.clear()
+            self.versions = versions
+            self.checked_at = time.monotonic()
+            self.loaded = True
+
+    async def titles(self) -> List[Tuple[int, str]]:
+        await self.refresh()
+        return [(course['id'], course['title']) for course in self.courses]
+
+    async def course(self, course_id: int) -> Optional[Dict]:
+        await self.refresh()
+        return self.by_id.get(course_id)
+
+    async def keyboard(self, prefix: str) -> Optional[InlineKeyboardMarkup]:
+        """Prebuilt course selection keyboard ('ask_course_' or 'course_'); None when there are no courses"""
+        await self.refresh()
+        return self.keyboards.get(prefix)
+
+    async def access(self, telegram_id) -> UserAccess:
+        await self.refresh()
+        key = str(telegram_id)
+        access = self.access_cache.get(key)
+        if access is None:
+            access = await self.database.access(key)
+            self.access_cache[key] = access
+            if len(self.access_cache) > MAX_CACHED_USERS:
+                self.access_cache.popitem(last=False)
+        self.access_cache.move_to_end(key)
+        return access
@@ -0,0 +1,148 @@
+import os
+import logging
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import select
+from sqlalchemy.engine import URL, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+
+from app import db
+from app.models import Course, Material, MaterialFile, User, CacheVersion, course_users
+
+logger = logging.getLogger(__name__)
+
+# Отдельный пул соединений бота; по умолчанию та же БД, что у веб-приложения (DATABASE_URL)
+DATABASE_URL = os.environ.get('BOT_DATABASE_URL')
+POOL_SIZE = int(os.environ.get('BOT_DB_POOL_SIZE', '5'))
+MAX_OVERFLOW = int(os.environ.get('BOT_DB_MAX_OVERFLOW', '5'))
+
+# Синхронный драйвер -> асинхронный для того же диалекта
+ASYNC_DRIVERS = {'postgresql': 'asyncpg', 'sqlite': 'aiosqlite'}
+
+
+class UserAccess(NamedTuple):
+    is_admin: bool
+    course_ids: FrozenSet[int]  # Курсы, созданные пользователем или выданные ему
+
+    def allows(self, course_id: int) -> bool:
+        return self.is_admin or course_id in self.course_ids
+
+
+NO_ACCESS = UserAccess(False, frozenset())
+
+
+def async_url(url) -> URL:
+    """postgresql:// -> postgresql+asyncpg://, sqlite:// -> sqlite+aiosqlite:// (other drivers are kept)"""
+    url = make_url(str(url).replace('postgres://', 'postgresql://', 1) if isinstance(url, str) else url)
+    backend = url.get_backend_name()
+    driver = ASYNC_DRIVERS.get(backend)
+    if driver and url.get_driver_name() != driver:
+        url = url.set(drivername=f'{backend}+{driver}')
+    return url
+
+
+class BotDatabase:
+    """
+    Async read access to the web app's database for the bot.
+
+    Reuses the Flask-SQLAlchemy models (their tables and columns) with an
+    AsyncSession on its own connection pool (asyncpg for PostgreSQL,
+    aiosqlite for SQLite), so course, material and user lookups are awaited
+    on the event loop instead of occupying a worker thread. Results are
+    plain dicts/tuples, never ORM objects.
+    """
+
+    def __init__(self, url, pool_size: int = POOL_SIZE, max_overflow: int = MAX_OVERFLOW):
+        url = async_url(url)
+        options = {'pool_pre_ping': True, 'pool_recycle': 300}
+        if url.get_backend_name() != 'sqlite':
+            options.update(pool_size=pool_size, max_overflow=max_overflow)
+        try:
+            self.engine: AsyncEngine = create_async_engine(url, **options)
+        except ImportError as e:
+            raise RuntimeError(f"Bot database {url.drivername} requires the {url.get_driver_name()} package: {e}")
+        self.sessions = async_sessionmaker(self.engine, expire_on_commit=False)
+        logger.info(f"Bot database: {url.render_as_string(hide_password=True)}")
+
+    @classmethod
+    def from_app(cls, app, url: Optional[str] = DATABASE_URL) -> 'BotDatabase':
+        """Same database as the Flask app (its resolved engine URL) unless BOT_DATABASE_URL is set"""
+        if not url:
+            with app.app_context():
+                url = db.engine.url
+        return cls(url)
+
+    async def versions(self) -> Dict[str, int]:
+        async with self.sessions() as session:
+            rows = await session.execute(select(CacheVersion.name, CacheVersion.version))
+            return {name: version for name, version in rows}
+
+    async def courses(self) -> List[Dict]:
+        async with self.sessions() as session:
+            rows = await session.execute(
+                select(Course.id, Course.title, Course.description).order_by(Course.id)
+            )
+            return [{'id': id_, 'title': title, 'description': description} for id_, title, description in rows]
+
+    async def course(self, course_id: int) -> Optional[Dict]:
+        async with self.sessions() as session:
+            row = (await session.execute(
+                select(Course.id, Course.title, Course.description).where(Course.id == course_id)
+            )).first()
+            if row is None:
+                return None
+            return {'id': row.id, 'title': row.title, 'description': row.description}
+
+    async def materials(self, course_id: int) -> Tuple[Optional[str], List[Tuple[str, List[str]]]]:
+        """(course title, [(material title, [file names])]); (None, []) for an unknown course"""
+        async with self.sessions() as session:
+            title = await session.scalar(select(Course.title).where(Course.id == course_id))
+            if title is None:
+                return None, []
+            materials = (await session.execute(
+                select(Material.id, Material.title).where(Material.course_id == course_id).order_by(Material.id)
+            )).all()
+            files: Dict[int, List[str]] = {material_id: [] for material_id, _ in materials}
+            if files:
+                rows = await session.execute(
+                    select(MaterialFile.material_id, MaterialFile.filename)
+                    .where(MaterialFile.material_id.in_(list(files)))
+                    .order_by(MaterialFile.id)
+                )
+                for material_id, filename in rows:
+                    files[material_id].append(filename)
+            return title, [(material_title, files[material_id]) for material_id, material_title in materials]
+
+    async def course_files(self, course_id: int) -> Dict[str, str]:
+        """content_hash -> file name for the indexed files of a course (the scope of a course search)"""
+        async with self.sessions() as session:
+            rows = await session.execute(
+                select(MaterialFile.content_hash, MaterialFile.filename)
+                .join(Material, MaterialFile.material_id == Material.id)
+                .where(Material.course_id == course_id, MaterialFile.content_hash.isnot(None))
+            )
+            return {content_hash: filename for content_hash, filename in rows}
+
+    async def user(self, telegram_id) -> Optional[Dict]:
+        async with self.sessions() as session:
+            row = (await session.execute(
+                select(User.id, User.username, User.is_admin).where(User.telegram_id == str(telegram_id))
+            )).first()
+            if row is None:
+                return None
+            return {'id': row.id, 'username': row.username, 'is_admin': bool(row.is_admin)}
+
+    async def access(self, telegram_id) -> UserAccess:
+        """Admin flag and ids of the courses a Telegram user may use (granted or authored)"""
+        user = await self.user(telegram_id)
+        if user is None:
+            return NO_ACCESS
+        async with self.sessions() as session:
+            granted = await session.scalars(
+                select(course_users.c.course_id).where(course_users.c.user_id == user['id'])
+            )
+            authored = await session.scalars(select(Course.id).where(Course.user_id == user['id']))
+            return UserAccess(user['is_admin'], frozenset(granted.all()) | frozenset(authored.all()))
+
+    async def close(self) -> None:
+        await self.engine.dispose()
@@ -0,0 +1,149 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from aiogram.types import InlineQueryResultArticle, InputTextMessageContent
+
+from app.bot.database import BotDatabase
+from app.services.timing import span, record
+from app.services.vector_db import get_vector_db
+
+logger = logging.getLogger(__name__)
+
+# Inline-запрос должен успеть ответить, пока пользователь печатает
+BUDGET_MS = float(os.environ.get('BOT_INLINE_BUDGET_MS', '400'))
+MAX_RESULTS = int(os.environ.get('BOT_INLINE_RESULTS', '5'))
+CACHE_SECONDS = float(os.environ.get('BOT_INLINE_CACHE_SECONDS', '300'))
+CACHE_SIZE = 2048
+SCOPE_SECONDS = 60  # Как долго помнить список файлов курса
+MAX_PENDING = 8  # Поисков в работе; при наборе текста лишние запросы не ставятся в очередь
+MIN_QUERY_LENGTH = 3
+SNIPPET_LENGTH = 200
+MESSAGE_LENGTH = 4000
+
+
+def normalize_query(query: str) -> str:
+    return ' '.join(query.lower().split())
+
+
+def _location(entry: Dict) -> str:
+    for key, label in (('page', 'стр.'), ('paragraph', 'абз.')):
+        if key in entry:
+            start, end = entry[key], entry.get(f'{key}_end', entry[key])
+            return f"{label} {start}" if start == end else f"{label} {start}–{end}"
+    return ''
+
+
+def build_article(doc: Dict, files: Dict[str, str]) -> InlineQueryResultArticle:
+    """Inline result for a retrieved chunk, titled with the course file it came from"""
+    # Почти одинаковые чанки хранятся один раз: берем копию, которая принадлежит файлу этого курса
+    entries = [doc] + list(doc.get('aliases', []))
+    entry = next((item for item in entries if item.get('content_hash') in files), doc)
+    filename = files.get(entry.get('content_hash'), 'Материал курса')
+    location = _location(entry)
+    title = f"{filename}, {location}" if location else filename
+    text = doc.get('text', '')
+    key = f"{entry.get('content_hash')}:{entry.get('chunk_index')}:{doc.get('id')}"
+    return InlineQueryResultArticle(
+        id=hashlib.sha1(key.encode('utf-8')).hexdigest(),
+        title=title,
+        description=' '.join(text.split())[:SNIPPET_LENGTH],
+        input_message_content=InputTextMessageContent(
+            message_text=f"📎 {title}\n\n{text}"[:MESSAGE_LENGTH]
+        )
+    )
+
+
+class InlineSearch:
+    """
+    Retrieval-only lookups for inline queries (no reranking, no GigaChat).
+
+    A query is embedded (through the query embedding cache) and matched
+    with FAISS among the chunks of the user's course, on a small dedicated
+    thread pool so inline lookups never wait behind full questions. Results
+    are cached per (course, normalized query). A lookup that does not
+    finish within budget_ms returns None; the search keeps running and its
+    result lands in the cache for the next keystroke.
+    """
+
+    def __init__(self, database: BotDatabase, vector_db_path: str, budget_ms: float = BUDGET_MS,
+                 top_k: int = MAX_RESULTS):
+        self.database = database
+        self.vector_db_path = vector_db_path
+        self.budget = budget_ms / 1000
+        self.top_k = top_k
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='bot-inline')
+        self.results: "OrderedDict[Tuple[int, str], Tuple[float, List]]" = OrderedDict()
+        self.pending: Dict[Tuple[int, str], asyncio.Future] = {}
+        self.scopes: Dict[int, Tuple[float, Dict[str, str]]] = {}
+        self.stats = {'hits': 0, 'misses': 0, 'timeouts': 0, 'skipped': 0}
+
+    async def _files(self, course_id: int) -> Dict[str, str]:
+        cached = self.scopes.get(course_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        files = await self.database.course_files(course_id)
+        self.scopes[course_id] = (time.monotonic() + SCOPE_SECONDS, files)
+        return files
+
+    def _search(self, query: str, files: Dict[str, str]) -> List[InlineQueryResultArticle]:
+        """Runs in the inline thread pool"""
+        with span('inline_search'):
+            vector_db = get_vector_db(self.vector_db_path)
+            with vector_db.reading():
+                selected = vector_db.select(files)
+                docs = vector_db.search(query, top_k=self.top_k, selected=selected)
+        return [build_article(doc, files) for doc in docs]
+
+    def _store(self, key, future: asyncio.Future) -> None:
+        self.pending.pop(key, None)
+        if future.cancelled() or future.exception() is not None:
+            if not future.cancelled():
+                logger.error(f"Inline search failed: {future.exception()}")
+            return
+        self.results[key] = (time.monotonic() + CACHE_SECONDS, future.result())
+        self.results.move_to_end(key)
+        while len(self.results) > CACHE_SIZE:
+            self.results.popitem(last=False)
+
+    async def lookup(self, course_id: int, query: str) -> Optional[List[InlineQueryResultArticle]]:
+        """Results for the query within the latency budget; None when they are not ready in time"""
+        start = time.perf_counter()
+        key = (course_id, normalize_query(query))
+        cached = self.results.get(key)
+        if cached is not None and cached[0] > time.monotonic():
+            self.results.move_to_end(key)
+            self.stats['hits'] += 1
+            return cached[1]
+        self.stats['misses'] += 1
+
+        future = self.pending.get(key)
+        if future is None:
+            if len(self.pending) >= MAX_PENDING:
+                self.stats['skipped'] += 1
+                return None
+            files = await self._files(course_id)
+            if not files:
+                return []
+            loop = asyncio.get_running_loop()
+            future = loop.run_in_executor(self.executor, self._search, key[1], files)
+            self.pending[key] = future
+            future.add_done_callback(lambda done: self._store(key, done))
+
+        remaining = self.budget - (time.perf_counter() - start)
+        try:
+            # shield: по таймауту поиск не отменяется, а дописывает результат в кеш
+            return await asyncio.wait_for(asyncio.shield(future), max(remaining, 0.001))
+        except asyncio.TimeoutError:
+            self.stats['timeouts'] += 1
+            return None
+        finally:
+            record('inline_lookup', (time.perf_counter() - start) * 1000)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,183 @@
+import os
+import time
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+
+from app.services.metrics import Histogram
+from app.services.timing import record
+
+logger = logging.getLogger(__name__)
+
+# Лимиты Bot API: ~30 сообщений в секунду на бота, ~1 в секунду в личный чат, 20 в минуту в группу
+GLOBAL_RATE = float(os.environ.get('TELEGRAM_GLOBAL_RATE', '25'))
+CHAT_RATE = float(os.environ.get('TELEGRAM_CHAT_RATE', '1'))
+CHAT_BURST = int(os.environ.get('TELEGRAM_CHAT_BURST', '3'))  # Столько частей длинного ответа уходит сразу
+GROUP_RATE = 20 / 60
+MAX_RETRIES = int(os.environ.get('TELEGRAM_MAX_RETRIES', '3'))
+MAX_CHAT_BUCKETS = 10000  # Дальше простаивающие чаты забываются
+
+_batch_chat: ContextVar[Optional[int]] = ContextVar('telegram_batch_chat', default=None)
+
+
+class TokenBucket:
+    """Token bucket on the event loop clock; the lock queues waiters in FIFO order"""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def delay(self) -> float:
+        """Seconds until a token is available (0 if one is available now)"""
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    async def take(self) -> None:
+        """Wait for and consume a token; the caller is expected to hold the lock"""
+        while True:
+            wait = self.delay()
+            if wait <= 0:
+                self.tokens -= 1
+                return
+            await asyncio.sleep(wait)
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            await self.take()
+
+    def pause(self, seconds: float) -> None:
+        """Stop handing out tokens for the given time (Telegram's retry_after)"""
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    def idle(self) -> bool:
+        return not self.lock.locked() and self.delay() == 0 and self.tokens >= self.capacity
+
+
+class OutboundQueue(BaseRequestMiddleware):
+    """
+    Schedules all outgoing Bot API calls addressed to a chat.
+
+    Installed as a request middleware on the bot session, so every
+    send_message/edit_text/reply waits for a token from its chat's bucket
+    and then from the global bucket. Calls to one chat go out in FIFO order.
+    A 429 (TelegramRetryAfter) pauses the chat for retry_after seconds and
+    the call is retried. batch() keeps the parts of a long answer together:
+    nothing else is sent to the chat until the batch is done.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST, max_retries: int = MAX_RETRIES):
+        self.global_bucket = TokenBucket(global_rate, global_rate)
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.chats: Dict[int, TokenBucket] = {}
+        self.depth = 0  # Вызовов, ожидающих отправки
+        self.sent = 0
+        self.retries = 0
+        self.latency = Histogram('telegram_outbound_seconds',
+                                 'Outbound Telegram calls: time queued and time in the Bot API', 'phase')
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self.chats.get(chat_id)
+        if bucket is None:
+            if len(self.chats) >= MAX_CHAT_BUCKETS:
+                for key in [key for key, value in self.chats.items() if value.idle()]:
+                    del self.chats[key]
+            if chat_id < 0:
+                bucket = TokenBucket(GROUP_RATE, 1)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self.chats[chat_id] = bucket
+        return bucket
+
+    async def __call__(self, make_request, bot, method):
+        chat_id = getattr(method, 'chat_id', None)
+        if not isinstance(chat_id, int):
+            # Ответы на callback/inline-запросы и служебные вызовы не ограничиваются лимитами сообщений
+            return await make_request(bot, method)
+        return await self.send(chat_id, lambda: make_request(bot, method))
+
+    async def send(self, chat_id: int, call):
+        """Run call() once the chat and global limits allow it, retrying on flood control"""
+        bucket = self._bucket(chat_id)
+        in_batch = _batch_chat.get() == chat_id
+        queued = time.perf_counter()
+        waiting = True
+        self.depth += 1
+        try:
+            if not in_batch:
+                await bucket.lock.acquire()
+            try:
+                for attempt in range(self.max_retries + 1):
+                    await bucket.take()
+                    await self.global_bucket.acquire()
+                    if waiting:
+                        waiting = False
+                        self.depth -= 1
+                        waited = time.perf_counter() - queued
+                        self.latency.observe('queue', waited)
+                        record('telegram_queue', waited * 1000)
+                    start = time.perf_counter()
+                    try:
+                        result = await call()
+                    except TelegramRetryAfter as e:
+                        self.retries += 1
+                        if attempt == self.max_retries:
+                            raise
+                        logger.warning(f"Flood control for chat {chat_id}: retry in {e.retry_after}s")
+                        bucket.pause(e.retry_after)
+                        continue
+                    self.latency.observe('send', time.perf_counter() - start)
+                    self.sent += 1
+                    return result
+            finally:
+                if not in_batch:
+                    bucket.lock.release()
+        finally:
+            if waiting:
+                self.depth -= 1
+
+    @asynccontextmanager
+    async def batch(self, chat_id: int):
+        """Send several messages to a chat back to back, without other messages in between"""
+        bucket = self._bucket(chat_id)
+        if _batch_chat.get() == chat_id:
+            yield
+            return
+        async with bucket.lock:
+            token = _batch_chat.set(chat_id)
+            try:
+                yield
+            finally:
+                _batch_chat.reset(token)
+
+    def render(self) -> List[str]:
+        lines = [
+            '# HELP telegram_outbound_queue_depth Outbound Telegram calls waiting for a send slot',
+            '# TYPE telegram_outbound_queue_depth gauge',
+            f'telegram_outbound_queue_depth {self.depth}',
+            '# HELP telegram_outbound_sent_total Outbound Telegram calls sent',
+            '# TYPE telegram_outbound_sent_total counter',
+            f'telegram_outbound_sent_total {self.sent}',
+            '# HELP telegram_outbound_retry_after_total Calls rejected by Telegram flood control',
+            '# TYPE telegram_outbound_retry_after_total counter',
+            f'telegram_outbound_retry_after_total {self.retries}',
+        ]
+        return lines + self.latency.render()
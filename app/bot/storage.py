@@ -0,0 +1,302 @@
+import os
+import json
+import time
+import asyncio
+import sqlite3
+import logging
+import threading
+from collections import OrderedDict
+from datetime import timedelta
+from typing import Any, Dict, List, Optional
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, StateType, StorageKey
+
+logger = logging.getLogger(__name__)
+
+# Хранилище состояний диалогов бота: sqlite (по умолчанию), redis или local (замена Redis в памяти процесса)
+FSM_STORAGE = os.environ.get('BOT_FSM_STORAGE', 'sqlite')
+FSM_DB_PATH = os.environ.get('BOT_FSM_DB', os.path.join(os.getcwd(), 'app', 'data', 'bot_fsm.sqlite3'))
+FSM_REDIS_URL = os.environ.get('BOT_FSM_REDIS_URL', 'redis://localhost:6379/0')
+FSM_TTL_SECONDS = int(os.environ.get('BOT_FSM_TTL', str(24 * 3600)))  # Неактивный диалог забывается через сутки
+FSM_FLUSH_SECONDS = float(os.environ.get('BOT_FSM_FLUSH_SECONDS', '1.0'))
+FSM_MAX_CACHED = 10000  # Записей в памяти, остальные читаются с диска по требованию
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+def _key(key: StorageKey) -> str:
+    return f"{key.bot_id}:{key.chat_id}:{key.user_id}:{key.thread_id or ''}:{key.destiny}"
+
+
+class SQLiteStorage(BaseStorage):
+    """
+    aiogram FSM storage persisted in SQLite.
+
+    Records are served from a bounded LRU cache. Changes only mark a record
+    dirty; a background task writes all dirty records in one transaction
+    every flush_interval seconds, so a burst of dialog updates costs a single
+    write. Records idle for longer than ttl read as empty and are purged
+    from disk and memory. Disk I/O runs in a worker thread.
+    """
+
+    def __init__(self, path: str = FSM_DB_PATH, ttl: int = FSM_TTL_SECONDS,
+                 flush_interval: float = FSM_FLUSH_SECONDS, max_cached: int = FSM_MAX_CACHED):
+        self.path = path
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.max_cached = max_cached
+        self._cache: "OrderedDict[str, List[Any]]" = OrderedDict()  # key -> [state, data, updated_at]
+        self._dirty = set()
+        self._db_lock = threading.Lock()
+        self._flusher: Optional[asyncio.Task] = None
+        self._last_purge = time.time()
+
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._db_lock:
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute(
+                'CREATE TABLE IF NOT EXISTS fsm_records ('
+                'key TEXT PRIMARY KEY, state TEXT, data TEXT, updated_at REAL NOT NULL)'
+            )
+            self._conn.execute('CREATE INDEX IF NOT EXISTS fsm_records_updated ON fsm_records (updated_at)')
+            self._conn.commit()
+
+    # --- Диск ---
+
+    def _read(self, key: str) -> Optional[List[Any]]:
+        with self._db_lock:
+            row = self._conn.execute(
+                'SELECT state, data, updated_at FROM fsm_records WHERE key = ?', (key,)
+            ).fetchone()
+        if row is None or time.time() - row[2] > self.ttl:
+            return None
+        return [row[0], json.loads(row[1]) if row[1] else {}, row[2]]
+
+    def _write(self, upserts, deletes) -> None:
+        with self._db_lock:
+            with self._conn:
+                if upserts:
+                    self._conn.executemany(
+                        'INSERT INTO fsm_records (key, state, data, updated_at) VALUES (?, ?, ?, ?) '
+                        'ON CONFLICT(key) DO UPDATE SET state = excluded.state, data = excluded.data, '
+                        'updated_at = excluded.updated_at',
+                        upserts
+                    )
+                if deletes:
+                    self._conn.executemany('DELETE FROM fsm_records WHERE key = ?', [(key,) for key in deletes])
+
+    def _delete_expired(self, cutoff: float) -> int:
+        with self._db_lock:
+            with self._conn:
+                return self._conn.execute('DELETE FROM fsm_records WHERE updated_at < ?', (cutoff,)).rowcount
+
+    # --- Кеш ---
+
+    async def _record(self, key: StorageKey) -> List[Any]:
+        name = _key(key)
+        record = self._cache.get(name)
+        if record is not None and time.time() - record[2] > self.ttl:
+            record[0], record[1] = None, {}
+        if record is None:
+            loaded = await asyncio.to_thread(self._read, name)
+            # Пока шло чтение, запись могла появиться в кеше - она новее
+            record = self._cache.setdefault(name, loaded or [None, {}, time.time()])
+        self._cache.move_to_end(name)
+        return record
+
+    def _touch(self, key: StorageKey, record: List[Any]) -> None:
+        record[2] = time.time()
+        self._dirty.add(_key(key))
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+        self._evict()
+
+    def _evict(self) -> None:
+        # Грязные записи не вытесняются до сброса на диск
+        for name in list(self._cache):
+            if len(self._cache) <= self.max_cached:
+                break
+            if name not in self._dirty:
+                del self._cache[name]
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+                if time.time() - self._last_purge > min(self.ttl, 600):
+                    await self.purge()
+            except Exception as e:
+                logger.error(f"FSM storage flush failed: {str(e)}")
+
+    async def flush(self) -> int:
+        """Write all dirty records in one transaction; returns the number of written records"""
+        if not self._dirty:
+            return 0
+        dirty, self._dirty = self._dirty, set()
+        upserts, deletes = [], []
+        for name in dirty:
+            record = self._cache.get(name)
+            if record is None or (record[0] is None and not record[1]):
+                deletes.append(name)
+            else:
+                upserts.append((name, record[0], json.dumps(record[1], ensure_ascii=False), record[2]))
+        try:
+            await asyncio.to_thread(self._write, upserts, deletes)
+        except Exception:
+            self._dirty |= dirty  # Повторим при следующем сбросе
+            raise
+        self._evict()
+        return len(dirty)
+
+    async def purge(self) -> int:
+        """Forget dialogs idle for longer than ttl"""
+        self._last_purge = time.time()
+        cutoff = self._last_purge - self.ttl
+        for name, record in list(self._cache.items()):
+            if record[2] < cutoff and name not in self._dirty:
+                del self._cache[name]
+        removed = await asyncio.to_thread(self._delete_expired, cutoff)
+        if removed:
+            logger.info(f"Expired {removed} idle bot dialogs")
+        return removed
+
+    # --- Интерфейс BaseStorage ---
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        record = await self._record(key)
+        record[0] = _state_name(state)
+        self._touch(key, record)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return (await self._record(key))[0]
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        record = await self._record(key)
+        record[1] = dict(data)
+        self._touch(key, record)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return dict((await self._record(key))[1])
+
+    async def close(self) -> None:
+        if self._flusher is not None:
+            self._flusher.cancel()
+            self._flusher = None
+        if self._conn is None:
+            return
+        try:
+            await self.flush()
+        except Exception as e:
+            logger.error(f"FSM storage final flush failed: {str(e)}")
+        with self._db_lock:
+            self._conn.close()
+            self._conn = None
+
+
+class LocalRedis:
+    """
+    In-process stand-in for a Redis server (GET/SET with expiry/DELETE).
+
+    Lets the Redis-backed storage run in development and tests without a
+    server; state is lost on restart like with any in-memory store.
+    """
+
+    SWEEP_EVERY = 1000
+
+    def __init__(self):
+        self._values: Dict[str, Any] = {}  # key -> (value, expires_at or None)
+        self._writes = 0
+
+    async def get(self, name: str):
+        item = self._values.get(name)
+        if item is None:
+            return None
+        value, expires_at = item
+        if expires_at is not None and expires_at <= time.time():
+            del self._values[name]
+            return None
+        return value
+
+    async def set(self, name: str, value, ex=None):
+        if isinstance(ex, timedelta):
+            ex = ex.total_seconds()
+        self._values[name] = (value, time.time() + ex if ex else None)
+        self._writes += 1
+        if self._writes % self.SWEEP_EVERY == 0:
+            now = time.time()
+            for key, (_, expires_at) in list(self._values.items()):
+                if expires_at is not None and expires_at <= now:
+                    del self._values[key]
+        return True
+
+    async def delete(self, *names: str) -> int:
+        return sum(1 for name in names if self._values.pop(name, None) is not None)
+
+    async def aclose(self, close_connection_pool: bool = True) -> None:
+        pass
+
+
+class RedisStorage(BaseStorage):
+    """
+    aiogram FSM storage on a Redis-compatible client (redis.asyncio.Redis or LocalRedis).
+
+    Every write refreshes the record's TTL, so idle dialogs expire on the
+    server side and memory stays bounded.
+    """
+
+    def __init__(self, client, ttl: int = FSM_TTL_SECONDS, prefix: str = 'fsm'):
+        self.client = client
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def _name(self, key: StorageKey, part: str) -> str:
+        return f"{self.prefix}:{_key(key)}:{part}"
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        name = self._name(key, 'state')
+        state = _state_name(state)
+        if state is None:
+            await self.client.delete(name)
+        else:
+            await self.client.set(name, state, ex=self.ttl)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        value = await self.client.get(self._name(key, 'state'))
+        return value.decode('utf-8') if isinstance(value, bytes) else value
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        name = self._name(key, 'data')
+        if not data:
+            await self.client.delete(name)
+        else:
+            await self.client.set(name, json.dumps(data, ensure_ascii=False), ex=self.ttl)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self.client.get(self._name(key, 'data'))
+        if value is None:
+            return {}
+        return json.loads(value.decode('utf-8') if isinstance(value, bytes) else value)
+
+    async def close(self) -> None:
+        await self.client.aclose()
+
+
+def create_storage(backend: str = FSM_STORAGE) -> BaseStorage:
+    """FSM storage selected by BOT_FSM_STORAGE (sqlite, redis or local)"""
+    if backend == 'redis':
+        try:
+            from redis.asyncio import Redis
+        except ImportError:
+            raise RuntimeError("BOT_FSM_STORAGE=redis requires the redis package")
+        logger.info(f"Bot dialog state stored in Redis ({FSM_REDIS_URL})")
+        return RedisStorage(Redis.from_url(FSM_REDIS_URL))
+    if backend == 'local':
+        logger.info("Bot dialog state stored in the local Redis stand-in")
+        return RedisStorage(LocalRedis())
+    logger.info(f"Bot dialog state stored in SQLite ({FSM_DB_PATH})")
+    return SQLiteStorage()
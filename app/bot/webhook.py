@@ -0,0 +1,265 @@
+import os
+import json
+import queue
+import signal
+import asyncio
+import secrets
+import ipaddress
+import logging
+import multiprocessing
+from typing import Any, Dict, List, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_HOST = os.environ.get('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.environ.get('WEBHOOK_PORT', '8443'))
+WEBHOOK_PATH = os.environ.get('WEBHOOK_PATH', '/telegram/webhook')
+WEBHOOK_URL = os.environ.get('WEBHOOK_URL')  # Публичный адрес, который регистрируется в Telegram
+WEBHOOK_SECRET = os.environ.get('WEBHOOK_SECRET')  # Не задан - генерируется при регистрации вебхука
+# Явное разрешение принимать запросы без секрета на внешнем адресе (например, за прокси с собственной проверкой)
+WEBHOOK_ALLOW_INSECURE = os.environ.get('WEBHOOK_ALLOW_INSECURE', '0') == '1'
+WEBHOOK_WORKERS = int(os.environ.get('WEBHOOK_WORKERS', str(min(4, os.cpu_count() or 1))))
+WEBHOOK_QUEUE_SIZE = 1000  # Обновлений в очереди одного обработчика, дальше Telegram получает 503 и повторит
+SHUTDOWN_TIMEOUT = float(os.environ.get('WEBHOOK_SHUTDOWN_TIMEOUT', '30'))
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+WATCHDOG_SECONDS = 5
+
+
+def is_loopback(host: str) -> bool:
+    """Whether the server only listens on the local machine"""
+    if host == 'localhost':
+        return True
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return False
+
+
+def update_chat_id(update: Dict[str, Any]) -> int:
+    """Chat (or, for inline queries, user) an update belongs to; used to shard updates"""
+    for key, value in update.items():
+        if key == 'update_id' or not isinstance(value, dict):
+            continue
+        chat = value.get('chat') or (value.get('message') or {}).get('chat')
+        if chat and 'id' in chat:
+            return int(chat['id'])
+        sender = value.get('from') or value.get('user')
+        if sender and 'id' in sender:
+            return int(sender['id'])
+    return 0
+
+
+def shard_for(update: Dict[str, Any], workers: int) -> int:
+    return update_chat_id(update) % workers
+
+
+# --- Обработчик (отдельный процесс) ----------------------------------------
+
+async def _consume(course_bot, updates) -> None:
+    """
+    Feed updates from the queue into the bot.
+
+    Updates of different chats are processed concurrently; a per-chat lock
+    (FIFO) keeps updates of one chat in arrival order. A None sentinel stops
+    the loop after in-flight updates have finished.
+    """
+    loop = asyncio.get_running_loop()
+    chat_locks: Dict[int, asyncio.Lock] = {}
+    pending: Dict[int, int] = {}  # Обновлений чата в работе - замок удаляется, когда их не осталось
+    in_flight = set()
+
+    async def handle(update):
+        chat_id = update_chat_id(update)
+        lock = chat_locks.setdefault(chat_id, asyncio.Lock())
+        pending[chat_id] = pending.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                await course_bot.feed_raw_update(update)
+        except Exception as e:
+            logger.error(f"Error handling update {update.get('update_id')}: {e}", exc_info=True)
+        finally:
+            pending[chat_id] -= 1
+            if not pending[chat_id]:
+                del pending[chat_id]
+                del chat_locks[chat_id]
+
+    while True:
+        update = await loop.run_in_executor(None, updates.get)
+        if update is None:
+            break
+        task = asyncio.create_task(handle(update))
+        in_flight.add(task)
+        task.add_done_callback(in_flight.discard)
+
+    if in_flight:
+        logger.info(f"Waiting for {len(in_flight)} updates in progress")
+        await asyncio.gather(*in_flight, return_exceptions=True)
+    await course_bot.close()
+
+
+def run_worker(index: int, updates) -> None:
+    """Entry point of a worker process: its own Flask app, CourseBot and event loop"""
+    # Ctrl+C приходит всей группе процессов - останавливаемся только по сигналу от главного процесса
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    logging.basicConfig(level=logging.INFO,
+                        format=f'%(asctime)s - worker{index} - %(name)s - %(levelname)s - %(message)s')
+
+    from app import create_app
+    from app.bot.bot import CourseBot
+    from app.services.metrics import start_metrics_server
+
+    metrics_port = int(os.environ.get('BOT_METRICS_PORT', '9102'))
+    if metrics_port:
+        start_metrics_server(metrics_port + index)
+
+    course_bot = CourseBot(create_app())
+    logger.info(f"Webhook worker {index} started (pid {os.getpid()})")
+    asyncio.run(_consume(course_bot, updates))
+    logger.info(f"Webhook worker {index} stopped")
+
+
+# --- Главный процесс: HTTP-сервер и распределение обновлений ----------------
+
+class WebhookServer:
+    """
+    aiohttp webhook endpoint that shards updates across worker processes.
+
+    Each update goes to worker chat_id % workers, so all updates of a chat
+    are handled by one process in order. Requests without the configured
+    secret token are rejected; a full worker queue answers 503 so Telegram
+    redelivers the update later. Without a secret the server only starts on a
+    loopback address or with allow_insecure (WEBHOOK_ALLOW_INSECURE=1).
+    """
+
+    def __init__(self, workers: int = WEBHOOK_WORKERS, secret: Optional[str] = WEBHOOK_SECRET,
+                 path: str = WEBHOOK_PATH, allow_insecure: bool = WEBHOOK_ALLOW_INSECURE):
+        self.workers = max(1, workers)
+        self.secret = secret
+        self.allow_insecure = allow_insecure
+        self.path = path
+        self.context = multiprocessing.get_context('spawn')
+        self.queues = [self.context.Queue(maxsize=WEBHOOK_QUEUE_SIZE) for _ in range(self.workers)]
+        self.processes: List[Optional[multiprocessing.Process]] = [None] * self.workers
+        self.stats = {'received': 0, 'rejected': 0, 'overloaded': 0}
+
+    def _spawn(self, index: int) -> None:
+        process = self.context.Process(target=run_worker, args=(index, self.queues[index]),
+                                       name=f'webhook-worker-{index}', daemon=False)
+        process.start()
+        self.processes[index] = process
+
+    async def _watchdog(self) -> None:
+        while True:
+            await asyncio.sleep(WATCHDOG_SECONDS)
+            for index, process in enumerate(self.processes):
+                if process is not None and not process.is_alive():
+                    logger.error(f"Webhook worker {index} exited with code {process.exitcode}, restarting")
+                    self._spawn(index)
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and request.headers.get(SECRET_HEADER) != self.secret:
+            self.stats['rejected'] += 1
+            return web.Response(status=401)
+        try:
+            update = await request.json(loads=json.loads)
+        except ValueError:
+            return web.Response(status=400)
+        if not isinstance(update, dict):
+            return web.Response(status=400)
+
+        try:
+            self.queues[shard_for(update, self.workers)].put_nowait(update)
+        except queue.Full:
+            self.stats['overloaded'] += 1
+            return web.Response(status=503)
+        self.stats['received'] += 1
+        return web.Response(status=200)
+
+    def _ensure_secret(self) -> None:
+        """A public webhook must check the secret token; generate one when WEBHOOK_SECRET is not set"""
+        if not self.secret:
+            self.secret = secrets.token_urlsafe(32)
+            logger.warning("WEBHOOK_SECRET is not set, registering the webhook with a generated secret token")
+
+    async def set_webhook(self, url: str) -> None:
+        """Register the public URL (with the secret token) in Telegram"""
+        from aiogram import Bot
+
+        self._ensure_secret()
+
+        bot = Bot(token=os.environ['TELEGRAM_BOT_TOKEN'])
+        try:
+            await bot.set_webhook(url=url.rstrip('/') + self.path, secret_token=self.secret)
+            logger.info(f"Webhook registered: {url.rstrip('/') + self.path}")
+        finally:
+            await bot.session.close()
+
+    def _stop_workers(self) -> None:
+        for updates in self.queues:
+            updates.put(None)
+        for index, process in enumerate(self.processes):
+            if process is None:
+                continue
+            process.join(SHUTDOWN_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"Webhook worker {index} did not stop in {SHUTDOWN_TIMEOUT}s, terminating")
+                process.terminate()
+                process.join()
+
+    async def serve(self, host: str = WEBHOOK_HOST, port: int = WEBHOOK_PORT,
+                    public_url: Optional[str] = WEBHOOK_URL) -> None:
+        """Run until SIGINT/SIGTERM, then drain the workers and exit"""
+        if public_url:
+            # Секрет нужен до того, как сервер начнет принимать запросы
+            self._ensure_secret()
+        elif not self.secret:
+            if not (self.allow_insecure or is_loopback(host)):
+                raise RuntimeError(
+                    f"WEBHOOK_SECRET is not set: refusing to accept unauthenticated updates on {host}. "
+                    f"Set WEBHOOK_SECRET, bind to 127.0.0.1 or set WEBHOOK_ALLOW_INSECURE=1"
+                )
+            logger.warning(f"WEBHOOK_SECRET is not set: webhook requests on {host} are not authenticated")
+        for index in range(self.workers):
+            self._spawn(index)
+
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        runner = web.AppRunner(app, handle_signals=False)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        logger.info(f"Webhook server listening on {host}:{port}{self.path} with {self.workers} workers")
+
+        if public_url:
+            await self.set_webhook(public_url)
+
+        stop = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, stop.set)
+        watchdog = asyncio.create_task(self._watchdog())
+
+        await stop.wait()
+        logger.info("Shutting down webhook server...")
+        watchdog.cancel()
+        # Сначала перестаем принимать запросы, затем даем обработчикам доработать очередь
+        await runner.cleanup()
+        await loop.run_in_executor(None, self._stop_workers)
+        logger.info(f"Webhook server stopped: {self.stats}")
+
+
+def replay_updates(path: str, url: str, secret: Optional[str] = WEBHOOK_SECRET) -> Dict[int, int]:
+    """POST recorded updates (JSON lines) to a running webhook server; returns counts per status"""
+    import requests
+
+    headers = {SECRET_HEADER: secret} if secret else {}
+    statuses: Dict[int, int] = {}
+    with requests.Session() as session, open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            response = session.post(url, data=line.encode('utf-8'),
+                                    headers={'Content-Type': 'application/json', **headers}, timeout=30)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+    return statuses
@@ -0,0 +1,73 @@
+import os
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+from app.services.fair_queue import FairScheduler, Ticket
+
+logger = logging.getLogger(__name__)
+
+# Потоки для блокирующей работы (RAG-конвейер, запросы к БД) и общий лимит одновременных вопросов
+WORKER_THREADS = int(os.environ.get('BOT_WORKER_THREADS', '8'))
+MAX_CONCURRENT_QUESTIONS = int(os.environ.get('BOT_MAX_CONCURRENT_QUESTIONS', '8'))
+
+
+class WorkerPool:
+    """
+    Runs blocking bot work off the aiogram event loop.
+
+    Calls execute in a bounded thread pool inside a Flask app context, so
+    one slow question or DB round trip never stalls other chats. Questions
+    additionally take a slot from a fair scheduler (excess questions wait
+    in weighted fair order across users and courses, see
+    app.services.fair_queue) and at most one question per user is in flight.
+    """
+
+    def __init__(self, app, max_workers: int = WORKER_THREADS,
+                 max_questions: int = MAX_CONCURRENT_QUESTIONS, scheduler: FairScheduler = None):
+        self.app = app
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='bot-worker')
+        self.max_questions = max_questions
+        self.scheduler = scheduler or FairScheduler(max_questions)
+        self.active_users = set()
+
+    def _call(self, func, args, kwargs):
+        with self.app.app_context():
+            return func(*args, **kwargs)
+
+    async def run(self, func, *args, **kwargs):
+        """Run a blocking function in the pool (with an app context) and await its result"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, partial(self._call, func, args, kwargs))
+
+    def begin_question(self, user_id: int) -> bool:
+        """Reserve the user's single in-flight question; False if one is already being processed"""
+        if user_id in self.active_users:
+            return False
+        self.active_users.add(user_id)
+        return True
+
+    def end_question(self, user_id: int) -> None:
+        self.active_users.discard(user_id)
+
+    def saturated(self) -> bool:
+        """All question slots are taken - a new question will wait in the queue"""
+        return self.scheduler.saturated()
+
+    def admit(self, user_id=None, course_id=None) -> Ticket:
+        """Queue a user's question; raises QuestionRejected when the user exceeds their limits"""
+        return self.scheduler.submit(user_id, course_id)
+
+    def release(self, ticket: Ticket) -> None:
+        self.scheduler.release(ticket)
+
+    async def answer(self, func, *args, ticket: Ticket = None, **kwargs):
+        """Run a question through the pool once its turn in the scheduler comes"""
+        if ticket is None:
+            ticket = self.scheduler.submit()
+        async with self.scheduler.held(ticket):
+            return await self.run(func, *args, **kwargs)
+
+    def shutdown(self) -> None:
+        self.executor.shutdown(wait=False, cancel_futures=True)
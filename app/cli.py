@@ -1,3 +1,4 @@
+import os
 import click
 from flask.cli import with_appcontext
 from app.models import User
@@ -31,3 +32,178 @@ def create_admin(username, email, password):
     except Exception as e:
         logger.error(f"Ошибка при создании администратора: {str(e)}")
         db.session.rollback()
+
+@click.command('rebuild-index')
+@click.option('--workers', type=int, default=None, help='Число процессов извлечения текста (по умолчанию - число CPU)')
+@click.option('--batch-size', type=int, default=256, show_default=True, help='Размер пакета чанков для модели эмбеддингов')
+@click.option('--checkpoint-every', type=int, default=50, show_default=True, help='Сохранять прогресс каждые N файлов')
+@click.option('--fresh', is_flag=True, help='Начать заново, не продолжая прерванную перестройку')
+@with_appcontext
+def rebuild_index(workers, batch_size, checkpoint_every, fresh):
+    """Перестроить векторный индекс из всех файлов материалов"""
+    from app.services.ingestion import rebuild_index as run_rebuild
+
+    def report(stats):
+        rate = stats['files_done'] / stats['elapsed_s'] if stats['elapsed_s'] else 0
+        click.echo(
+            f"\r[{stats['generation']}] файлов {stats['files_done']}/{stats['files_total']}, "
+            f"чанков {stats['chunks']}, ошибок {stats['failed']}, {rate:.1f} файлов/с",
+            nl=False
+        )
+
+    try:
+        stats = run_rebuild(
+            os.path.join(os.getcwd(), 'app', 'data'),
+            workers=workers,
+            embed_batch=batch_size,
+            checkpoint_every=checkpoint_every,
+            fresh=fresh,
+            progress=report
+        )
+        click.echo()
+        click.echo(
+            f"Индекс перестроен: поколение {stats['generation']}, файлов {stats['files_done']} "
+            f"(продолжено с {stats['resumed_files']}), чанков {stats['chunks']}, "
+            f"ошибок {stats['failed']}, {stats['elapsed_s']:.1f} с"
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при перестроении индекса: {str(e)}")
+        raise click.ClickException(str(e))
+
+@click.command('import-course')
+@click.argument('course_id', type=int)
+@click.argument('source', type=click.Path(exists=True))
+@click.option('--workers', type=int, default=None, help='Число процессов извлечения текста (по умолчанию - число CPU)')
+@click.option('--batch-size', type=int, default=256, show_default=True, help='Размер пакета чанков для модели эмбеддингов')
+@with_appcontext
+def import_course(course_id, source, workers, batch_size):
+    """Импортировать каталог или zip-архив с материалами в курс"""
+    from app.models import Course
+    from app.services.ingestion import import_course as run_import
+
+    if not Course.query.get(course_id):
+        raise click.ClickException(f"Курс {course_id} не найден")
+
+    def report(stats):
+        elapsed = stats['elapsed_s'] or 1e-9
+        click.echo(
+            f"\rфайлов {stats['files_done']}/{stats['files_total']}, чанков {stats['chunks']}, "
+            f"ошибок {stats['failed']}, {stats['files_done'] / elapsed:.1f} файлов/с, "
+            f"{stats['chunks'] / elapsed:.1f} чанков/с",
+            nl=False
+        )
+
+    try:
+        result = run_import(
+            course_id,
+            source,
+            os.path.join(os.getcwd(), 'app', 'data'),
+            workers=workers,
+            embed_batch=batch_size,
+            progress=report
+        )
+    except Exception as e:
+        logger.error(f"Ошибка при импорте курса: {str(e)}")
+        raise click.ClickException(str(e))
+
+    click.echo()
+    click.echo(
+        f"Импортировано материалов: {result['materials']}, файлов: {result['files']} "
+        f"(проиндексировано {result['files_indexed']}, переиспользовано {result['files_reused']}), "
+        f"чанков: {result['chunks']} за {result['elapsed_s']:.1f} с "
+        f"({result['files_per_s']:.1f} файлов/с, {result['chunks_per_s']:.1f} чанков/с)"
+    )
+    if result['dedup']['chunks']:
+        click.echo(
+            f"Дубликаты: из {result['dedup']['chunks']} чанков хранится {result['dedup']['stored']} "
+            f"(-{1 - result['dedup']['stored'] / result['dedup']['chunks']:.1%})"
+        )
+    if result['failures']:
+        click.echo(f"Ошибки ({len(result['failures'])}):")
+        for name, reason in result['failures']:
+            click.echo(f"  {name}: {reason}")
+
+@click.command('index-stats')
+@click.option('--query', 'queries', multiple=True, help='Тестовый запрос для сравнения задержки поиска (можно несколько)')
+@click.option('--repeat', type=int, default=5, show_default=True, help='Сколько раз повторить каждый запрос')
+@click.option('--course-id', type=int, default=None, help='Также замерить поиск с фильтром по курсу')
+@click.option('--material-id', type=int, default=None, help='Также замерить поиск с фильтром по материалу')
+@with_appcontext
+def index_stats(queries, repeat, course_id, material_id):
+    """Показать размер векторного и лексического индексов и сравнить задержку поиска"""
+    import time
+    from app.services.vector_db import get_vector_db
+    from app.services.search_scope import resolve_scope
+
+    vector_db = get_vector_db(os.path.join(os.getcwd(), 'app', 'data'))
+    stats = vector_db.stats()
+    click.echo(
+        f"Векторный индекс: {stats['vector']['vectors']} векторов "
+        f"({stats['vector']['live_chunks']} активных, {stats['vector']['tombstones']} удаленных), "
+        f"~{stats['vector']['approx_bytes'] / 1024 / 1024:.1f} МБ"
+    )
+    click.echo(
+        f"Лексический индекс: {stats['lexical']['terms']} терминов, {stats['lexical']['postings']} записей, "
+        f"~{stats['lexical']['approx_bytes'] / 1024 / 1024:.1f} МБ, построение {stats['lexical']['build_ms']:.0f} мс"
+    )
+
+    selected = None
+    scope = resolve_scope(course_id, material_id)
+    if scope is not None:
+        start = time.perf_counter()
+        selected = vector_db.select(scope)
+        live = max(1, stats['vector']['live_chunks'])
+        click.echo(
+            f"Фильтр: {len(selected)} из {live} чанков (селективность {len(selected) / live:.2%}), "
+            f"построение {(time.perf_counter() - start) * 1000:.1f} мс"
+        )
+
+    modes = [('vector', vector_db.search, None), ('hybrid', vector_db.hybrid_search, None)]
+    if selected is not None:
+        modes += [('vector+filter', vector_db.search, selected), ('hybrid+filter', vector_db.hybrid_search, selected)]
+
+    for query in queries:
+        timings = {mode: [] for mode, _, _ in modes}
+        for _ in range(max(1, repeat)):
+            for mode, search, mode_selected in modes:
+                start = time.perf_counter()
+                search(query, top_k=3, selected=mode_selected)
+                timings[mode].append((time.perf_counter() - start) * 1000)
+        medians = ', '.join(
+            f"{mode} {sorted(values)[len(values) // 2]:.1f} мс" for mode, values in timings.items()
+        )
+        click.echo(f"'{query}' (медиана): {medians}")
+
+@click.command('dedup-report')
+@with_appcontext
+def dedup_report():
+    """Показать, насколько схлопывание почти одинаковых чанков уменьшило индекс по курсам"""
+    from app.models import Course, Material, MaterialFile
+    from app.services.vector_db import get_vector_db
+
+    vector_db = get_vector_db(os.path.join(os.getcwd(), 'app', 'data'))
+    for course in Course.query.order_by(Course.id).all():
+        hashes = [row.content_hash for row in db.session.query(MaterialFile.content_hash)
+                  .join(Material).filter(Material.course_id == course.id, MaterialFile.content_hash.isnot(None))]
+        report = vector_db.dedup_report(hashes)
+        if not report['chunks']:
+            continue
+        reduction = 1 - report['stored'] / report['chunks']
+        click.echo(
+            f"[{course.id}] {course.title}: чанков {report['chunks']}, хранится {report['stored']} "
+            f"(-{reduction:.1%})"
+        )
+    total = vector_db.stats()['dedup']
+    if total['chunks']:
+        click.echo(
+            f"Всего: чанков {total['chunks']}, хранится {total['stored']} "
+            f"(-{1 - total['stored'] / total['chunks']:.1%})"
+        )
+
+def register_commands(app):
+    """Регистрация CLI-команд приложения"""
+    app.cli.add_command(create_admin)
+    app.cli.add_command(rebuild_index)
+    app.cli.add_command(import_course)
+    app.cli.add_command(index_stats)
+    app.cli.add_command(dedup_report)
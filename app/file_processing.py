@@ -6,6 +6,17 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Версия извлечения текста: увеличивайте при изменении логики разбора PDF/DOCX,
+# чтобы сохраненные результаты извлечения были пересчитаны
+EXTRACTOR_VERSION = 1
+
+# Ограничения на размер документа: файлы больше считаются патологическими
+MAX_PDF_PAGES = int(os.environ.get('MAX_PDF_PAGES', 2000))
+MAX_DOCX_PARAGRAPHS = int(os.environ.get('MAX_DOCX_PARAGRAPHS', 100000))
+
+class ExtractionLimitError(Exception):
+    """Документ превышает допустимые ограничения на размер"""
+
 def process_file(file_path: str) -> List[Dict[str, Any]]:
     """
     Обработать файл и извлечь из него текст.
@@ -27,6 +38,8 @@ def process_file(file_path: str) -> List[Dict[str, Any]]:
             logger.error(f"Неподдерживаемый формат файла: {file_extension}")
             return []
 
+    except ExtractionLimitError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при обработке файла {file_path}: {str(e)}")
         return []
@@ -39,6 +52,8 @@ def process_pdf(file_path: str) -> List[Dict[str, Any]]:
             try:
                 pdf_reader = PyPDF2.PdfReader(file)
                 total_pages = len(pdf_reader.pages)
+                if total_pages > MAX_PDF_PAGES:
+                    raise ExtractionLimitError(f"PDF has {total_pages} pages, limit is {MAX_PDF_PAGES}")
                 logger.info(f"Начало обработки PDF файла, всего страниц: {total_pages}")
 
                 for page_num in range(total_pages):
@@ -57,10 +72,14 @@ def process_pdf(file_path: str) -> List[Dict[str, Any]]:
                         continue
 
                 return documents
+            except ExtractionLimitError:
+                raise
             except Exception as pdf_error:
                 logger.error(f"Ошибка при чтении PDF файла: {str(pdf_error)}")
                 return []
 
+    except ExtractionLimitError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при открытии PDF файла {file_path}: {str(e)}")
         return []
@@ -70,6 +89,8 @@ def process_docx(file_path: str) -> List[Dict[str, Any]]:
     try:
         documents = []
         doc = Document(file_path)
+        if len(doc.paragraphs) > MAX_DOCX_PARAGRAPHS:
+            raise ExtractionLimitError(f"DOCX has {len(doc.paragraphs)} paragraphs, limit is {MAX_DOCX_PARAGRAPHS}")
         logger.info(f"Начало обработки DOCX файла, всего параграфов: {len(doc.paragraphs)}")
 
         for para_num, paragraph in enumerate(doc.paragraphs):
@@ -87,6 +108,8 @@ def process_docx(file_path: str) -> List[Dict[str, Any]]:
                 continue
 
         return documents
+    except ExtractionLimitError:
+        raise
     except Exception as e:
         logger.error(f"Ошибка при обработке DOCX файла {file_path}: {str(e)}")
         return []
\ No newline at end of file
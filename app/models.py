@@ -1,4 +1,5 @@
-from app import db
+from app import db, login_manager
+from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import json
@@ -21,7 +22,7 @@ course_users = db.Table('course_users',
     db.Column('granted_by', db.Integer, db.ForeignKey('users.id', ondelete='SET NULL'))
 )
 
-class User(db.Model):
+class User(UserMixin, db.Model):
     __tablename__ = 'users'
 
     id = db.Column(db.Integer, primary_key=True)
@@ -101,6 +102,10 @@ class User(db.Model):
     def __repr__(self):
         return f'<User {self.username}>'
 
+@login_manager.user_loader
+def load_user(user_id):
+    return db.session.get(User, int(user_id))
+
 class Course(db.Model):
     __tablename__ = 'courses'
 
@@ -143,17 +148,69 @@ class MaterialFile(db.Model):
     filename = db.Column(db.String(255), nullable=False)
     file_path = db.Column(db.String(512), nullable=False)
     file_type = db.Column(db.String(10), nullable=False)
+    content_hash = db.Column(db.String(64), index=True)  # sha256 содержимого, ключ в хранилище файлов
+    file_size = db.Column(db.Integer)
     uploaded_at = db.Column(db.DateTime, default=datetime.utcnow)
     is_indexed = db.Column(db.Boolean, default=False)
+    index_status = db.Column(db.String(20), default='pending')  # pending / indexed / failed
+    index_error = db.Column(db.Text)  # Причина ошибки индексации
+    # Статистика последней индексации файла
+    page_count = db.Column(db.Integer)
+    chunk_count = db.Column(db.Integer)
+    extract_ms = db.Column(db.Integer)
+    embed_ms = db.Column(db.Integer)
+    vectors_added = db.Column(db.Integer)
+    index_failures = db.Column(db.Integer, default=0)
+    indexed_at = db.Column(db.DateTime)
     vector = db.Column(db.Text)
 
     def set_vector(self, vector_data):
         self.vector = json.dumps(vector_data)
         self.is_indexed = True
 
+    def mark_indexed(self):
+        self.is_indexed = True
+        self.index_status = 'indexed'
+        self.index_error = None
+
+    def mark_failed(self, reason):
+        self.is_indexed = False
+        self.index_status = 'failed'
+        self.index_error = reason
+        self.index_failures = (self.index_failures or 0) + 1
+
+    def record_ingestion(self, stats):
+        """Сохраняет статистику индексации (pages, chunks, extract_ms, embed_ms, vectors_added)"""
+        if not stats:
+            return
+        self.page_count = stats.get('pages', self.page_count)
+        self.chunk_count = stats.get('chunks', self.chunk_count)
+        self.extract_ms = stats.get('extract_ms', self.extract_ms)
+        self.embed_ms = stats.get('embed_ms', self.embed_ms)
+        self.vectors_added = stats.get('vectors_added', self.vectors_added)
+        self.indexed_at = datetime.utcnow()
+
     def get_vector(self):
         return json.loads(self.vector) if self.vector else None
 
+class CacheVersion(db.Model):
+    """Счетчик версии данных, которые другие процессы (бот) держат в кеше"""
+    __tablename__ = 'cache_versions'
+
+    name = db.Column(db.String(32), primary_key=True)
+    version = db.Column(db.Integer, nullable=False, default=0)
+
+    @classmethod
+    def bump(cls, name):
+        """Увеличивает версию в текущей транзакции (коммит - на вызывающей стороне)"""
+        updated = cls.query.filter_by(name=name).update({cls.version: cls.version + 1})
+        if not updated:
+            db.session.add(cls(name=name, version=1))
+
+    @classmethod
+    def current(cls):
+        return {row.name: row.version for row in cls.query.all()}
+
 class Notification(db.Model):
     __tablename__ = 'notifications'
 
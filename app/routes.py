@@ -1,9 +1,17 @@
 from flask import Blueprint, render_template, redirect, url_for, request, flash, jsonify, send_file, session
-from app.models import Course, Material, MaterialFile, User, Notification
+from flask_login import current_user
+from app.models import Course, Material, MaterialFile, User, Notification, CacheVersion
 from app import db
 from app.services.vector_search import VectorSearch
+from app.services.content_store import get_content_store
+from app.services.extraction_cache import get_extraction_cache
+from app.services.search_scope import parse_page_range
+from app.services.timing import collect_stages
+from app.services.profiler import profile, profile_requested
+from app.services.fair_queue import get_question_scheduler, QuestionRejected
 import logging
 import os
+import tempfile
 from werkzeug.utils import secure_filename
 from functools import wraps
 
@@ -25,9 +33,58 @@ def admin_required(f):
         return f(*args, **kwargs)
     return decorated_function
 
+def is_admin_user():
+    """Вошедший пользователь с правами администратора (флаг сессии для этого не годится)"""
+    return current_user.is_authenticated and current_user.is_admin
+
+def resolve_import_directory(directory):
+    """Реальный путь каталога импорта, если он лежит внутри IMPORT_ROOT, иначе None"""
+    if not IMPORT_ROOT or not directory:
+        return None
+    root = os.path.realpath(IMPORT_ROOT)
+    path = os.path.realpath(os.path.join(root, directory))
+    if os.path.commonpath([root, path]) != root or not os.path.isdir(path):
+        return None
+    return path
+
 # Путь к векторной базе данных
 VECTOR_DB_PATH = os.path.join(os.getcwd(), "app", "data")
 
+# Каталог на сервере, из которого разрешен импорт через веб-интерфейс (не задан - только zip-архивы)
+IMPORT_ROOT = os.environ.get('IMPORT_ROOT')
+# Импорт идет внутри запроса, поэтому его размер ограничен; большие курсы - через flask import-course
+WEB_IMPORT_MAX_FILES = int(os.environ.get('WEB_IMPORT_MAX_FILES', '200'))
+WEB_IMPORT_MAX_MB = int(os.environ.get('WEB_IMPORT_MAX_MB', '500'))
+# Время этапов в ответе /chat/ask для всех (нагрузочный тест); иначе - только администратору
+STAGE_TIMINGS_PUBLIC = os.environ.get('STAGE_TIMINGS_PUBLIC', '0') == '1'
+
+def count_other_copies(material_file, deleted_ids=()):
+    """Количество других записей, ссылающихся на то же содержимое файла"""
+    if not material_file.content_hash:
+        return 0
+    return MaterialFile.query.filter(
+        MaterialFile.content_hash == material_file.content_hash,
+        MaterialFile.id.notin_({material_file.id, *deleted_ids})
+    ).count()
+
+def remove_file_storage(material_file, deleted_ids=(), processor=None):
+    """Удаляет файл с диска и его чанки из индекса, если на содержимое больше никто не ссылается"""
+    if count_other_copies(material_file, deleted_ids):
+        return
+    legacy = not material_file.content_hash
+    if legacy or material_file.is_indexed:
+        from app.services.file_processor import FileProcessor
+        processor = processor or FileProcessor(vector_db_path=VECTOR_DB_PATH)
+        if legacy:
+            # Файл загружен до хранилища по хешу: его чанки адресуются путем файла
+            processor.remove_source(material_file.file_path)
+        else:
+            processor.remove_content(material_file.content_hash)
+    if material_file.content_hash:
+        get_extraction_cache().remove(material_file.content_hash)
+    if os.path.exists(material_file.file_path):
+        os.remove(material_file.file_path)
+
 @main.route('/')
 def index():
     """
@@ -86,10 +143,34 @@ def materials_management():
 @main.route('/files-management')
 @admin_required
 def files_management():
-    """Список всех файлов"""
+    """Список всех файлов со статистикой индексации и суммарной пропускной способностью"""
     try:
         files = MaterialFile.query.all()
-        return render_template('admin/files.html', files=files)
+
+        # Итоги по типам файлов: какие форматы дороже всего индексировать
+        totals = {}
+        for file in files:
+            for key in (file.file_type, 'all'):
+                total = totals.setdefault(key, {'files': 0, 'bytes': 0, 'pages': 0, 'chunks': 0, 'vectors': 0,
+                                                'extract_ms': 0, 'embed_ms': 0, 'failures': 0})
+                total['files'] += 1
+                total['bytes'] += file.file_size or 0
+                total['pages'] += file.page_count or 0
+                total['chunks'] += file.chunk_count or 0
+                total['vectors'] += file.vectors_added or 0
+                total['extract_ms'] += file.extract_ms or 0
+                total['embed_ms'] += file.embed_ms or 0
+                total['failures'] += file.index_failures or 0
+        for total in totals.values():
+            extract_s = total['extract_ms'] / 1000
+            embed_s = total['embed_ms'] / 1000
+            total['mb_per_s'] = total['bytes'] / 1024 / 1024 / extract_s if extract_s else None
+            total['pages_per_s'] = total['pages'] / extract_s if extract_s else None
+            total['chunks_per_s'] = total['chunks'] / embed_s if embed_s else None
+
+        # Самые дорогие файлы - первыми
+        files.sort(key=lambda f: (f.extract_ms or 0) + (f.embed_ms or 0), reverse=True)
+        return render_template('admin/files.html', files=files, totals=totals)
     except Exception as e:
         logger.error(f"Ошибка при загрузке списка файлов: {str(e)}")
         flash('Ошибка при загрузке списка файлов', 'error')
@@ -120,22 +201,60 @@ def chat_ask():
         # Инициализация поиска
         vector_search = VectorSearch()
 
-        # Поиск ответа
-        results = vector_search.search(question)
+        # Профилирование одного запроса по заголовку X-Profile или ?profile=1 (только администратор)
+        profiling = is_admin_user() and profile_requested(
+            request.headers.get('X-Profile') or request.args.get('profile')
+        )
+
+        # Вопросы ждут своей очереди к конвейеру (справедливо между пользователями и курсами)
+        scheduler = get_question_scheduler()
+        if current_user.is_authenticated:
+            tenant = f'user:{current_user.id}'
+        else:
+            tenant = f'ip:{request.remote_addr}'
+        try:
+            ticket = scheduler.submit(tenant, int(course_id))
+        except QuestionRejected as e:
+            response = jsonify({
+                'success': False,
+                'error': f'Слишком много вопросов. Попробуйте снова через {e.retry_after} с.',
+                'retry_after': e.retry_after
+            })
+            response.headers['Retry-After'] = str(e.retry_after)
+            return response, 429
+
+        # Поиск ответа только по материалам выбранного курса (и, если задано, материала и страниц)
+        try:
+            with profile('chat_ask', enabled=profiling, meta={'course_id': course_id}) as profiled, \
+                    collect_stages() as stages:
+                scheduler.wait(ticket)
+                results = vector_search.search(
+                    question,
+                    course_id=int(course_id),
+                    material_id=request.form.get('material_id', type=int),
+                    pages=parse_page_range(request.form.get('page_from'), request.form.get('page_to'))
+                )
+        finally:
+            scheduler.release(ticket)
 
         if not results:
-            return jsonify({
+            response = {
                 'success': True,
                 'answer': 'К сожалению, не удалось найти информацию по вашему вопросу в материалах курса.'
-            })
+            }
+        else:
+            # Форматируем ответ из результатов поиска
+            response = {
+                'success': True,
+                'answer': results[0].get('content', 'Информация не найдена')
+            }
 
-        # Форматируем ответ из результатов поиска
-        answer = results[0].get('content', 'Информация не найдена')
-
-        return jsonify({
-            'success': True,
-            'answer': answer
-        })
+        # Время этапов (поиск, переранжирование, GigaChat) - для нагрузочного тестирования
+        if request.headers.get('X-Stage-Timings') and (STAGE_TIMINGS_PUBLIC or is_admin_user()):
+            response['timings'] = {stage: round(ms, 1) for stage, ms in stages.items()}
+        if profiled.get('profile'):
+            response['profile'] = profiled['profile']
+        return jsonify(response)
 
     except Exception as e:
         logger.error(f"Ошибка при обработке вопроса: {str(e)}")
@@ -180,6 +299,7 @@ def edit_course(course_id):
 
         course.title = title
         course.description = description
+        CacheVersion.bump('courses')
         db.session.commit()
 
         flash('Курс успешно обновлен', 'success')
@@ -198,12 +318,16 @@ def delete_course_old(course_id):
         course = Course.query.get_or_404(course_id)
 
         # Удаляем все файлы курса физически
-        for material in course.materials:
-            for file in material.files:
-                if os.path.exists(file.file_path):
-                    os.remove(file.file_path)
+        course_files = [file for material in course.materials for file in material.files]
+        processor = None
+        if course_files:
+            from app.services.file_processor import FileProcessor
+            processor = FileProcessor(vector_db_path=VECTOR_DB_PATH)
+        for file in course_files:
+            remove_file_storage(file, deleted_ids=[f.id for f in course_files], processor=processor)
 
         db.session.delete(course)
+        CacheVersion.bump('courses')
         db.session.commit()
 
         flash('Курс успешно удален', 'success')
@@ -224,12 +348,16 @@ def delete_course_new(course_id):
         course = Course.query.get_or_404(course_id)
 
         # Удаляем все файлы курса физически
-        for material in course.materials:
-            for file in material.files:
-                if os.path.exists(file.file_path):
-                    os.remove(file.file_path)
+        course_files = [file for material in course.materials for file in material.files]
+        processor = None
+        if course_files:
+            from app.services.file_processor import FileProcessor
+            processor = FileProcessor(vector_db_path=VECTOR_DB_PATH)
+        for file in course_files:
+            remove_file_storage(file, deleted_ids=[f.id for f in course_files], processor=processor)
 
         db.session.delete(course)
+        CacheVersion.bump('courses')
         db.session.commit()
 
         flash('Курс успешно удален', 'success')
@@ -241,6 +369,69 @@ def delete_course_new(course_id):
         flash('Произошла ошибка при удалении курса', 'error')
         return redirect(url_for('main.courses_management'))
 
+@main.route('/courses-management/<int:course_id>/import', methods=['POST'])
+@admin_required
+def import_course(course_id):
+    """Массовый импорт материалов курса из zip-архива или каталога внутри IMPORT_ROOT"""
+    if not is_admin_user():
+        flash('Импорт материалов доступен только администратору', 'error')
+        return redirect(url_for('main.course', course_id=course_id))
+    try:
+        course = Course.query.get_or_404(course_id)
+        archive = request.files.get('archive')
+        directory = request.form.get('directory', '').strip()
+
+        from app.services.ingestion import import_course as run_import, import_size
+
+        def run_limited(source):
+            files, size = import_size(source)
+            if files > WEB_IMPORT_MAX_FILES or size > WEB_IMPORT_MAX_MB * 1024 * 1024:
+                flash(
+                    f'Слишком большой импорт для веб-интерфейса ({files} файлов, {size // (1024 * 1024)} МБ; '
+                    f'не более {WEB_IMPORT_MAX_FILES} файлов и {WEB_IMPORT_MAX_MB} МБ). '
+                    f'Используйте команду flask import-course {course.id} <путь>',
+                    'error'
+                )
+                return None
+            return run_import(course.id, source, VECTOR_DB_PATH)
+
+        if archive and archive.filename:
+            with tempfile.NamedTemporaryFile(suffix='.zip') as tmp:
+                archive.save(tmp)
+                tmp.flush()
+                result = run_limited(tmp.name)
+        elif directory:
+            path = resolve_import_directory(directory)
+            if path is None:
+                logger.warning(f"Отклонен импорт из каталога вне IMPORT_ROOT: {directory}")
+                flash('Каталог не найден или находится вне разрешенного каталога импорта', 'error')
+                return redirect(url_for('main.course', course_id=course_id))
+            result = run_limited(path)
+        else:
+            flash('Выберите zip-архив или укажите каталог на сервере', 'error')
+            return redirect(url_for('main.course', course_id=course_id))
+        if result is None:
+            return redirect(url_for('main.course', course_id=course_id))
+
+        flash(
+            f"Импортировано материалов: {result['materials']}, файлов: {result['files']}, "
+            f"чанков: {result['chunks']} за {result['elapsed_s']:.1f} с "
+            f"({result['files_per_s']:.1f} файлов/с, {result['chunks_per_s']:.1f} чанков/с)",
+            'success'
+        )
+        if result['failures']:
+            details = '; '.join(f"{name}: {reason}" for name, reason in result['failures'][:20])
+            more = len(result['failures']) - 20
+            flash(f"Не удалось обработать {len(result['failures'])} файлов: {details}"
+                  + (f" и еще {more}" if more > 0 else ''), 'warning')
+        return redirect(url_for('main.course', course_id=course_id))
+
+    except Exception as e:
+        logger.error(f"Ошибка при импорте курса: {str(e)}")
+        db.session.rollback()
+        flash('Произошла ошибка при импорте материалов', 'error')
+        return redirect(url_for('main.course', course_id=course_id))
+
 @main.route('/add_course', methods=['POST'])
 def add_course():
     """Добавление нового курса"""
@@ -258,6 +449,7 @@ def add_course():
             user_id=1  # Временно используем ID админа
         )
         db.session.add(new_course)
+        CacheVersion.bump('courses')
         db.session.commit()
 
         flash('Курс успешно создан', 'success')
@@ -325,36 +517,52 @@ def upload_file(material_id):
                 flash('Неподдерживаемый тип файла. Разрешены только PDF и DOCX', 'error')
                 return redirect(url_for('main.course', course_id=material.course_id))
 
-            # Создаем директорию для файлов материала
-            file_dir = os.path.join(os.getcwd(), 'app', 'uploads', str(material_id))
-            os.makedirs(file_dir, exist_ok=True)
-
-            # Сохраняем файл
-            file_path = os.path.join(file_dir, filename)
-            file.save(file_path)
+            # Сохраняем файл в контентно-адресуемое хранилище, вычисляя хеш на лету
+            content_hash, file_path, file_size = get_content_store().save_stream(file.stream, file_type)
 
             try:
+                # Если такой файл уже загружался и проиндексирован, переиспользуем его чанки и векторы
+                indexed_copy = MaterialFile.query.filter_by(content_hash=content_hash, is_indexed=True).first()
+
                 # Создаем запись в БД
                 material_file = MaterialFile(
                     material_id=material_id,
                     filename=filename,
                     file_path=file_path,
-                    file_type=file_type
+                    file_type=file_type,
+                    content_hash=content_hash,
+                    file_size=file_size
                 )
+                if indexed_copy:
+                    material_file.mark_indexed()
+                    # Извлечение и эмбеддинги не выполнялись - новых векторов нет
+                    material_file.record_ingestion({'pages': indexed_copy.page_count, 'chunks': indexed_copy.chunk_count,
+                                                    'extract_ms': 0, 'embed_ms': 0, 'vectors_added': 0})
                 db.session.add(material_file)
                 db.session.commit()
 
+                if indexed_copy:
+                    logger.info(f"Файл {filename} совпадает с уже проиндексированным ({content_hash}), индексация пропущена")
+                    flash('Файл успешно загружен и проиндексирован', 'success')
+                    return redirect(url_for('main.course', course_id=material.course_id))
+
                 # Создаем экземпляр FileProcessor для индексации
                 from app.services.file_processor import FileProcessor
                 processor = FileProcessor(vector_db_path=VECTOR_DB_PATH)
 
                 # Индексируем файл
-                if processor.process_file(file_path):
+                indexed = processor.process_file(file_path, content_hash=content_hash)
+                material_file.record_ingestion(processor.last_stats)
+                if indexed:
+                    material_file.mark_indexed()
+                    db.session.commit()
                     logger.info(f"Файл {filename} успешно проиндексирован")
                     flash('Файл успешно загружен и проиндексирован', 'success')
                 else:
-                    logger.warning(f"Ошибка при индексации файла {filename}")
-                    flash('Файл загружен, но возникла ошибка при индексации', 'warning')
+                    material_file.mark_failed(processor.last_error)
+                    db.session.commit()
+                    logger.warning(f"Ошибка при индексации файла {filename}: {processor.last_error}")
+                    flash(f'Файл загружен, но возникла ошибка при индексации: {processor.last_error}', 'warning')
 
             except Exception as e:
                 logger.error(f"Ошибка при обработке файла: {str(e)}")
@@ -374,7 +582,7 @@ def download_file(file_id):
     """Скачивание файла"""
     try:
         file = MaterialFile.query.get_or_404(file_id)
-        return send_file(file.file_path, as_attachment=True)
+        return send_file(file.file_path, as_attachment=True, download_name=file.filename)
     except Exception as e:
         logger.error(f"Ошибка при скачивании файла: {str(e)}")
         flash('Произошла ошибка при скачивании файла', 'error')
@@ -387,8 +595,7 @@ def delete_file(file_id):
         file = MaterialFile.query.get_or_404(file_id)
         course_id = file.material.course_id
 
-        if os.path.exists(file.file_path):
-            os.remove(file.file_path)
+        remove_file_storage(file)
 
         db.session.delete(file)
         db.session.commit()
@@ -402,6 +609,129 @@ def delete_file(file_id):
         flash('Произошла ошибка при удалении файла', 'error')
         return redirect(url_for('main.course', course_id=file.material.course_id))
 
+@main.route('/file/<int:file_id>/reindex', methods=['POST'])
+def reindex_file(file_id):
+    """Повторная индексация файла: пересчитываются только изменившиеся чанки"""
+    try:
+        file = MaterialFile.query.get_or_404(file_id)
+        course_id = file.material.course_id
+
+        from app.services.file_processor import FileProcessor
+        processor = FileProcessor(vector_db_path=VECTOR_DB_PATH)
+
+        # Старое содержимое можно менять на месте, только если на него не ссылаются другие записи
+        exclusive = count_other_copies(file) == 0
+
+        content_hash, file_path, file_size = file.content_hash, file.file_path, file.file_size
+        legacy = not content_hash
+        if legacy:
+            # Файлы, загруженные до появления хранилища по хешу, переносим в него;
+            # их старые чанки адресуются путем файла и удаляются до индексации новой версии
+            content_hash, file_path, file_size = get_content_store().save_file(file.file_path, file.file_type)
+            removed = processor.remove_source(file.file_path)
+
+        stats = processor.reindex_file(file_path, file.content_hash, content_hash, exclusive=exclusive)
+        file.record_ingestion(processor.last_stats)
+        if stats is None:
+            file.mark_failed(processor.last_error)
+            db.session.commit()
+            flash(f'Ошибка при переиндексации файла: {processor.last_error}', 'error')
+            return redirect(url_for('main.course', course_id=course_id))
+
+        if legacy:
+            stats['removed'] += removed
+            file.file_path, file.file_size = file_path, file_size
+        file.content_hash = content_hash
+        file.mark_indexed()
+        db.session.commit()
+
+        flash(f"Файл переиндексирован: переиспользовано {stats['reused']}, "
+              f"пересчитано {stats['recomputed']}, удалено {stats['removed']} чанков", 'success')
+        return redirect(url_for('main.course', course_id=course_id))
+
+    except Exception as e:
+        logger.error(f"Ошибка при переиндексации файла: {str(e)}")
+        db.session.rollback()
+        flash('Произошла ошибка при переиндексации файла', 'error')
+        return redirect(url_for('main.index'))
+
+@main.route('/file/<int:file_id>/replace', methods=['POST'])
+def replace_file(file_id):
+    """Замена файла новой версией с инкрементальной переиндексацией"""
+    try:
+        file = MaterialFile.query.get_or_404(file_id)
+        course_id = file.material.course_id
+
+        upload = request.files.get('file')
+        if not upload or upload.filename == '':
+            flash('Файл не выбран', 'error')
+            return redirect(url_for('main.course', course_id=course_id))
+
+        filename = secure_filename(upload.filename)
+        file_type = filename.rsplit('.', 1)[1].lower() if '.' in filename else ''
+        if file_type != file.file_type:
+            flash('Новая версия должна быть того же типа, что и исходный файл', 'error')
+            return redirect(url_for('main.course', course_id=course_id))
+
+        old_hash, old_path = file.content_hash, file.file_path
+        new_hash, new_path, new_size = get_content_store().save_stream(upload.stream, file_type)
+        if new_hash == old_hash:
+            flash('Загруженный файл не отличается от текущей версии', 'info')
+            return redirect(url_for('main.course', course_id=course_id))
+
+        # Старое содержимое можно менять на месте, только если на него не ссылаются другие записи
+        exclusive = count_other_copies(file) == 0
+
+        from app.services.file_processor import FileProcessor
+        processor = FileProcessor(vector_db_path=VECTOR_DB_PATH)
+
+        # Чанки файла, загруженного до хранилища по хешу, адресуются его путем
+        removed = processor.remove_source(old_path) if not old_hash else 0
+
+        if processor.vector_db.has_content(new_hash):
+            # Новая версия уже проиндексирована (загружалась ранее): извлечения и эмбеддингов не было
+            stats = {'reused': processor.vector_db.dedup_report([new_hash])['stored'], 'recomputed': 0, 'removed': 0}
+            ingestion = None
+            if exclusive and old_hash:
+                stats['removed'] = processor.remove_content(old_hash)
+        else:
+            stats = processor.reindex_file(new_path, old_hash, new_hash, exclusive=exclusive)
+            ingestion = processor.last_stats
+            if stats is None:
+                # Новая версия никуда не попала - ее копию в хранилище удаляем, если на нее никто не ссылается
+                if not MaterialFile.query.filter_by(content_hash=new_hash).count():
+                    get_content_store().remove(new_hash, file_type)
+                    get_extraction_cache().remove(new_hash)
+                file.mark_failed(processor.last_error)
+                db.session.commit()
+                flash(f'Ошибка при индексации новой версии файла: {processor.last_error}', 'error')
+                return redirect(url_for('main.course', course_id=course_id))
+
+        if not old_hash:
+            stats['removed'] += removed
+        file.filename = filename
+        file.file_path = new_path
+        file.content_hash = new_hash
+        file.file_size = new_size
+        file.mark_indexed()
+        file.record_ingestion(ingestion)
+        db.session.commit()
+
+        if exclusive and os.path.exists(old_path):
+            os.remove(old_path)
+            if old_hash:
+                get_extraction_cache().remove(old_hash)
+
+        flash(f"Файл заменен: переиспользовано {stats['reused']}, "
+              f"пересчитано {stats['recomputed']}, удалено {stats['removed']} чанков", 'success')
+        return redirect(url_for('main.course', course_id=course_id))
+
+    except Exception as e:
+        logger.error(f"Ошибка при замене файла: {str(e)}")
+        db.session.rollback()
+        flash('Произошла ошибка при замене файла', 'error')
+        return redirect(url_for('main.index'))
+
 # Маршруты управления пользователями
 @main.route('/users-management')
 @admin_required
@@ -441,11 +771,13 @@ def manage_user_courses(user_id):
 
             if action == 'grant':
                 if user.grant_course_access(course):
+                    CacheVersion.bump('access')
                     db.session.commit()
                     flash(f'Доступ к курсу "{course.title}" предоставлен', 'success')
                     logger.info(f"Access granted: user={user_id}, course={course_id}")
             elif action == 'revoke':
                 if user.revoke_course_access(course):
+                    CacheVersion.bump('access')
                     db.session.commit()
                     flash(f'Доступ к курсу "{course.title}" отозван', 'success')
                     logger.info(f"Access revoked: user={user_id}, course={course_id}")
@@ -0,0 +1,152 @@
+import re
+import logging
+from typing import List, Dict, Any, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_OVERLAP_TOKENS = 24  # Перекрытие соседних чанков
+MIN_CHUNK_TOKENS = 32  # Чанки короче этого размера объединяются с соседними
+
+# Метаданные позиции, которые переносятся из сегментов в чанки
+POSITION_KEYS = ('page', 'paragraph')
+
+_SENTENCE_BOUNDARY = re.compile(r'(?<=[.!?…;])\s+|\n+')
+
+
+def _split_sentences(text: str) -> List[str]:
+    """Split text into sentences, keeping non-empty parts only"""
+    return [part.strip() for part in _SENTENCE_BOUNDARY.split(text) if part and part.strip()]
+
+
+def _split_long_unit(text: str, tokens: int, max_tokens: int,
+                     count_tokens: Callable[[List[str]], List[int]]) -> List[tuple]:
+    """Split a sentence longer than max_tokens into word windows that fit the limit"""
+    words = text.split()
+    if len(words) <= 1:
+        # Одно "слово" длиннее лимита - модель всё равно обрежет его, оставляем как есть
+        return [(text, min(tokens, max_tokens))]
+
+    words_per_window = max(1, int(len(words) * max_tokens / tokens))
+    windows = [' '.join(words[i:i + words_per_window]) for i in range(0, len(words), words_per_window)]
+    result = []
+    for window, window_tokens in zip(windows, count_tokens(windows)):
+        if window_tokens > max_tokens:
+            result.extend(_split_long_unit(window, window_tokens, max_tokens, count_tokens))
+        else:
+            result.append((window, window_tokens))
+    return result
+
+
+def _build_units(segments: List[Dict[str, Any]], max_tokens: int,
+                 count_tokens: Callable[[List[str]], List[int]]) -> List[Dict[str, Any]]:
+    """Turn extracted segments (pages/paragraphs) into sentence units with token counts"""
+    units = []
+    for segment_idx, segment in enumerate(segments):
+        sentences = _split_sentences(segment.get('text', ''))
+        if not sentences:
+            continue
+        position = {key: segment[key] for key in POSITION_KEYS if key in segment}
+        for sentence, tokens in zip(sentences, count_tokens(sentences)):
+            parts = (_split_long_unit(sentence, tokens, max_tokens, count_tokens)
+                     if tokens > max_tokens else [(sentence, tokens)])
+            for part, part_tokens in parts:
+                units.append({
+                    'text': part,
+                    'tokens': part_tokens,
+                    'segment': segment_idx,
+                    **position
+                })
+    return units
+
+
+def _make_chunk(units: List[Dict[str, Any]], source: Optional[str]) -> Dict[str, Any]:
+    """Join sentence units into a chunk and record the covered positions"""
+    text = ''
+    previous_segment = None
+    for unit in units:
+        if previous_segment is None:
+            text = unit['text']
+        else:
+            separator = ' ' if unit['segment'] == previous_segment else '\n'
+            text += separator + unit['text']
+        previous_segment = unit['segment']
+
+    chunk = {
+        'text': text,
+        'token_count': sum(unit['tokens'] for unit in units)
+    }
+    for key in POSITION_KEYS:
+        values = [unit[key] for unit in units if key in unit]
+        if values:
+            chunk[key] = min(values)
+            chunk[f'{key}_end'] = max(values)
+    if source:
+        chunk['source'] = source
+    return chunk
+
+
+def chunk_segments(segments: List[Dict[str, Any]],
+                   source: Optional[str] = None,
+                   max_tokens: Optional[int] = None,
+                   overlap_tokens: int = DEFAULT_OVERLAP_TOKENS,
+                   min_tokens: int = MIN_CHUNK_TOKENS,
+                   count_tokens: Optional[Callable[[List[str]], List[int]]] = None) -> List[Dict[str, Any]]:
+    """
+    Split extracted segments into chunks sized to the embedding model's token limit.
+
+    Segments are dicts with 'text' and optional 'page' / 'paragraph' numbers, as
+    returned by app.file_processing.process_file. Sentences are packed greedily up to
+    max_tokens, consecutive chunks share up to overlap_tokens of trailing sentences,
+    and short segments (one-line DOCX paragraphs) are merged with their neighbours.
+    Each chunk keeps the page/paragraph range it covers ('page'..'page_end').
+    """
+    if count_tokens is None or max_tokens is None:
+        from app.services import embeddings
+        count_tokens = count_tokens or embeddings.count_tokens
+        max_tokens = max_tokens or embeddings.get_max_tokens()
+
+    overlap_tokens = max(0, min(overlap_tokens, max_tokens // 2))
+    units = _build_units(segments, max_tokens, count_tokens)
+
+    chunks = []
+    current = []
+    current_tokens = 0
+    fresh = 0  # Сколько единиц в текущем чанке не являются перекрытием
+    for unit in units:
+        if fresh and current_tokens + unit['tokens'] > max_tokens:
+            chunks.append(current)
+            # Переносим хвост предыдущего чанка для перекрытия контекста
+            overlap = []
+            overlap_size = 0
+            for previous in reversed(current):
+                if overlap_size + previous['tokens'] > overlap_tokens:
+                    break
+                overlap.insert(0, previous)
+                overlap_size += previous['tokens']
+            if overlap_size + unit['tokens'] > max_tokens:
+                overlap, overlap_size = [], 0
+            current, current_tokens, fresh = overlap, overlap_size, 0
+        current.append(unit)
+        current_tokens += unit['tokens']
+        fresh += 1
+
+    if fresh:
+        tail = current[len(current) - fresh:]
+        tail_tokens = sum(unit['tokens'] for unit in tail)
+        if chunks and tail_tokens < min_tokens:
+            # Короткий хвост: дописываем в предыдущий чанк, если он помещается
+            merged = chunks[-1] + tail
+            if sum(unit['tokens'] for unit in merged) <= max_tokens:
+                chunks[-1] = merged
+                current = []
+        if current:
+            chunks.append(current)
+
+    result = []
+    for idx, chunk_units in enumerate(chunks):
+        chunk = _make_chunk(chunk_units, source)
+        chunk['chunk_index'] = idx
+        result.append(chunk)
+
+    logger.info(f"Chunked {len(segments)} segments into {len(result)} chunks (max {max_tokens} tokens)")
+    return result
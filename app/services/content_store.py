@@ -0,0 +1,98 @@
+import os
+import hashlib
+import logging
+import tempfile
+from typing import Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+HASH_ALGORITHM = 'sha256'
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def hash_file(file_path: str) -> str:
+    """Compute the content hash of a file on disk"""
+    digest = hashlib.new(HASH_ALGORITHM)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(READ_CHUNK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class ContentStore:
+    """
+    Content-addressed storage for uploaded files.
+
+    Files are stored once under <root>/<hash[:2]>/<hash>.<ext>, so the same
+    document uploaded to several materials or courses shares one copy on disk
+    (and one set of chunks in the vector index, keyed by the same hash).
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.tmp_dir = os.path.join(root, 'tmp')
+        os.makedirs(self.tmp_dir, exist_ok=True)
+
+    def path_for(self, content_hash: str, file_type: str) -> str:
+        """Return the storage path of a blob"""
+        return os.path.join(self.root, content_hash[:2], f"{content_hash}.{file_type}")
+
+    def exists(self, content_hash: str, file_type: str) -> bool:
+        return os.path.exists(self.path_for(content_hash, file_type))
+
+    def save_stream(self, stream, file_type: str) -> Tuple[str, str, int]:
+        """
+        Store an uploaded file, hashing it while it is written.
+
+        Returns (content_hash, path, size). If a blob with the same hash is
+        already stored, the new copy is discarded and the existing path is returned.
+        """
+        digest = hashlib.new(HASH_ALGORITHM)
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=self.tmp_dir)
+        try:
+            with os.fdopen(fd, 'wb') as tmp_file:
+                for block in iter(lambda: stream.read(READ_CHUNK_SIZE), b''):
+                    digest.update(block)
+                    tmp_file.write(block)
+                    size += len(block)
+
+            content_hash = digest.hexdigest()
+            path = self.path_for(content_hash, file_type)
+            if os.path.exists(path):
+                os.remove(tmp_path)
+                logger.info(f"Duplicate upload detected, reusing blob {content_hash}")
+            else:
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+                logger.info(f"Stored new blob {content_hash} ({size} bytes)")
+            return content_hash, path, size
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+    def save_file(self, file_path: str, file_type: str) -> Tuple[str, str, int]:
+        """Store a file from the local filesystem (e.g. during bulk import)"""
+        with open(file_path, 'rb') as f:
+            return self.save_stream(f, file_type)
+
+    def remove(self, content_hash: str, file_type: str) -> bool:
+        """Delete a blob from storage"""
+        path = self.path_for(content_hash, file_type)
+        if os.path.exists(path):
+            os.remove(path)
+            logger.info(f"Removed blob {content_hash}")
+            return True
+        return False
+
+
+_store: Optional[ContentStore] = None
+
+
+def get_content_store() -> ContentStore:
+    """Return the content store under app/uploads/objects"""
+    global _store
+    if _store is None:
+        _store = ContentStore(os.path.join(os.getcwd(), 'app', 'uploads', 'objects'))
+    return _store
@@ -0,0 +1,139 @@
+import os
+import re
+import pickle
+import hashlib
+import logging
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NUM_PERMUTATIONS = 64
+LSH_BANDS = 8  # 8 полос по 8 строк: кандидаты находятся примерно от сходства 0.77
+SHINGLE_SIZE = 3  # Шинглы из трех слов
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', '0.85'))  # Оценка сходства Жаккара
+
+_MERSENNE_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.RandomState(20240501)  # Фиксированные перестановки: подписи сохраняются на диск
+_PERM_A = _rng.randint(1, (1 << 31) - 1, size=NUM_PERMUTATIONS).astype(np.uint64)
+_PERM_B = _rng.randint(0, (1 << 31) - 1, size=NUM_PERMUTATIONS).astype(np.uint64)
+
+_WORD_RE = re.compile(r'\w+', re.UNICODE)
+
+
+def _shingles(text: str) -> Set[str]:
+    words = _WORD_RE.findall(text.lower().replace('ё', 'е'))
+    if len(words) < SHINGLE_SIZE:
+        return {' '.join(words)} if words else set()
+    return {' '.join(words[i:i + SHINGLE_SIZE]) for i in range(len(words) - SHINGLE_SIZE + 1)}
+
+
+def minhash_signature(text: str) -> Optional[np.ndarray]:
+    """MinHash signature of the word shingles of a text (None for texts without words)"""
+    shingles = _shingles(text)
+    if not shingles:
+        return None
+    hashes = np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode(), digest_size=4).digest(), 'little') for s in shingles),
+        dtype=np.uint64, count=len(shingles)
+    ) % _MERSENNE_PRIME
+    permuted = (np.outer(hashes, _PERM_A) + _PERM_B) % _MERSENNE_PRIME
+    return permuted.min(axis=0).astype(np.uint32)
+
+
+def estimate_similarity(a: np.ndarray, b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of two signatures"""
+    return float(np.count_nonzero(a == b)) / len(a)
+
+
+class DuplicateIndex:
+    """
+    MinHash LSH index over the chunk positions of one VectorDB.
+
+    A chunk is a near-duplicate of a stored one when they share an LSH band and
+    their estimated Jaccard similarity reaches DEDUP_THRESHOLD.
+    """
+
+    def __init__(self):
+        self.signatures: Dict[int, np.ndarray] = {}
+        self.buckets: Dict[Tuple[int, bytes], Set[int]] = {}
+        self.document_count = 0  # Размер списка документов, для которого построен индекс
+
+    def __len__(self):
+        return len(self.signatures)
+
+    def _bands(self, signature: np.ndarray):
+        rows = NUM_PERMUTATIONS // LSH_BANDS
+        for band in range(LSH_BANDS):
+            yield band, signature[band * rows:(band + 1) * rows].tobytes()
+
+    def add(self, position: int, signature: Optional[np.ndarray]) -> None:
+        if signature is None:
+            return
+        self.signatures[position] = signature
+        for key in self._bands(signature):
+            self.buckets.setdefault(key, set()).add(position)
+
+    def remove(self, position: int) -> None:
+        signature = self.signatures.pop(position, None)
+        if signature is None:
+            return
+        for key in self._bands(signature):
+            bucket = self.buckets.get(key)
+            if bucket:
+                bucket.discard(position)
+                if not bucket:
+                    del self.buckets[key]
+
+    def truncate(self, count: int) -> None:
+        """Forget positions >= count (used to roll back a failed append)"""
+        for position in [position for position in self.signatures if position >= count]:
+            self.remove(position)
+
+    def find(self, signature: Optional[np.ndarray]) -> Optional[int]:
+        """Return the position of the most similar stored chunk above the threshold"""
+        if signature is None:
+            return None
+        candidates = set()
+        for key in self._bands(signature):
+            candidates.update(self.buckets.get(key, ()))
+        best, best_similarity = None, DEDUP_THRESHOLD
+        for position in candidates:
+            similarity = estimate_similarity(signature, self.signatures[position])
+            if similarity >= best_similarity:
+                best, best_similarity = position, similarity
+        return best
+
+    def remapped(self, positions: List[int]) -> 'DuplicateIndex':
+        """Index with positions renumbered after compaction (positions[new] = old)"""
+        index = DuplicateIndex()
+        for new_position, old_position in enumerate(positions):
+            index.add(new_position, self.signatures.get(old_position))
+        return index
+
+    def save(self, path: str) -> None:
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({'signatures': self.signatures, 'permutations': NUM_PERMUTATIONS,
+                         'document_count': self.document_count}, f,
+                        protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['DuplicateIndex']:
+        """Load saved signatures and rebuild the LSH buckets; None if missing or incompatible"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('permutations') != NUM_PERMUTATIONS:
+                return None
+            index = cls()
+            index.document_count = data.get('document_count', -1)
+            for position, signature in data['signatures'].items():
+                index.add(position, signature)
+            return index
+        except Exception as e:
+            logger.error(f"Error loading duplicate index {path}: {str(e)}")
+            return None
@@ -0,0 +1,63 @@
+import os
+import threading
+import logging
+from collections import OrderedDict
+from typing import List
+
+import numpy as np
+from sentence_transformers import SentenceTransformer
+
+logger = logging.getLogger(__name__)
+
+EMBEDDING_MODEL_NAME = 'sentence-transformers/paraphrase-multilingual-mpnet-base-v2'
+EMBEDDING_DIM = 768  # Размерность для модели paraphrase-multilingual-mpnet-base-v2
+SPECIAL_TOKENS = 2  # <s> и </s>, которые модель добавляет к каждому тексту
+# Эмбеддинги недавних поисковых запросов (повторы и inline-запросы по мере набора не кодируются заново)
+QUERY_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', '2048'))
+
+_model = None
+_model_lock = threading.Lock()
+_query_cache: 'OrderedDict[str, np.ndarray]' = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+
+def get_embedding_model() -> SentenceTransformer:
+    """Return the process-wide embedding model, loading it on first use"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = SentenceTransformer(EMBEDDING_MODEL_NAME)
+                logger.info(f"Embedding model loaded: {EMBEDDING_MODEL_NAME}")
+    return _model
+
+
+def get_max_tokens() -> int:
+    """Maximum number of content tokens the model embeds without truncation"""
+    return get_embedding_model().max_seq_length - SPECIAL_TOKENS
+
+
+def count_tokens(texts: List[str]) -> List[int]:
+    """Count model tokens for each text (without special tokens)"""
+    if not texts:
+        return []
+    tokenizer = get_embedding_model().tokenizer
+    encoded = tokenizer(texts, add_special_tokens=False)['input_ids']
+    return [len(ids) for ids in encoded]
+
+
+def encode_query(query: str) -> np.ndarray:
+    """Embedding of a search query (float32), served from an LRU cache of recent queries"""
+    with _query_cache_lock:
+        embedding = _query_cache.get(query)
+        if embedding is not None:
+            _query_cache.move_to_end(query)
+            return embedding
+    embedding = np.asarray(get_embedding_model().encode([query])[0], dtype='float32')
+    embedding.setflags(write=False)
+    if QUERY_CACHE_SIZE > 0:
+        with _query_cache_lock:
+            _query_cache[query] = embedding
+            while len(_query_cache) > QUERY_CACHE_SIZE:
+                _query_cache.popitem(last=False)
+    return embedding
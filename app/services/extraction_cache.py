@@ -0,0 +1,116 @@
+import os
+import gzip
+import json
+import time
+import logging
+from typing import List, Dict, Any, Optional
+from app.file_processing import process_file, EXTRACTOR_VERSION
+from app.services.sandbox import extract_sandboxed
+
+logger = logging.getLogger(__name__)
+
+
+class ExtractionCache:
+    """
+    Persisted results of text extraction, stored next to the uploads.
+
+    Segments (text with page/paragraph numbers) are kept as gzip-compressed
+    JSON under <root>/<hash[:2]>/<hash>.v<EXTRACTOR_VERSION>.json.gz, so
+    re-chunking or re-embedding a file never re-parses the original PDF/DOCX.
+    Bumping EXTRACTOR_VERSION invalidates all entries.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def path_for(self, content_hash: str) -> str:
+        return os.path.join(self.root, content_hash[:2], f"{content_hash}.v{EXTRACTOR_VERSION}.json.gz")
+
+    def get(self, content_hash: str) -> Optional[List[Dict[str, Any]]]:
+        """Return cached segments or None"""
+        path = self.path_for(content_hash)
+        if not os.path.exists(path):
+            return None
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"Error reading extraction cache {path}: {str(e)}")
+            return None
+
+    def put(self, content_hash: str, segments: List[Dict[str, Any]]) -> None:
+        """Store segments atomically"""
+        path = self.path_for(content_hash)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            # Путь к файлу не кешируем: одно содержимое может лежать под разными путями
+            stored = [{key: value for key, value in segment.items() if key != 'source'} for segment in segments]
+            with gzip.open(tmp_path, 'wt', encoding='utf-8', compresslevel=6) as f:
+                json.dump(stored, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except Exception as e:
+            logger.error(f"Error writing extraction cache {path}: {str(e)}")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def remove(self, content_hash: str) -> None:
+        path = self.path_for(content_hash)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def load_segments(self, file_path: str, content_hash: Optional[str] = None,
+                      sandboxed: bool = True) -> List[Dict[str, Any]]:
+        """
+        Return segments of a file from the cache, extracting and caching them on a miss.
+
+        Extraction runs in a sandbox process with time and memory limits unless
+        sandboxed=False; failures raise sandbox.ExtractionError with the reason.
+        """
+        if content_hash:
+            segments = self.get(content_hash)
+            if segments is not None:
+                logger.info(f"Extraction cache hit for {content_hash}")
+                return [{**segment, 'source': file_path} for segment in segments]
+
+        segments = extract_sandboxed(file_path) if sandboxed else process_file(file_path)
+        # Пустой результат не кешируем: ошибка разбора может быть временной
+        if content_hash and segments:
+            self.put(content_hash, segments)
+        return segments
+
+
+_cache: Optional[ExtractionCache] = None
+
+
+def get_extraction_cache() -> ExtractionCache:
+    """Return the extraction cache under app/uploads/extracted"""
+    global _cache
+    if _cache is None:
+        _cache = ExtractionCache(os.path.join(os.getcwd(), 'app', 'uploads', 'extracted'))
+    return _cache
+
+
+def extract_job(job) -> Dict[str, Any]:
+    """
+    Extract one file for parallel ingestion.
+
+    job is (content_hash, file_path). Runs in an ingestion worker thread; the
+    parsing itself happens in a sandbox process, so only cache hits are served
+    in-process.
+    """
+    content_hash, file_path = job
+    start = time.perf_counter()
+    try:
+        segments = get_extraction_cache().load_segments(file_path, content_hash)
+        error = None if segments else 'no text extracted'
+    except Exception as e:
+        segments, error = [], str(e)
+    return {
+        'content_hash': content_hash,
+        'file_path': file_path,
+        'segments': segments,
+        'error': error,
+        'extract_ms': int((time.perf_counter() - start) * 1000)
+    }
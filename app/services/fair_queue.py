@@ -0,0 +1,315 @@
+import os
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+import weakref
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, List, Optional
+
+from app.services import metrics
+from app.services.timing import record
+
+logger = logging.getLogger(__name__)
+
+# Одновременных вопросов в RAG-конвейере веб-процесса (у бота - BOT_MAX_CONCURRENT_QUESTIONS)
+QUESTION_CONCURRENCY = int(os.environ.get('QUESTION_CONCURRENCY', '8'))
+# Лимит на пользователя: вопросов в минуту и допустимый всплеск (0 - без лимита)
+RATE_PER_MINUTE = float(os.environ.get('QUESTION_RATE_PER_MINUTE', '10'))
+RATE_BURST = int(os.environ.get('QUESTION_RATE_BURST', '5'))
+# Вопросов одного пользователя в очереди, сверх этого - отказ с подсказкой, когда повторить
+MAX_QUEUED_PER_USER = int(os.environ.get('QUESTION_MAX_QUEUED_PER_USER', '2'))
+MAX_TRACKED_USERS = 10000
+
+
+def parse_weights(value: str) -> Dict[str, float]:
+    """'1:2,5:0.5' -> {'1': 2.0, '5': 0.5} (course id -> share weight)"""
+    weights = {}
+    for item in value.split(','):
+        if ':' not in item:
+            continue
+        key, weight = item.split(':', 1)
+        try:
+            weights[key.strip()] = max(float(weight), 0.01)
+        except ValueError:
+            logger.warning(f"Ignoring invalid course weight: {item}")
+    return weights
+
+
+COURSE_WEIGHTS = parse_weights(os.environ.get('QUESTION_COURSE_WEIGHTS', ''))
+
+
+class QuestionRejected(Exception):
+    """The user exceeded their rate limit or queue share; retry_after is a hint in seconds"""
+
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(f"{reason}, retry after {retry_after:.0f}s")
+        self.reason = reason
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+
+def _resolve(future) -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class Ticket:
+    """A question's place in the scheduler"""
+
+    __slots__ = ('user', 'course', 'start', 'finish', 'enqueued', 'event', 'callback', 'state')
+
+    def __init__(self, user, course, start: float, finish: float):
+        self.user = user
+        self.course = course
+        self.start = start
+        self.finish = finish
+        self.enqueued = time.perf_counter()
+        self.event = threading.Event()
+        self.callback: Optional[Callable[[], None]] = None
+        self.state = 'queued'  # queued -> running -> done, или queued -> cancelled
+
+    @property
+    def granted(self) -> bool:
+        return self.event.is_set()
+
+
+class _Stats:
+    """Queue-wait histogram and rejection counters per course, shared by all schedulers of the process"""
+
+    def __init__(self):
+        self.wait = metrics.Histogram('question_queue_wait_seconds',
+                                      'Time questions waited for a RAG pipeline slot', 'course')
+        self.lock = threading.Lock()
+        self.rejected: Dict[tuple, int] = {}
+        self.schedulers = weakref.WeakSet()
+
+    def reject(self, course, reason: str) -> None:
+        with self.lock:
+            key = (str(course), reason)
+            self.rejected[key] = self.rejected.get(key, 0) + 1
+
+    def render(self) -> List[str]:
+        lines = self.wait.render()
+        lines += ['# HELP question_rejected_total Questions rejected by per-user limits',
+                  '# TYPE question_rejected_total counter']
+        with self.lock:
+            rejected = sorted(self.rejected.items())
+        lines += [f'question_rejected_total{{course="{course}",reason="{reason}"}} {count}'
+                  for (course, reason), count in rejected]
+        lines += ['# HELP question_queue_depth Questions waiting for a RAG pipeline slot',
+                  '# TYPE question_queue_depth gauge',
+                  f'question_queue_depth {sum(s.depth() for s in list(self.schedulers))}']
+        return lines
+
+
+stats = _Stats()
+metrics.register(stats)
+
+
+class FairScheduler:
+    """
+    Weighted fair queuing of questions in front of the RAG pipeline.
+
+    At most `capacity` questions run at once. Waiting questions are ordered
+    by start-time fair queuing tags: each course gets a share proportional
+    to its weight (QUESTION_COURSE_WEIGHTS), split evenly between its
+    active users, so a heavy user or a large class cannot starve others.
+    Per-user token buckets limit the question rate, and a user with too
+    many queued questions is rejected; both raise QuestionRejected with a
+    retry hint. Questions submitted without a user bypass the limits.
+
+    Thread-safe: the web app waits with wait()/slot() in request threads,
+    the bot with held() on its event loop.
+    """
+
+    def __init__(self, capacity: int = QUESTION_CONCURRENCY, rate_per_minute: float = RATE_PER_MINUTE,
+                 burst: int = RATE_BURST, max_queued_per_user: int = MAX_QUEUED_PER_USER,
+                 course_weights: Optional[Dict[str, float]] = None):
+        self.capacity = max(1, capacity)
+        self.rate = rate_per_minute / 60
+        self.burst = max(1, burst)
+        self.max_queued_per_user = max_queued_per_user
+        self.course_weights = COURSE_WEIGHTS if course_weights is None else course_weights
+        self.lock = threading.Lock()
+        self.heap: list = []  # (finish, seq, ticket); отмененные билеты удаляются лениво
+        self.seq = itertools.count()
+        self.running = 0
+        self.queued = 0
+        self.virtual_time = 0.0
+        self.last_finish: Dict = {}  # user -> finish tag of their last question
+        self.active: Dict = {}  # course -> {user: questions queued or running}
+        self.queued_by_user: Dict = {}
+        self.buckets: Dict = {}  # user -> [tokens, updated]
+        self.service_time = 5.0  # Скользящее среднее времени ответа, для подсказки retry_after
+        stats.schedulers.add(self)
+
+    # --- Внутреннее (под self.lock) ---
+
+    def _take_token(self, user) -> Optional[float]:
+        """Consume a rate token; returns the wait in seconds when none is left"""
+        now = time.monotonic()
+        bucket = self.buckets.get(user)
+        if bucket is None:
+            bucket = self.buckets[user] = [float(self.burst), now]
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return (1 - bucket[0]) / self.rate
+        bucket[0] -= 1
+        return None
+
+    def _prune(self, now: float) -> None:
+        """Forget users whose bucket is full again and whose fairness tag is in the past"""
+        for user, (tokens, updated) in list(self.buckets.items()):
+            if tokens + (now - updated) * self.rate >= self.burst:
+                del self.buckets[user]
+        for user, finish in list(self.last_finish.items()):
+            if finish <= self.virtual_time:
+                del self.last_finish[user]
+
+    def _weight(self, course, user) -> float:
+        users = self.active.get(course, {})
+        sharing = len(users) + (0 if user in users else 1)
+        return self.course_weights.get(str(course), 1.0) / sharing
+
+    def _grant(self, ticket: Ticket) -> None:
+        ticket.state = 'running'
+        self.running += 1
+        self.virtual_time = max(self.virtual_time, ticket.start)
+        ticket.event.set()
+        if ticket.callback is not None:
+            ticket.callback()
+
+    def _forget(self, ticket: Ticket) -> None:
+        users = self.active.get(ticket.course)
+        if users is not None:
+            users[ticket.user] -= 1
+            if not users[ticket.user]:
+                del users[ticket.user]
+            if not users:
+                del self.active[ticket.course]
+
+    def _dispatch(self) -> None:
+        while self.heap and self.running < self.capacity:
+            _, _, ticket = heapq.heappop(self.heap)
+            if ticket.state != 'queued':
+                continue
+            self.queued -= 1
+            if ticket.user is not None:
+                self.queued_by_user[ticket.user] -= 1
+                if not self.queued_by_user[ticket.user]:
+                    del self.queued_by_user[ticket.user]
+            self._grant(ticket)
+
+    # --- Интерфейс ---
+
+    def submit(self, user=None, course=None) -> Ticket:
+        """Queue a question (granted immediately when a slot is free); raises QuestionRejected"""
+        with self.lock:
+            if len(self.buckets) >= MAX_TRACKED_USERS or len(self.last_finish) >= MAX_TRACKED_USERS:
+                self._prune(time.monotonic())
+            if user is not None:
+                if self.rate > 0:
+                    wait = self._take_token(user)
+                    if wait is not None:
+                        stats.reject(course, 'rate')
+                        raise QuestionRejected('rate limit', wait)
+                queued = self.queued_by_user.get(user, 0)
+                if self.max_queued_per_user and queued >= self.max_queued_per_user:
+                    stats.reject(course, 'share')
+                    raise QuestionRejected('queue share', self.service_time * (queued + 1))
+
+            key = user if user is not None else ('course', course)
+            start = max(self.virtual_time, self.last_finish.get(key, 0.0))
+            ticket = Ticket(user, course, start, start + 1 / self._weight(course, user))
+            self.last_finish[key] = ticket.finish
+            users = self.active.setdefault(course, {})
+            users[user] = users.get(user, 0) + 1
+
+            if self.running < self.capacity and not self.queued:
+                self._grant(ticket)
+            else:
+                heapq.heappush(self.heap, (ticket.finish, next(self.seq), ticket))
+                self.queued += 1
+                if user is not None:
+                    self.queued_by_user[user] = self.queued_by_user.get(user, 0) + 1
+            return ticket
+
+    def release(self, ticket: Ticket) -> None:
+        """Free the ticket's slot (or drop it from the queue); safe to call more than once"""
+        with self.lock:
+            if ticket.state == 'running':
+                ticket.state = 'done'
+                self.running -= 1
+                elapsed = time.perf_counter() - ticket.enqueued
+                self.service_time = 0.9 * self.service_time + 0.1 * elapsed
+            elif ticket.state == 'queued':
+                ticket.state = 'cancelled'
+                self.queued -= 1
+                if ticket.user is not None:
+                    self.queued_by_user[ticket.user] -= 1
+                    if not self.queued_by_user[ticket.user]:
+                        del self.queued_by_user[ticket.user]
+            else:
+                return
+            self._forget(ticket)
+            self._dispatch()
+
+    def _waited(self, ticket: Ticket) -> None:
+        waited = time.perf_counter() - ticket.enqueued
+        stats.wait.observe(str(ticket.course), waited)
+        record('queue_wait', waited * 1000)
+
+    def wait(self, ticket: Ticket) -> None:
+        """Block the calling thread until the ticket's turn comes"""
+        ticket.event.wait()
+        self._waited(ticket)
+
+    @contextmanager
+    def slot(self, user=None, course=None):
+        """submit() + wait(); the slot is released on exit"""
+        ticket = self.submit(user, course)
+        try:
+            self.wait(ticket)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    @asynccontextmanager
+    async def held(self, ticket: Ticket):
+        """Await a submitted ticket on the event loop; the slot is released on exit"""
+        try:
+            if not ticket.granted:
+                loop = asyncio.get_running_loop()
+                future = loop.create_future()
+                with self.lock:
+                    granted = ticket.granted
+                    if not granted:
+                        ticket.callback = lambda: loop.call_soon_threadsafe(_resolve, future)
+                if not granted:
+                    await future
+            self._waited(ticket)
+            yield ticket
+        finally:
+            self.release(ticket)
+
+    def saturated(self) -> bool:
+        return self.running >= self.capacity
+
+    def depth(self) -> int:
+        return self.queued
+
+
+_scheduler: Optional[FairScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_question_scheduler() -> FairScheduler:
+    """Scheduler shared by the web app's request threads"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = FairScheduler()
+        return _scheduler
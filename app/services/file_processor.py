@@ -1,103 +1,141 @@
 import os
+import time
 import logging
-from typing import List, Dict, Any
-from docx import Document
-import PyPDF2
-import mammoth
-import numpy as np
-from sentence_transformers import SentenceTransformer
-from app.services.vector_db import VectorDB
+from typing import List, Dict, Any, Optional
+from app.services.vector_db import get_vector_db
+from app.services.chunking import chunk_segments
+from app.services.extraction_cache import get_extraction_cache
+from app.services.timing import span
 import hashlib
 
 logger = logging.getLogger(__name__)
 
+def _generate_document_id(file_path: str, text: str, index: int) -> str:
+    """Generate a unique document ID based on file path, chunk position and content"""
+    hash_input = f"{file_path}:{index}:{text}"
+    return hashlib.md5(hash_input.encode()).hexdigest()
+
+def make_chunks(file_path: str, segments: List[Dict[str, Any]],
+                content_hash: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Split extracted segments into chunks and assign chunk hashes and document IDs"""
+    chunks = chunk_segments(segments, source=file_path)
+    for chunk in chunks:
+        chunk['chunk_hash'] = hashlib.sha1(chunk['text'].encode()).hexdigest()
+        if content_hash:
+            # Чанки файла адресуются хешем содержимого и общие для всех его копий
+            chunk['id'] = f"{content_hash}:{chunk['chunk_index']}"
+            chunk['content_hash'] = content_hash
+        else:
+            chunk['id'] = _generate_document_id(file_path, chunk['text'], chunk['chunk_index'])
+    return chunks
+
+def page_count(segments: List[Dict[str, Any]]) -> int:
+    """Number of distinct pages among extracted segments (0 for formats without pages, e.g. DOCX)"""
+    return len({segment['page'] for segment in segments if segment.get('page')})
+
 class FileProcessor:
     def __init__(self, vector_db_path: str):
         """Initialize FileProcessor with vector database path"""
         self.vector_db_path = vector_db_path
         os.makedirs(vector_db_path, exist_ok=True)
 
-        # Инициализация модели для эмбеддингов
-        self.embedding_model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-mpnet-base-v2')
-
-        # Initialize VectorDB with specific paths for index and documents
-        self.vector_db = VectorDB(
-            index_path=os.path.join(vector_db_path, "vector_index.faiss"),
-            documents_path=os.path.join(vector_db_path, "documents.json")
-        )
+        # Use the shared VectorDB of the active index generation
+        self.vector_db = get_vector_db(vector_db_path)
+        self.last_error = None  # Причина последней неудачной обработки файла
+        self.last_stats = {}  # Статистика последней обработки: pages, chunks, extract_ms, embed_ms, vectors_added
         logger.info(f"FileProcessor initialized with vector DB path: {vector_db_path}")
 
-    def extract_text(self, file_path: str, file_type: str) -> str:
-        """Extract text content from a file based on its type"""
-        try:
-            if file_type == 'docx':
-                return self._extract_text_from_docx(file_path)
-            elif file_type == 'pdf':
-                return self._extract_text_from_pdf(file_path)
-            else:
-                raise ValueError(f"Unsupported file type: {file_type}")
-        except Exception as e:
-            logger.error(f"Error extracting text from file: {str(e)}")
-            raise
+    def create_chunks(self, file_path: str, content_hash: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Extract a file and split it into token-sized chunks with page/paragraph metadata"""
+        # Разобранный текст берется из кеша по хешу содержимого, если он уже извлекался
+        start = time.perf_counter()
+        with span('ingest_extract'):
+            segments = get_extraction_cache().load_segments(file_path, content_hash)
+        self.last_stats = {'extract_ms': int((time.perf_counter() - start) * 1000),
+                           'pages': page_count(segments or [])}
+        if not segments:
+            return []
+        chunks = make_chunks(file_path, segments, content_hash)
+        self.last_stats['chunks'] = len(chunks)
+        return chunks
 
-    def _extract_text_from_docx(self, file_path: str) -> str:
-        """Extract text from DOCX file"""
-        try:
-            with open(file_path, "rb") as docx_file:
-                result = mammoth.extract_raw_text(docx_file)
-                return result.value
-        except Exception as e:
-            logger.error(f"Error processing DOCX file {file_path}: {str(e)}")
-            raise
-
-    def _extract_text_from_pdf(self, file_path: str) -> str:
-        """Extract text from PDF file"""
-        try:
-            text = ""
-            with open(file_path, 'rb') as file:
-                pdf_reader = PyPDF2.PdfReader(file)
-                for page in pdf_reader.pages:
-                    text += page.extract_text() + "\n"
-            return text
-        except Exception as e:
-            logger.error(f"Error processing PDF file {file_path}: {str(e)}")
-            raise
+    def process_file(self, file_path: str, content_hash: Optional[str] = None) -> bool:
+        """
+        Process and index a file into the vector database.
 
-    def create_embedding(self, text: str) -> np.ndarray:
-        """Create vector embedding for text using sentence transformer"""
-        try:
-            return self.embedding_model.encode(text)
-        except Exception as e:
-            logger.error(f"Error creating embedding: {str(e)}")
-            raise
-
-    def _generate_document_id(self, file_path: str, text: str) -> str:
-        """Generate a unique document ID based on file path and content"""
-        hash_input = f"{file_path}:{text}"
-        return hashlib.md5(hash_input.encode()).hexdigest()
-
-    def process_file(self, file_path: str) -> bool:
-        """Process and index a file into the vector database"""
+        When content_hash is given and chunks with that hash are already indexed
+        (the same file was uploaded before), extraction and embedding are skipped.
+        """
+        self.last_error = None
+        self.last_stats = {}
         try:
             logger.info(f"Processing file: {file_path}")
-            # Get file extension
-            file_ext = os.path.splitext(file_path)[1].lower().replace('.', '')
 
-            # Extract text based on file type
-            text = self.extract_text(file_path, file_ext)
+            if content_hash and self.vector_db.has_content(content_hash):
+                logger.info(f"Content {content_hash} already indexed, reusing existing chunks")
+                return True
 
-            if not text:
+            chunks = self.create_chunks(file_path, content_hash)
+            if not chunks:
+                self.last_error = 'no text extracted'
                 logger.warning(f"No text content extracted from file: {file_path}")
                 return False
 
-            # Generate unique document ID
-            document_id = self._generate_document_id(file_path, text)
+            # Add all chunks to vector database in one batch
+            start = time.perf_counter()
+            vectors_before = self.vector_db.index.ntotal
+            added = self.vector_db.add_documents(chunks)
+            self.last_stats['embed_ms'] = int((time.perf_counter() - start) * 1000)
+            self.last_stats['vectors_added'] = self.vector_db.index.ntotal - vectors_before
+            if not added:
+                self.last_error = 'failed to add chunks to the index'
+                logger.error(f"Failed to index chunks of file: {file_path}")
+                return False
 
-            # Add to vector database
-            self.vector_db.add_document(text, document_id)
-            logger.info(f"Successfully processed file: {file_path}")
+            logger.info(f"Successfully processed file: {file_path} ({added} chunks)")
             return True
 
         except Exception as e:
+            self.last_error = str(e)
             logger.error(f"Error processing file {file_path}: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+    def reindex_file(self, file_path: str, old_hash: Optional[str], new_hash: str,
+                     exclusive: bool = True) -> Optional[Dict[str, int]]:
+        """
+        Re-extract a file and update its chunks in the index incrementally.
+
+        Chunk hashes of the new version are diffed against the chunks indexed
+        under old_hash: only new or changed chunks are embedded, removed ones are
+        tombstoned. exclusive must be False when other files still reference
+        old_hash. Returns {'reused', 'recomputed', 'removed'} or None on error.
+        """
+        try:
+            logger.info(f"Re-indexing file: {file_path}")
+            self.last_error = None
+            self.last_stats = {}
+            chunks = self.create_chunks(file_path, new_hash)
+            if not chunks:
+                self.last_error = 'no text extracted'
+                logger.warning(f"No text content extracted from file: {file_path}")
+                return None
+            start = time.perf_counter()
+            stats = self.vector_db.reindex_content(old_hash, new_hash, chunks, exclusive=exclusive)
+            if stats is None:
+                self.last_error = 'failed to add chunks to the index'
+            else:
+                self.last_stats['embed_ms'] = int((time.perf_counter() - start) * 1000)
+                self.last_stats['vectors_added'] = stats['recomputed']
+            return stats
+        except Exception as e:
+            self.last_error = str(e)
+            logger.error(f"Error re-indexing file {file_path}: {str(e)}")
+            return None
+
+    def remove_content(self, content_hash: str) -> int:
+        """Remove chunks of a file that is no longer referenced"""
+        return self.vector_db.remove_content(content_hash)
+
+    def remove_source(self, file_path: str) -> int:
+        """Remove chunks of a file indexed before the content store (addressed by its path)"""
+        return self.vector_db.remove_source(file_path)
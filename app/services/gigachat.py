@@ -3,6 +3,7 @@ import logging
 import requests
 import uuid
 from typing import Optional
+from app.services.timing import span
 
 logger = logging.getLogger(__name__)
 
@@ -15,8 +16,10 @@ class GigaChatAPI:
         if not self.credentials:
             logger.warning("GIGACHAT_CREDENTIALS не найден в переменных окружения")
 
-        self.token_url = "https://ngw.devices.sberbank.ru:9443/api/v2/oauth"  # URL для получения токена
-        self.base_url = "https://gigachat.devices.sberbank.ru/api/v1"  # Базовый URL для API
+        # Адреса можно переопределить, например, для локального mock-сервера при нагрузочном тестировании
+        self.token_url = os.environ.get('GIGACHAT_TOKEN_URL', "https://ngw.devices.sberbank.ru:9443/api/v2/oauth")
+        self.base_url = os.environ.get('GIGACHAT_BASE_URL', "https://gigachat.devices.sberbank.ru/api/v1")
+        self.verify_ssl = os.environ.get('GIGACHAT_VERIFY_SSL', '0') == '1'
         self.token = None
 
     def _get_token(self) -> Optional[str]:
@@ -37,12 +40,13 @@ class GigaChatAPI:
                 'scope': 'GIGACHAT_API_PERS'
             }
 
-            response = requests.post(
-                self.token_url,
-                headers=headers,
-                data=payload,
-                verify=False  # Отключаем проверку SSL-сертификатов (только для тестовых целей)
-            )
+            with span('gigachat_token'):
+                response = requests.post(
+                    self.token_url,
+                    headers=headers,
+                    data=payload,
+                    verify=self.verify_ssl  # По умолчанию проверка SSL отключена (GIGACHAT_VERIFY_SSL=1 включает)
+                )
 
             if response.status_code == 200:
                 data = response.json()
@@ -81,12 +85,13 @@ class GigaChatAPI:
                 'max_tokens': 1500
             }
 
-            response = requests.post(
-                f"{self.base_url}/chat/completions",
-                headers=headers,
-                json=data,
-                verify=False  # Отключаем проверку SSL-сертификатов (только для тестовых целей)
-            )
+            with span('gigachat_completion'):
+                response = requests.post(
+                    f"{self.base_url}/chat/completions",
+                    headers=headers,
+                    json=data,
+                    verify=self.verify_ssl
+                )
 
             if response.status_code == 200:
                 result = response.json()
@@ -0,0 +1,491 @@
+import os
+import json
+import time
+import shutil
+import zipfile
+import tempfile
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from typing import Dict, Any, Callable, Optional, Iterable, List, Tuple
+from sqlalchemy import insert
+from werkzeug.utils import secure_filename
+
+from app.services.content_store import hash_file, get_content_store
+from app.services.extraction_cache import extract_job
+from app.services.file_processor import make_chunks, page_count
+from app.services.timing import timed
+from app.services.vector_db import GENERATIONS_DIR, open_vector_db, publish_generation, get_vector_db
+
+logger = logging.getLogger(__name__)
+
+BUILDING_POINTER = "BUILDING"  # Имя поколения, которое сейчас собирается
+CHECKPOINT_FILENAME = "checkpoint.json"
+DEFAULT_EMBED_BATCH = 256  # Сколько чанков копится перед вызовом модели
+DEFAULT_CHECKPOINT_EVERY = 50  # Файлов между сохранениями прогресса
+MAX_CATCH_UP_PASSES = 3
+
+
+class IndexBuilder:
+    """
+    Collects chunks of extracted files and embeds them in large batches.
+
+    Chunks are added to the VectorDB without saving; the caller decides when
+    to persist (checkpoint) the database.
+    """
+
+    def __init__(self, vector_db, embed_batch: int = DEFAULT_EMBED_BATCH, encode_batch_size: int = 64):
+        self.vector_db = vector_db
+        self.embed_batch = embed_batch
+        self.encode_batch_size = encode_batch_size
+        self.pending = []
+        self.stats = {'files': 0, 'chunks': 0, 'embed_ms': 0}
+        # Статистика по файлам: {content_hash: {pages, chunks, extract_ms, embed_ms, vectors_added}}
+        self.file_stats: Dict[str, Dict[str, int]] = {}
+
+    def add(self, content_hash: str, file_path: str, segments, extract_ms: int = 0) -> int:
+        """Chunk an extracted file and queue its chunks for embedding"""
+        chunks = make_chunks(file_path, segments, content_hash)
+        self.file_stats[content_hash] = {'pages': page_count(segments), 'chunks': len(chunks),
+                                         'extract_ms': extract_ms, 'embed_ms': 0, 'vectors_added': 0}
+        self.pending.extend(chunks)
+        self.stats['files'] += 1
+        if len(self.pending) >= self.embed_batch:
+            self.flush()
+        return len(chunks)
+
+    def flush(self) -> int:
+        """Embed all queued chunks in one model call"""
+        if not self.pending:
+            return 0
+        start = time.perf_counter()
+        added = self.vector_db.add_documents(self.pending, batch_size=self.encode_batch_size, save=False)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        self.stats['embed_ms'] += int(elapsed_ms)
+        self.stats['chunks'] += added
+
+        # Время пакета делится между файлами пропорционально числу их чанков
+        batch = {}
+        for chunk in self.pending:
+            batch[chunk['content_hash']] = batch.get(chunk['content_hash'], 0) + 1
+        for content_hash, count in batch.items():
+            file_stats = self.file_stats.get(content_hash)
+            if file_stats is not None:
+                file_stats['embed_ms'] += int(elapsed_ms * count / len(self.pending))
+                file_stats['vectors_added'] = self.vector_db.owned_count(content_hash)
+        self.pending = []
+        return added
+
+
+@timed('ingest_extract')
+def _extract(job: Tuple[str, str]) -> Dict[str, Any]:
+    return extract_job(job)
+
+
+def run_extraction(jobs: Iterable[Tuple[str, str]], workers: Optional[int] = None):
+    """
+    Extract files in parallel, each in its own sandbox process.
+
+    `workers` threads each drive one sandboxed extraction (see
+    services.sandbox) at a time. Yields extraction results as they complete;
+    at most 2 * workers files are in flight, so results never pile up in
+    memory faster than they are consumed.
+    """
+    workers = workers or os.cpu_count() or 1
+    jobs = iter(jobs)
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        in_flight = set()
+        for job in jobs:
+            in_flight.add(executor.submit(_extract, job))
+            if len(in_flight) >= workers * 2:
+                break
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                yield future.result()
+                next_job = next(jobs, None)
+                if next_job is not None:
+                    in_flight.add(executor.submit(_extract, next_job))
+
+
+def ingest(jobs: Dict[str, str], builder: IndexBuilder,
+           workers: Optional[int] = None,
+           stats: Optional[Dict[str, Any]] = None,
+           progress: Optional[Callable[[Dict[str, Any]], None]] = None,
+           on_checkpoint: Optional[Callable[[], None]] = None,
+           checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+           failures: Optional[Dict[str, str]] = None) -> Dict[str, str]:
+    """
+    Extract {content_hash: file_path} jobs in parallel and embed them in batches.
+
+    Updates stats ('files_done', 'chunks', 'failed', 'elapsed_s') as files
+    complete, calls progress after each file and on_checkpoint every
+    checkpoint_every files (after flushing pending embeddings). Failures are
+    recorded in (and returned as) a {content_hash: reason} dict.
+    """
+    if stats is None:
+        stats = {'files_done': 0, 'files_total': len(jobs), 'chunks': 0, 'failed': 0}
+    started = time.perf_counter() - stats.get('elapsed_s', 0)
+    failures = {} if failures is None else failures
+    since_checkpoint = 0
+
+    for result in run_extraction(jobs.items(), workers):
+        if result['error']:
+            failures[result['content_hash']] = result['error']
+            stats['failed'] += 1
+            logger.warning(f"Failed to extract {result['file_path']}: {result['error']}")
+        else:
+            stats['chunks'] += builder.add(result['content_hash'], result['file_path'], result['segments'],
+                                           result.get('extract_ms', 0))
+        stats['files_done'] += 1
+        since_checkpoint += 1
+
+        if on_checkpoint and since_checkpoint >= checkpoint_every:
+            builder.flush()
+            on_checkpoint()
+            since_checkpoint = 0
+
+        stats['elapsed_s'] = time.perf_counter() - started
+        if progress:
+            progress(dict(stats))
+
+    builder.flush()
+    stats['elapsed_s'] = time.perf_counter() - started
+    return failures
+
+
+def _read_checkpoint(gen_dir: str) -> Dict[str, Any]:
+    path = os.path.join(gen_dir, CHECKPOINT_FILENAME)
+    if os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    return {}
+
+
+def _write_checkpoint(gen_dir: str, checkpoint: Dict[str, Any]) -> None:
+    path = os.path.join(gen_dir, CHECKPOINT_FILENAME)
+    checkpoint['updated_at'] = datetime.utcnow().isoformat()
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(checkpoint, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _open_building_generation(base_path: str, fresh: bool) -> Tuple[str, str]:
+    """Return (name, directory) of the generation being built, resuming an interrupted one"""
+    generations_root = os.path.join(base_path, GENERATIONS_DIR)
+    os.makedirs(generations_root, exist_ok=True)
+    pointer = os.path.join(generations_root, BUILDING_POINTER)
+
+    name = None
+    if not fresh and os.path.exists(pointer):
+        with open(pointer, 'r', encoding='utf-8') as f:
+            name = f.read().strip() or None
+        if name and not os.path.isdir(os.path.join(generations_root, name)):
+            name = None
+        if name:
+            logger.info(f"Resuming rebuild of generation {name}")
+
+    if name is None:
+        name = datetime.utcnow().strftime('gen-%Y%m%d-%H%M%S')
+        os.makedirs(os.path.join(generations_root, name), exist_ok=True)
+        with open(pointer, 'w', encoding='utf-8') as f:
+            f.write(name)
+        logger.info(f"Starting rebuild into new generation {name}")
+
+    return name, os.path.join(generations_root, name)
+
+
+def _collect_jobs(vector_db, failed: Dict[str, str]) -> Dict[str, str]:
+    """Map content hashes that still need indexing to a file path holding that content"""
+    from app import db
+    from app.models import MaterialFile
+
+    jobs = {}
+    for material_file in MaterialFile.query.all():
+        if not material_file.content_hash:
+            # Файлы, загруженные до хранилища по хешу: вычисляем хеш по месту
+            if not os.path.exists(material_file.file_path):
+                logger.warning(f"File is missing on disk: {material_file.file_path}")
+                continue
+            material_file.content_hash = hash_file(material_file.file_path)
+            material_file.file_size = os.path.getsize(material_file.file_path)
+        content_hash = material_file.content_hash
+        if content_hash in jobs or content_hash in failed or vector_db.has_content(content_hash):
+            continue
+        if os.path.exists(material_file.file_path):
+            jobs[content_hash] = material_file.file_path
+    db.session.commit()
+    return jobs
+
+
+def rebuild_index(base_path: str,
+                  workers: Optional[int] = None,
+                  embed_batch: int = DEFAULT_EMBED_BATCH,
+                  checkpoint_every: int = DEFAULT_CHECKPOINT_EVERY,
+                  fresh: bool = False,
+                  progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Rebuild the vector index from all MaterialFile rows into a new generation.
+
+    Files are extracted in parallel worker processes and embedded in large
+    batches. Progress is checkpointed every `checkpoint_every` files, so an
+    interrupted rebuild resumes from the last checkpoint (unless fresh=True).
+    Files uploaded while the rebuild runs are picked up by catch-up passes,
+    and the finished generation is swapped in atomically. Requires an app context.
+    """
+    from app import db
+    from app.models import MaterialFile
+
+    name, gen_dir = _open_building_generation(base_path, fresh)
+    vector_db = open_vector_db(gen_dir)
+    checkpoint = _read_checkpoint(gen_dir)
+    failed = checkpoint.get('failed', {})
+    builder = IndexBuilder(vector_db, embed_batch=embed_batch)
+
+    stats = {
+        'generation': name,
+        'files_done': 0,
+        'files_total': 0,
+        'chunks': 0,
+        'failed': len(failed),
+        'resumed_files': len(vector_db.content_index),
+        'elapsed_s': 0
+    }
+
+    def save_checkpoint():
+        vector_db.save()
+        checkpoint['failed'] = failed
+        _write_checkpoint(gen_dir, checkpoint)
+
+    for _ in range(MAX_CATCH_UP_PASSES):
+        jobs = _collect_jobs(vector_db, failed)
+        if not jobs:
+            break
+        stats['files_total'] += len(jobs)
+        ingest(jobs, builder, workers, stats=stats, progress=progress, on_checkpoint=save_checkpoint,
+               checkpoint_every=checkpoint_every, failures=failed)
+        save_checkpoint()
+
+    # Отмечаем проиндексированные и сбойные файлы и переключаем поколение
+    indexed = set(vector_db.content_index)
+    for material_file in MaterialFile.query.all():
+        if material_file.content_hash in indexed:
+            material_file.mark_indexed()
+            material_file.record_ingestion(builder.file_stats.get(material_file.content_hash))
+        elif material_file.content_hash in failed:
+            material_file.mark_failed(failed[material_file.content_hash])
+        else:
+            material_file.is_indexed = False
+    db.session.commit()
+
+    publish_generation(base_path, name)
+    pointer = os.path.join(base_path, GENERATIONS_DIR, BUILDING_POINTER)
+    if os.path.exists(pointer):
+        os.remove(pointer)
+
+    stats['embed_ms'] = builder.stats['embed_ms']
+    stats['lexical_ms'] = int(vector_db.lexical.build_ms)
+    logger.info(f"Index rebuild finished: {stats}")
+    return stats
+
+
+SUPPORTED_IMPORT_TYPES = ('pdf', 'docx')
+MAX_IMPORT_FILE_BYTES = 100 * 1024 * 1024  # Ограничение на один файл из архива
+MAX_IMPORT_TOTAL_BYTES = 4 * 1024 * 1024 * 1024  # Ограничение на распакованный архив целиком
+
+
+def _unpack_zip(archive_path: str, target_dir: str) -> List[Tuple[str, str]]:
+    """Safely extract supported files from a zip archive; returns (relative_path, reason) failures"""
+    failures = []
+    total = 0
+    with zipfile.ZipFile(archive_path) as archive:
+        for member in archive.infolist():
+            if member.is_dir():
+                continue
+            name = member.filename
+            parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+            if not parts or '..' in parts or name.startswith('/'):
+                failures.append((name, 'unsafe path in archive'))
+                continue
+            if parts[-1].rsplit('.', 1)[-1].lower() not in SUPPORTED_IMPORT_TYPES:
+                continue
+            if member.file_size > MAX_IMPORT_FILE_BYTES:
+                failures.append((name, 'file too large'))
+                continue
+            total += member.file_size
+            if total > MAX_IMPORT_TOTAL_BYTES:
+                failures.append((name, 'archive too large'))
+                break
+            destination = os.path.join(target_dir, *parts)
+            os.makedirs(os.path.dirname(destination), exist_ok=True)
+            with archive.open(member) as src, open(destination, 'wb') as dst:
+                shutil.copyfileobj(src, dst)
+    return failures
+
+
+def _scan_import_dir(root: str) -> List[Tuple[str, str, str]]:
+    """
+    List importable files as (material_title, relative_path, absolute_path).
+
+    Each top-level subdirectory becomes one material; files lying directly in
+    the root become a material each, titled by the file name.
+    """
+    entries = []
+    for dirpath, _, filenames in os.walk(root):
+        for filename in sorted(filenames):
+            if filename.rsplit('.', 1)[-1].lower() not in SUPPORTED_IMPORT_TYPES:
+                continue
+            absolute = os.path.join(dirpath, filename)
+            relative = os.path.relpath(absolute, root)
+            parts = relative.split(os.sep)
+            title = parts[0] if len(parts) > 1 else os.path.splitext(filename)[0]
+            entries.append((title[:120], relative, absolute))
+    entries.sort(key=lambda entry: entry[1])
+    return entries
+
+
+def import_size(source: str) -> Tuple[int, int]:
+    """(files, bytes) of importable content in a directory or zip archive, without extracting it"""
+    if zipfile.is_zipfile(source):
+        with zipfile.ZipFile(source) as archive:
+            members = [member for member in archive.infolist() if not member.is_dir()
+                       and member.filename.rsplit('.', 1)[-1].lower() in SUPPORTED_IMPORT_TYPES]
+            return len(members), sum(member.file_size for member in members)
+    entries = _scan_import_dir(source)
+    return len(entries), sum(os.path.getsize(absolute) for _, _, absolute in entries)
+
+
+def import_course(course_id: int, source: str, base_path: str,
+                  workers: Optional[int] = None,
+                  embed_batch: int = DEFAULT_EMBED_BATCH,
+                  progress: Optional[Callable[[Dict[str, Any]], None]] = None) -> Dict[str, Any]:
+    """
+    Import a directory or zip archive of PDF/DOCX files into a course.
+
+    Files are copied into the content store, Material/MaterialFile rows are
+    created with bulk inserts, and all new content is extracted in a worker
+    pool and embedded in batches into the live index. Returns throughput
+    statistics and a list of per-file failures. Requires an app context.
+    """
+    from app import db
+    from app.models import Material, MaterialFile
+
+    started = time.perf_counter()
+    failures = []
+    tmp_dir = None
+    try:
+        if zipfile.is_zipfile(source):
+            tmp_dir = tempfile.mkdtemp(prefix='import-')
+            failures.extend(_unpack_zip(source, tmp_dir))
+            root = tmp_dir
+        elif os.path.isdir(source):
+            root = source
+        else:
+            raise ValueError(f"Import source must be a directory or zip archive: {source}")
+
+        entries = _scan_import_dir(root)
+        store = get_content_store()
+
+        # Копируем файлы в хранилище по хешу параллельно (операции ввода-вывода)
+        def store_entry(entry):
+            title, relative, absolute = entry
+            file_type = absolute.rsplit('.', 1)[-1].lower()
+            try:
+                return entry, file_type, store.save_file(absolute, file_type), None
+            except Exception as e:
+                return entry, file_type, None, str(e)
+
+        with ThreadPoolExecutor(max_workers=min(8, (workers or os.cpu_count() or 1) * 2)) as executor:
+            stored = list(executor.map(store_entry, entries))
+
+        # Материалы и файлы создаются пакетными вставками
+        titles = []
+        for (title, _, _), _, blob, error in stored:
+            if blob and title not in titles:
+                titles.append(title)
+        materials = {title: Material(course_id=course_id, title=title) for title in titles}
+        db.session.add_all(materials.values())
+        db.session.flush()
+
+        rows = []
+        jobs = {}
+        vector_db = get_vector_db(base_path)
+        for (title, relative, _), file_type, blob, error in stored:
+            if error:
+                failures.append((relative, error))
+                continue
+            content_hash, path, size = blob
+            rows.append({
+                'material_id': materials[title].id,
+                'filename': secure_filename(os.path.basename(relative)) or os.path.basename(path),
+                'file_path': path,
+                'file_type': file_type,
+                'content_hash': content_hash,
+                'file_size': size,
+                'is_indexed': False,
+                'index_status': 'pending',
+                'uploaded_at': datetime.utcnow()
+            })
+            if not vector_db.has_content(content_hash):
+                jobs.setdefault(content_hash, path)
+        if rows:
+            db.session.execute(insert(MaterialFile.__table__), rows)
+        db.session.commit()
+
+        # Извлечение в пуле процессов и пакетное построение эмбеддингов
+        builder = IndexBuilder(vector_db, embed_batch=embed_batch)
+        stats = {'files_done': 0, 'files_total': len(jobs), 'chunks': 0, 'failed': 0,
+                 'elapsed_s': time.perf_counter() - started}
+        extraction_failures = ingest(jobs, builder, workers, stats=stats, progress=progress,
+                                     on_checkpoint=vector_db.save)
+        vector_db.save()
+
+        indexed = [row['content_hash'] for row in rows if vector_db.has_content(row['content_hash'])]
+        if indexed:
+            MaterialFile.query.filter(
+                MaterialFile.content_hash.in_(set(indexed))
+            ).update({'is_indexed': True, 'index_status': 'indexed', 'index_error': None},
+                     synchronize_session=False)
+        for content_hash, file_stats in builder.file_stats.items():
+            MaterialFile.query.filter_by(content_hash=content_hash).update(
+                {'page_count': file_stats['pages'], 'chunk_count': file_stats['chunks'],
+                 'extract_ms': file_stats['extract_ms'], 'embed_ms': file_stats['embed_ms'],
+                 'vectors_added': file_stats['vectors_added'], 'indexed_at': datetime.utcnow()},
+                synchronize_session=False
+            )
+        for content_hash, reason in extraction_failures.items():
+            MaterialFile.query.filter_by(content_hash=content_hash).update(
+                {'is_indexed': False, 'index_status': 'failed', 'index_error': reason,
+                 'index_failures': db.func.coalesce(MaterialFile.index_failures, 0) + 1},
+                synchronize_session=False
+            )
+        db.session.commit()
+
+        for row in rows:
+            if row['content_hash'] in extraction_failures:
+                failures.append((row['filename'], extraction_failures[row['content_hash']]))
+
+        elapsed = time.perf_counter() - started
+        result = {
+            'materials': len(materials),
+            'files': len(rows),
+            'files_indexed': len(jobs) - len(extraction_failures),
+            'files_reused': len(rows) - len(jobs),
+            'chunks': stats['chunks'],
+            'elapsed_s': elapsed,
+            'files_per_s': len(rows) / elapsed if elapsed else 0.0,
+            'chunks_per_s': stats['chunks'] / elapsed if elapsed else 0.0,
+            # Сколько чанков реально хранится после схлопывания дубликатов
+            'dedup': vector_db.dedup_report({row['content_hash'] for row in rows}),
+            'failures': failures
+        }
+        logger.info(f"Course {course_id} import finished: {result['files']} files, "
+                    f"{result['chunks']} chunks, {len(failures)} failures in {elapsed:.1f}s")
+        return result
+
+    except Exception:
+        db.session.rollback()
+        raise
+    finally:
+        if tmp_dir:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
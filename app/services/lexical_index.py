@@ -0,0 +1,186 @@
+import os
+import re
+import math
+import time
+import pickle
+import logging
+from collections import Counter
+from typing import List, Dict, Tuple, Optional, Iterable, Set
+
+logger = logging.getLogger(__name__)
+
+try:
+    import snowballstemmer
+    _ru_stemmer = snowballstemmer.stemmer('russian')
+    _en_stemmer = snowballstemmer.stemmer('english')
+except ImportError:  # Без snowballstemmer используем упрощенное отсечение окончаний
+    snowballstemmer = None
+    _ru_stemmer = _en_stemmer = None
+
+# Параметры BM25
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+_CYRILLIC_RE = re.compile(r'[а-я]')
+
+STOP_WORDS = frozenset("""
+и в во не что он на я с со как а то все она так его но да ты к у же вы за бы по только ее мне было вот от
+меня еще нет о из ему теперь когда даже ну вдруг ли если уже или ни быть был него до вас нибудь опять уж
+вам ведь там потом себя ничего ей может они тут где есть надо ней для мы тебя их чем была сам чтоб без
+будто чего раз тоже себе под будет ж тогда кто этот того потому этого какой совсем ним здесь этом один
+почти мой тем чтобы нее сейчас были куда зачем всех никогда можно при наконец два об другой хоть после
+над больше тот через эти нас про всего них какая много разве три эту моя впрочем хорошо свою этой перед
+иногда лучше чуть том нельзя такой им более всегда конечно всю между это the a an of to in and or is are
+""".split())
+
+_RU_ENDINGS = sorted("""
+ями ами ого его ому ему ыми ими ость ости ение ения ению ением ании ание ания ованн ировать
+ться тся ешь ишь ете ите ают яют ует ала ило или ыла ыло ыли ая яя ое ее ые ие ый ий ой ей ом ем ам ям ах ях
+ую юю ов ев ий ия ию ье ья ью ть ти ет ит ут ют ат ят ал ил ыл ла ли ло а я о е и ы у ю ь
+""".split(), key=len, reverse=True)
+
+
+def _light_stem_ru(word: str) -> str:
+    """Fallback Russian stemmer: strip the longest known ending, keeping a stem of 3+ letters"""
+    for ending in _RU_ENDINGS:
+        if word.endswith(ending) and len(word) - len(ending) >= 3:
+            return word[:-len(ending)]
+    return word
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase, drop stop words and stem Russian/English tokens; numbers are kept as is"""
+    tokens = []
+    for token in _TOKEN_RE.findall(text.lower().replace('ё', 'е')):
+        if token in STOP_WORDS or (len(token) < 2 and not token.isdigit()):
+            continue
+        if token.isdigit():
+            tokens.append(token)
+        elif _CYRILLIC_RE.search(token):
+            tokens.append(_ru_stemmer.stemWord(token) if _ru_stemmer else _light_stem_ru(token))
+        else:
+            tokens.append(_en_stemmer.stemWord(token) if _en_stemmer else token)
+    return tokens
+
+
+class LexicalIndex:
+    """
+    In-process BM25 inverted index over the chunks of one VectorDB.
+
+    Document ids are the chunk positions in the VectorDB, so both indexes can
+    be queried independently and their results fused. The index is updated
+    incrementally as chunks are added or tombstoned.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[int, int]] = {}
+        self.doc_lengths: Dict[int, int] = {}
+        self.total_length = 0
+        self.build_ms = 0.0
+
+    def __len__(self):
+        return len(self.doc_lengths)
+
+    def add(self, position: int, text: str) -> None:
+        """Index a chunk under its VectorDB position"""
+        if position in self.doc_lengths:
+            self.remove(position)
+        tokens = tokenize(text or '')
+        for term, tf in Counter(tokens).items():
+            self.postings.setdefault(term, {})[position] = tf
+        self.doc_lengths[position] = len(tokens)
+        self.total_length += len(tokens)
+
+    def add_many(self, items: Iterable[Tuple[int, str]]) -> None:
+        start = time.perf_counter()
+        for position, text in items:
+            self.add(position, text)
+        self.build_ms += (time.perf_counter() - start) * 1000
+
+    def remove(self, position: int, text: Optional[str] = None) -> None:
+        """Remove a chunk; without its text all postings are scanned"""
+        length = self.doc_lengths.pop(position, None)
+        if length is None:
+            return
+        self.total_length -= length
+        terms = set(tokenize(text)) if text is not None else list(self.postings)
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings and position in postings:
+                del postings[position]
+                if not postings:
+                    del self.postings[term]
+
+    def search(self, query: str, top_k: int = 10,
+               allowed: Optional[Set[int]] = None) -> List[Tuple[int, float]]:
+        """Return up to top_k (position, score) pairs by BM25 score"""
+        n_docs = len(self.doc_lengths)
+        if not n_docs:
+            return []
+        avg_length = self.total_length / n_docs or 1.0
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n_docs - len(postings) + 0.5) / (len(postings) + 0.5))
+            for position, tf in postings.items():
+                if allowed is not None and position not in allowed:
+                    continue
+                length = self.doc_lengths[position]
+                norm = tf * (BM25_K1 + 1) / (tf + BM25_K1 * (1 - BM25_B + BM25_B * length / avg_length))
+                scores[position] = scores.get(position, 0.0) + idf * norm
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:top_k]
+
+    def stats(self) -> Dict[str, float]:
+        """Size and build time of the index"""
+        postings_count = sum(len(postings) for postings in self.postings.values())
+        # Оценка памяти: ~100 байт на запись словаря постингов и ~60 байт на термин
+        return {
+            'documents': len(self.doc_lengths),
+            'terms': len(self.postings),
+            'postings': postings_count,
+            'approx_bytes': postings_count * 100 + len(self.postings) * 60,
+            'build_ms': round(self.build_ms, 1)
+        }
+
+    def save(self, path: str) -> None:
+        with open(path + '.tmp', 'wb') as f:
+            pickle.dump({
+                'postings': self.postings,
+                'doc_lengths': self.doc_lengths,
+                'total_length': self.total_length,
+                'build_ms': self.build_ms,
+                'stemmer': 'snowball' if snowballstemmer else 'light'
+            }, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path: str) -> Optional['LexicalIndex']:
+        """Load a saved index; returns None if missing or built with another stemmer"""
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+            if data.get('stemmer') != ('snowball' if snowballstemmer else 'light'):
+                return None
+            index = cls()
+            index.postings = data['postings']
+            index.doc_lengths = data['doc_lengths']
+            index.total_length = data['total_length']
+            index.build_ms = data.get('build_ms', 0.0)
+            return index
+        except Exception as e:
+            logger.error(f"Error loading lexical index {path}: {str(e)}")
+            return None
+
+
+def reciprocal_rank_fusion(rankings: List[List[int]], k: int = 60) -> List[Tuple[int, float]]:
+    """Fuse several ranked lists of positions by reciprocal rank"""
+    scores: Dict[int, float] = {}
+    for ranking in rankings:
+        for rank, position in enumerate(ranking):
+            scores[position] = scores.get(position, 0.0) + 1.0 / (k + rank + 1)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
@@ -0,0 +1,131 @@
+import os
+import bisect
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+
+from app.services import timing
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы в секундах: от 5 мс (FAISS) до 60 с (GigaChat под нагрузкой)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+STAGE_METRIC = 'rag_stage_duration_seconds'
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Histogram:
+    """Cumulative histogram in the Prometheus sense, one series per label value"""
+
+    def __init__(self, name: str, help_text: str, label: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.help_text = help_text
+        self.label = label
+        self.buckets = tuple(sorted(buckets))
+        self.lock = threading.Lock()
+        # label value -> [counts per bucket (+Inf last), sum, count]
+        self.series: Dict[str, List] = {}
+
+    def observe(self, label_value: str, value: float) -> None:
+        index = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label_value)
+            if series is None:
+                series = self.series[label_value] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self) -> List[str]:
+        lines = [f'# HELP {self.name} {self.help_text}', f'# TYPE {self.name} histogram']
+        with self.lock:
+            snapshot = {key: (list(counts), total, count) for key, (counts, total, count) in self.series.items()}
+        for label_value, (counts, total, count) in sorted(snapshot.items()):
+            label = f'{self.label}="{_escape(label_value)}"'
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{{{label},le="{bound:g}"}} {cumulative}')
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {count}')
+            lines.append(f'{self.name}_sum{{{label}}} {total:.6f}')
+            lines.append(f'{self.name}_count{{{label}}} {count}')
+        return lines
+
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+stage_durations = Histogram(STAGE_METRIC, 'Duration of RAG pipeline stages', 'stage')
+_collectors = [stage_durations]
+_installed = False
+_install_lock = threading.Lock()
+
+
+def _observe_stage(stage: str, elapsed_ms: float) -> None:
+    stage_durations.observe(stage, elapsed_ms / 1000)
+
+
+def install() -> None:
+    """Start aggregating timing spans (app.services.timing) into histograms"""
+    global _installed
+    with _install_lock:
+        if not _installed:
+            timing.add_listener(_observe_stage)
+            _installed = True
+
+
+def register(collector) -> None:
+    """Expose another collector (anything with render() -> list of lines) on /metrics"""
+    if collector not in _collectors:
+        _collectors.append(collector)
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    lines = []
+    for collector in list(_collectors):
+        try:
+            lines.extend(collector.render())
+        except Exception as e:
+            logger.error(f"Failed to render metrics: {str(e)}")
+    return '\n'.join(lines) + '\n'
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, format, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.split('?')[0] != '/metrics':
+            self.send_error(404)
+            return
+        body = render().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', CONTENT_TYPE)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port: Optional[int] = None, host: str = '0.0.0.0') -> Optional[ThreadingHTTPServer]:
+    """
+    Serve /metrics from a background thread (for processes without Flask, e.g. the bot).
+
+    The port defaults to BOT_METRICS_PORT; 0 disables the server.
+    """
+    if port is None:
+        port = int(os.environ.get('BOT_METRICS_PORT', '9102'))
+    if not port:
+        return None
+    install()
+    try:
+        server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    except OSError as e:
+        logger.error(f"Failed to start metrics server on port {port}: {str(e)}")
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='metrics', daemon=True).start()
+    logger.info(f"Metrics server listening on {host}:{port}")
+    return server
@@ -0,0 +1,165 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILES_DIR = os.path.join(os.getcwd(), 'app', 'data', 'profiles')
+MAX_SAMPLE_HZ = 250  # Верхняя граница частоты опроса, чтобы профилирование не нагружало процесс
+SAMPLE_HZ = min(int(os.environ.get('PROFILE_SAMPLE_HZ', '100')), MAX_SAMPLE_HZ)
+MAX_PROFILES_PER_HOUR = int(os.environ.get('PROFILE_MAX_PER_HOUR', '20'))
+MAX_STACK_DEPTH = 64
+SUMMARY_TOP = 30
+
+_recent = deque()  # Время запуска последних профилей - для ограничения частоты
+_recent_lock = threading.Lock()
+
+
+def _frame_name(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler for one thread.
+
+    A background thread snapshots the target thread's stack every
+    1/sample_hz seconds via sys._current_frames(); the profiled code runs
+    unmodified, so overhead stays flat regardless of how many calls it makes.
+    """
+
+    def __init__(self, thread_id: Optional[int] = None, sample_hz: int = SAMPLE_HZ):
+        self.thread_id = thread_id if thread_id is not None else threading.get_ident()
+        self.interval = 1.0 / max(1, min(sample_hz, MAX_SAMPLE_HZ))
+        self.stacks: Counter = Counter()
+        self.samples = 0
+        self.started = None
+        self.elapsed_s = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self) -> None:
+        frame = sys._current_frames().get(self.thread_id)
+        if frame is None:
+            return
+        stack = []
+        while frame is not None and len(stack) < MAX_STACK_DEPTH:
+            stack.append(_frame_name(frame))
+            frame = frame.f_back
+        # Корень стека первым - так ожидают инструменты flame graph
+        self.stacks[tuple(reversed(stack))] += 1
+        self.samples += 1
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self._sample()
+
+    def start(self) -> None:
+        self.started = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='profiler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.elapsed_s = time.perf_counter() - self.started
+
+    def folded(self) -> str:
+        """Collapsed stacks ("a;b;c count"), readable by flamegraph.pl and speedscope"""
+        return '\n'.join(f"{';'.join(stack)} {count}" for stack, count in self.stacks.most_common()) + '\n'
+
+    def summary(self) -> Dict:
+        """Per-function sample counts: self (top of stack) and total (anywhere on the stack)"""
+        own: Counter = Counter()
+        total: Counter = Counter()
+        for stack, count in self.stacks.items():
+            own[stack[-1]] += count
+            for name in set(stack):
+                total[name] += count
+        samples = max(self.samples, 1)
+
+        def rows(counter):
+            return [{'function': name, 'samples': count, 'share': round(count / samples, 4)}
+                    for name, count in counter.most_common(SUMMARY_TOP)]
+
+        return {
+            'elapsed_s': round(self.elapsed_s, 3),
+            'samples': self.samples,
+            'sample_hz': round(1 / self.interval),
+            'self': rows(own),
+            'total': rows(total)
+        }
+
+
+def _allow() -> bool:
+    """Rate cap: at most MAX_PROFILES_PER_HOUR profiles in a sliding hour"""
+    now = time.monotonic()
+    with _recent_lock:
+        while _recent and now - _recent[0] > 3600:
+            _recent.popleft()
+        if len(_recent) >= MAX_PROFILES_PER_HOUR:
+            return False
+        _recent.append(now)
+        return True
+
+
+def save_profile(profiler: SamplingProfiler, name: str, meta: Optional[Dict] = None) -> Optional[str]:
+    """Write <timestamp>-<name>.folded and .json into PROFILES_DIR; returns the base file name"""
+    try:
+        os.makedirs(PROFILES_DIR, exist_ok=True)
+        base = f"{datetime.utcnow().strftime('%Y%m%d-%H%M%S-%f')}-{name}"
+        with open(os.path.join(PROFILES_DIR, base + '.folded'), 'w', encoding='utf-8') as f:
+            f.write(profiler.folded())
+        with open(os.path.join(PROFILES_DIR, base + '.json'), 'w', encoding='utf-8') as f:
+            json.dump({'name': name, **(meta or {}), **profiler.summary()}, f, ensure_ascii=False, indent=2)
+        logger.info(f"Profile saved: {base} ({profiler.samples} samples, {profiler.elapsed_s:.2f} s)")
+        return base
+    except Exception as e:
+        logger.error(f"Failed to save profile {name}: {str(e)}")
+        return None
+
+
+@contextmanager
+def profile(name: str, enabled: bool = True, meta: Optional[Dict] = None):
+    """
+    Profile the enclosed block in the current thread.
+
+    Yields a dict that receives the saved file name under 'profile' once the
+    block finishes. Does nothing (and yields an empty dict) when disabled or
+    when the hourly rate cap is reached.
+    """
+    result: Dict[str, str] = {}
+    if not enabled:
+        yield result
+        return
+    if not _allow():
+        logger.warning(f"Profiling of {name} skipped: more than {MAX_PROFILES_PER_HOUR} profiles per hour")
+        yield result
+        return
+
+    profiler = SamplingProfiler()
+    profiler.start()
+    try:
+        yield result
+    finally:
+        profiler.stop()
+        saved = save_profile(profiler, name, meta)
+        if saved:
+            result['profile'] = saved
+
+
+def profile_requested(value: Optional[str]) -> bool:
+    """Whether a header/query value asks for profiling (must match PROFILE_TOKEN when it is set)"""
+    if not value:
+        return False
+    token = os.environ.get('PROFILE_TOKEN')
+    return value == token if token else value.lower() in ('1', 'true', 'yes')
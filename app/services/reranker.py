@@ -0,0 +1,78 @@
+import os
+import time
+import threading
+import logging
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+from typing import List, Dict, Any, Optional
+
+from app.services.timing import submit_in_context
+
+logger = logging.getLogger(__name__)
+
+RERANKER_MODEL_NAME = os.environ.get('RERANKER_MODEL', 'cross-encoder/mmarco-mMiniLMv2-L12-H384-v1')
+RERANK_BUDGET_MS = int(os.environ.get('RERANK_BUDGET_MS', '300'))  # Жесткий лимит времени на запрос
+RERANK_BATCH_SIZE = 16
+RERANK_MAX_LENGTH = 256  # Токенов на пару (вопрос, чанк)
+
+_model = None
+_model_lock = threading.Lock()
+# Отдельный пул, чтобы ожидание по таймауту не блокировало сам пересчет
+_rerank_pool = ThreadPoolExecutor(max_workers=2, thread_name_prefix='rerank')
+
+
+def get_reranker_model():
+    """Return the process-wide cross-encoder, loading it on first use"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                from sentence_transformers import CrossEncoder
+                _model = CrossEncoder(RERANKER_MODEL_NAME, max_length=RERANK_MAX_LENGTH, device='cpu')
+                logger.info(f"Reranker model loaded: {RERANKER_MODEL_NAME}")
+    return _model
+
+
+def _score(query: str, texts: List[str], batch_size: int, deadline: float) -> Optional[List[float]]:
+    """Score (query, text) pairs batch by batch, giving up once the deadline has passed"""
+    model = get_reranker_model()
+    scores = []
+    for start in range(0, len(texts), batch_size):
+        if time.perf_counter() > deadline:
+            return None
+        batch = [(query, text) for text in texts[start:start + batch_size]]
+        scores.extend(float(score) for score in model.predict(batch, batch_size=batch_size))
+    return scores
+
+
+def rerank(query: str, documents: List[Dict[str, Any]], budget_ms: int = RERANK_BUDGET_MS,
+           batch_size: int = RERANK_BATCH_SIZE) -> Optional[List[Dict[str, Any]]]:
+    """
+    Re-order retrieved chunks by cross-encoder relevance to the query.
+
+    Returns copies of the documents sorted by score, each with a 'rerank_score',
+    or None if scoring did not finish within budget_ms (the caller then keeps
+    the retrieval order). The first call also loads the model in the background
+    and usually falls back.
+    """
+    if not documents:
+        return []
+    texts = [doc.get('text', '') for doc in documents]
+    started = time.perf_counter()
+    deadline = started + budget_ms / 1000
+    future = submit_in_context(_rerank_pool, _score, query, texts, batch_size, deadline)
+    try:
+        scores = future.result(timeout=max(0.0, deadline - time.perf_counter()))
+    except FutureTimeoutError:
+        scores = None
+    except Exception as e:
+        logger.error(f"Error during reranking: {str(e)}")
+        return None
+
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if scores is None:
+        logger.warning(f"Reranking exceeded budget of {budget_ms} ms, using retrieval order")
+        return None
+
+    ranked = sorted(zip(scores, range(len(documents))), key=lambda item: item[0], reverse=True)
+    logger.info(f"Reranked {len(documents)} candidates in {elapsed_ms:.0f} ms")
+    return [dict(documents[idx], rerank_score=score) for score, idx in ranked]
@@ -0,0 +1,126 @@
+import os
+import time
+import logging
+import multiprocessing
+from typing import List, Dict, Any, Optional
+
+logger = logging.getLogger(__name__)
+
+# Ограничения для процесса извлечения текста из одного файла
+EXTRACTION_TIMEOUT = float(os.environ.get('EXTRACTION_TIMEOUT', 120))  # секунды
+EXTRACTION_MAX_RSS_MB = int(os.environ.get('EXTRACTION_MAX_RSS_MB', 1024))
+POLL_INTERVAL = 0.2
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class ExtractionError(Exception):
+    """Text extraction failed, timed out or exceeded its resource limits"""
+
+
+_context = None
+
+
+def _get_context():
+    """forkserver starts workers from a clean process without the embedding model's threads"""
+    global _context
+    if _context is None:
+        methods = multiprocessing.get_all_start_methods()
+        _context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        if 'forkserver' in methods:
+            _context.set_forkserver_preload(['app.file_processing'])
+    return _context
+
+
+def _read_rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process in MB (Linux only)"""
+    try:
+        with open(f'/proc/{pid}/statm', 'r') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _worker(conn, file_path: str, max_rss_mb: int) -> None:
+    """Entry point of the sandbox process"""
+    if resource is not None:
+        # Жесткий предел адресного пространства страхует от резкого роста памяти между проверками RSS
+        limit = max_rss_mb * 2 * 1024 * 1024
+        try:
+            resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+        except (ValueError, OSError):
+            pass
+    try:
+        from app.file_processing import process_file
+        conn.send(('ok', process_file(file_path)))
+    except MemoryError:
+        conn.send(('error', 'memory limit exceeded'))
+    except BaseException as e:
+        conn.send(('error', f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+
+def extract_sandboxed(file_path: str,
+                      timeout: float = EXTRACTION_TIMEOUT,
+                      max_rss_mb: int = EXTRACTION_MAX_RSS_MB) -> List[Dict[str, Any]]:
+    """
+    Extract segments of a file in a separate process.
+
+    The process is killed when it runs longer than `timeout` seconds or its
+    resident memory grows past `max_rss_mb`, so a malformed or enormous
+    document cannot stall or exhaust the calling web/bot/CLI process.
+    Raises ExtractionError with a human-readable reason on failure.
+    """
+    ctx = _get_context()
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_worker, args=(child_conn, file_path, max_rss_mb), daemon=True)
+    process.start()
+    child_conn.close()
+
+    deadline = time.monotonic() + timeout
+    reason = None
+    message = None
+    try:
+        while True:
+            if parent_conn.poll(POLL_INTERVAL):
+                try:
+                    message = parent_conn.recv()
+                except EOFError:
+                    reason = f"extraction worker crashed (exit code {process.exitcode})"
+                break
+            if not process.is_alive():
+                # Процесс мог отправить результат и завершиться между poll и is_alive
+                try:
+                    if parent_conn.poll(0):
+                        message = parent_conn.recv()
+                        break
+                except EOFError:
+                    pass
+                reason = f"extraction worker crashed (exit code {process.exitcode})"
+                break
+            if time.monotonic() > deadline:
+                reason = f"extraction timed out after {timeout:.0f}s"
+                break
+            rss = _read_rss_mb(process.pid)
+            if rss is not None and rss > max_rss_mb:
+                reason = f"extraction exceeded memory limit ({rss:.0f} MB > {max_rss_mb} MB)"
+                break
+    finally:
+        if process.is_alive() and message is None:
+            process.kill()
+        process.join(timeout=5)
+        parent_conn.close()
+
+    if message is not None:
+        status, payload = message
+        if status == 'ok':
+            return payload
+        reason = payload
+
+    logger.warning(f"Sandboxed extraction of {file_path} failed: {reason}")
+    raise ExtractionError(reason)
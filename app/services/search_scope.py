@@ -0,0 +1,50 @@
+import logging
+from typing import Iterable, Optional, Set, Tuple
+
+from app import db
+from app.models import Material, MaterialFile
+
+logger = logging.getLogger(__name__)
+
+
+def resolve_scope(course_id: Optional[int] = None, material_id: Optional[int] = None,
+                  file_id: Optional[int] = None,
+                  allowed_courses: Optional[Iterable[int]] = None) -> Optional[Set[str]]:
+    """
+    Content hashes of the files a search is limited to.
+
+    Returns None when no filter is given (search the whole index). With
+    allowed_courses (ids of the courses a user may search), files outside
+    those courses are never matched. Files uploaded before content hashing
+    have no hash and are not matched by filters until they are re-indexed.
+    Requires an application context.
+    """
+    if not (course_id or material_id or file_id) and allowed_courses is None:
+        return None
+
+    query = (db.session.query(MaterialFile.content_hash)
+             .join(Material, MaterialFile.material_id == Material.id)
+             .filter(MaterialFile.content_hash.isnot(None)))
+    if course_id:
+        query = query.filter(Material.course_id == course_id)
+    if material_id:
+        query = query.filter(MaterialFile.material_id == material_id)
+    if file_id:
+        query = query.filter(MaterialFile.id == file_id)
+    if allowed_courses is not None:
+        query = query.filter(Material.course_id.in_(list(allowed_courses)))
+    return {row.content_hash for row in query}
+
+
+def parse_page_range(first, last) -> Optional[Tuple[int, int]]:
+    """Page (or DOCX paragraph) range from optional form values; None if not given"""
+    try:
+        first = int(first) if first not in (None, '') else None
+        last = int(last) if last not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+    if first is None and last is None:
+        return None
+    first = first if first is not None else 1
+    last = last if last is not None else first
+    return (min(first, last), max(first, last))
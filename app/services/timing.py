@@ -0,0 +1,89 @@
+import time
+import asyncio
+import threading
+import logging
+import functools
+from contextlib import contextmanager
+import contextvars
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Словарь сбора этапов текущего запроса; в пулы потоков передается через contextvars.copy_context()
+_stages: ContextVar[Optional[Dict[str, float]]] = ContextVar('timing_stages', default=None)
+_stages_lock = threading.Lock()  # Этапы одного запроса могут записываться из нескольких потоков
+_listeners: List[Callable[[str, float], None]] = []
+
+
+def add_listener(listener: Callable[[str, float], None]) -> None:
+    """Call listener(stage, milliseconds) for every finished span in the process"""
+    _listeners.append(listener)
+
+
+def remove_listener(listener: Callable[[str, float], None]) -> None:
+    if listener in _listeners:
+        _listeners.remove(listener)
+
+
+def record(stage: str, elapsed_ms: float) -> None:
+    """Record a stage duration measured elsewhere"""
+    stages = _stages.get()
+    if stages is not None:
+        with _stages_lock:
+            stages[stage] = stages.get(stage, 0.0) + elapsed_ms
+    for listener in list(_listeners):
+        try:
+            listener(stage, elapsed_ms)
+        except Exception as e:
+            logger.error(f"Timing listener failed: {str(e)}")
+
+
+@contextmanager
+def span(stage: str):
+    """Time a pipeline stage (embedding, search, GigaChat call, ...)"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(stage, (time.perf_counter() - start) * 1000)
+
+
+def timed(stage: str):
+    """Decorator timing every call of a function or coroutine function as a span"""
+    def decorator(func):
+        if asyncio.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                with span(stage):
+                    return await func(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with span(stage):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+@contextmanager
+def collect_stages(stages: Optional[Dict[str, float]] = None):
+    """
+    Collect the stage durations of the current context into a dict.
+
+    Used to return per-request timings (e.g. to the load-test tool); nested
+    collections are restored on exit. Work submitted to thread pools is
+    included when it runs in a copy of the caller's context (submit_in_context).
+    """
+    collected = stages if stages is not None else {}
+    token = _stages.set(collected)
+    try:
+        yield collected
+    finally:
+        _stages.reset(token)
+
+
+def submit_in_context(executor, func, *args):
+    """executor.submit() that runs func in a copy of the caller's context, so its spans reach collect_stages"""
+    return executor.submit(contextvars.copy_context().run, func, *args)
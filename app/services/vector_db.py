@@ -1,20 +1,153 @@
 import os
 import json
+import shutil
+import threading
 import faiss
 import numpy as np
 import logging
-from sentence_transformers import SentenceTransformer
 import traceback
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from app.services.embeddings import get_embedding_model, encode_query, EMBEDDING_DIM
+from app.services.lexical_index import LexicalIndex, reciprocal_rank_fusion
+from app.services.dedup import DuplicateIndex, minhash_signature
+from app.services.timing import span, record, submit_in_context
 
 logger = logging.getLogger(__name__)
 
+# Компактация индекса запускается, когда удаленных чанков становится слишком много
+COMPACT_MIN_TOMBSTONES = 256
+COMPACT_TOMBSTONE_RATIO = 0.25
+
+INDEX_FILENAME = "vector_index.faiss"
+DOCUMENTS_FILENAME = "documents.json"
+LEXICAL_FILENAME = "lexical_index.pkl"
+DEDUP_FILENAME = "minhash_index.pkl"
+GENERATIONS_DIR = "generations"
+CURRENT_POINTER = "CURRENT"  # Имя активного поколения индекса
+
+# Гибридный поиск: сколько кандидатов берется из каждого индекса перед слиянием
+HYBRID_CANDIDATES = 20
+RRF_K = 60
+
+# Почти одинаковые чанки хранятся один раз, остальные копии - ссылками в 'aliases'
+DEDUP_ENABLED = os.environ.get('DEDUP_ENABLED', '1') != '0'
+
+# Векторный и лексический поиск выполняются параллельно
+_search_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='search')
+
+# Замки VectorDB, которые текущий контекст держит на чтение: id(lock) -> глубина вложенности
+_read_holds: ContextVar[dict] = ContextVar('vector_db_read_holds', default={})
+
+def _entries(doc):
+    """Metadata of every chunk a stored document stands for: itself and its collapsed duplicates"""
+    primary = {key: value for key, value in doc.items() if key != 'aliases'}
+    return [primary] + list(doc.get('aliases', []))
+
+def _overlaps(entry, pages):
+    """Whether a chunk's page (or paragraph) range intersects pages=(first, last)"""
+    start = entry.get('page', entry.get('paragraph'))
+    if start is None:
+        return False
+    end = entry.get('page_end', entry.get('paragraph_end', start))
+    return start <= pages[1] and end >= pages[0]
+
+class ReadWriteLock:
+    """
+    Shared/exclusive lock: searches run concurrently, mutations run alone.
+
+    Writers are preferred: once a writer is waiting, new readers wait too, so
+    a steady stream of searches cannot starve add_documents, reindex_content
+    or compaction. A reader that already holds the lock re-enters without
+    waiting (nested select() + search()); the hold is tracked in a context
+    variable, so work handed to _search_pool with submit_in_context counts as
+    part of the caller's read. The writing thread may re-enter and read;
+    upgrading a shared hold to exclusive is not supported.
+    """
+
+    def __init__(self):
+        self._cond = threading.Condition(threading.Lock())
+        self._readers = 0  # Контексты, держащие замок на чтение
+        self._waiting_writers = 0
+        self._writer = None
+        self._depth = 0
+
+    @contextmanager
+    def shared(self):
+        holds = _read_holds.get()
+        depth = holds.get(id(self), 0)
+        with self._cond:
+            owner = self._writer == threading.get_ident()
+            if not owner and not depth:
+                while self._writer is not None or self._waiting_writers:
+                    self._cond.wait()
+                self._readers += 1
+        token = _read_holds.set({**holds, id(self): depth + 1})
+        try:
+            yield
+        finally:
+            _read_holds.reset(token)
+            if not owner and not depth:
+                with self._cond:
+                    self._readers -= 1
+                    if not self._readers:
+                        self._cond.notify_all()
+
+    @contextmanager
+    def exclusive(self):
+        me = threading.get_ident()
+        with self._cond:
+            if self._writer != me:
+                self._waiting_writers += 1
+                try:
+                    while self._writer is not None or self._readers:
+                        self._cond.wait()
+                finally:
+                    self._waiting_writers -= 1
+                self._writer = me
+            self._depth += 1
+        try:
+            yield
+        finally:
+            with self._cond:
+                self._depth -= 1
+                if not self._depth:
+                    self._writer = None
+                    self._cond.notify_all()
+
+def _shared(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.shared():
+            return method(self, *args, **kwargs)
+    return wrapper
+
+def _exclusive(method):
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        with self.lock.exclusive():
+            return method(self, *args, **kwargs)
+    return wrapper
+
 class VectorDB:
+    """
+    FAISS index, chunk documents and the BM25/MinHash indexes kept beside them.
+
+    One instance is shared by all threads of a process (get_vector_db):
+    searches hold self.lock shared, methods that change the indexes hold it
+    exclusively. Callers that pair select() with a search keep both under
+    reading(), so positions cannot shift in between.
+    """
+
     def __init__(self, index_path, documents_path):
         """Initialize vector database with paths for index and documents"""
         self.index_path = index_path
         self.documents_path = documents_path
-        self.model = SentenceTransformer('sentence-transformers/paraphrase-multilingual-mpnet-base-v2')
-        self.embedding_dim = 768  # Размерность для модели paraphrase-multilingual-mpnet-base-v2
+        self.model = get_embedding_model()
+        self.embedding_dim = EMBEDDING_DIM
 
         # Создаем директории если они не существуют
         os.makedirs(os.path.dirname(index_path), exist_ok=True)
@@ -22,9 +155,21 @@ class VectorDB:
 
         self.documents = []
         self.index = None
+        self.content_index = {}  # content_hash -> позиции чанков этого файла в индексе
+        self.tombstone_count = 0  # Удаленные чанки, которые еще занимают место в индексе
+        self.saved_mtime = None  # Время изменения файла документов на момент загрузки/сохранения
+        self.lexical_path = os.path.join(os.path.dirname(documents_path), LEXICAL_FILENAME)
+        self.lexical = LexicalIndex()  # BM25-индекс по тем же позициям, что и FAISS
+        self.dedup_path = os.path.join(os.path.dirname(documents_path), DEDUP_FILENAME)
+        self.dedup = DuplicateIndex()  # MinHash-подписи для поиска почти одинаковых чанков
+        self.last_search_stats = {}
+        self.lock = ReadWriteLock()
 
         # Пытаемся загрузить существующий индекс и документы
         self.load()
+        self._rebuild_content_index()
+        self._load_lexical()
+        self._load_dedup()
 
         # Если индекс не существует, создаем новый
         if self.index is None:
@@ -48,6 +193,7 @@ class VectorDB:
 
             if os.path.exists(self.documents_path):
                 try:
+                    self.saved_mtime = os.path.getmtime(self.documents_path)
                     with open(self.documents_path, 'r', encoding='utf-8') as f:
                         self.documents = json.load(f)
                     logger.info(f"Successfully loaded documents, count: {len(self.documents)}")
@@ -62,12 +208,74 @@ class VectorDB:
             self.index = None
             self.documents = []
 
+    @_exclusive
+    def reload(self):
+        """Re-read index and documents written by another process"""
+        self.load()
+        self._rebuild_content_index()
+        self._load_lexical()
+        self._load_dedup()
+        if self.index is None:
+            self.index = faiss.IndexFlatL2(self.embedding_dim)
+
+    def _rebuild_content_index(self):
+        """Map file content hashes to the positions of their live chunks"""
+        self.content_index = {}
+        self.tombstone_count = 0
+        for position, doc in enumerate(self.documents):
+            if doc.get('deleted'):
+                self.tombstone_count += 1
+                continue
+            for entry in _entries(doc):
+                content_hash = entry.get('content_hash')
+                if content_hash:
+                    positions = self.content_index.setdefault(content_hash, [])
+                    if not positions or positions[-1] != position:
+                        positions.append(position)
+
+    def _load_lexical(self):
+        """Load the saved BM25 index, rebuilding it when it is out of sync with the documents"""
+        live = len(self.documents) - self.tombstone_count
+        lexical = LexicalIndex.load(self.lexical_path)
+        if lexical is not None and len(lexical) == live:
+            self.lexical = lexical
+            return
+        self._rebuild_lexical()
+
+    def _rebuild_lexical(self):
+        """Build the BM25 index from the texts of all live chunks"""
+        self.lexical = LexicalIndex()
+        self.lexical.add_many(
+            (position, doc.get('text', '')) for position, doc in enumerate(self.documents)
+            if not doc.get('deleted')
+        )
+        if self.documents:
+            logger.info(f"Lexical index built: {self.lexical.stats()}")
+
+    def _load_dedup(self):
+        """Load saved MinHash signatures, recomputing them when they are out of sync"""
+        dedup = DuplicateIndex.load(self.dedup_path)
+        if dedup is not None and dedup.document_count == len(self.documents):
+            self.dedup = dedup
+            return
+        self.dedup = DuplicateIndex()
+        for position, doc in enumerate(self.documents):
+            if not doc.get('deleted'):
+                self.dedup.add(position, minhash_signature(doc.get('text', '')))
+
+    @_shared
+    def has_content(self, content_hash):
+        """Check whether chunks of a file with this content hash are already indexed"""
+        return bool(self.content_index.get(content_hash))
+
+    @_exclusive
     def save(self):
         """Save index and documents to files"""
         try:
-            # Сохраняем индекс
+            # Сохраняем индекс (через временный файл, чтобы другие процессы не прочитали его наполовину)
             try:
-                faiss.write_index(self.index, self.index_path)
+                faiss.write_index(self.index, self.index_path + '.tmp')
+                os.replace(self.index_path + '.tmp', self.index_path)
                 logger.info(f"Index saved to {self.index_path}")
             except Exception as e:
                 logger.error(f"Error saving index: {e}\n{traceback.format_exc()}")
@@ -75,13 +283,26 @@ class VectorDB:
 
             # Сохраняем документы в JSON формате
             try:
-                with open(self.documents_path, 'w', encoding='utf-8') as f:
+                with open(self.documents_path + '.tmp', 'w', encoding='utf-8') as f:
                     json.dump(self.documents, f, ensure_ascii=False, indent=2)
+                os.replace(self.documents_path + '.tmp', self.documents_path)
+                self.saved_mtime = os.path.getmtime(self.documents_path)
                 logger.info(f"Documents saved to {self.documents_path}")
             except Exception as e:
                 logger.error(f"Error saving documents: {e}\n{traceback.format_exc()}")
                 return False
 
+            # Лексический индекс можно восстановить из документов, поэтому ошибка не критична
+            try:
+                self.lexical.save(self.lexical_path)
+            except Exception as e:
+                logger.error(f"Error saving lexical index: {e}")
+            try:
+                self.dedup.document_count = len(self.documents)
+                self.dedup.save(self.dedup_path)
+            except Exception as e:
+                logger.error(f"Error saving duplicate index: {e}")
+
             return True
         except Exception as e:
             logger.error(f"Error saving database: {e}\n{traceback.format_exc()}")
@@ -89,117 +310,660 @@ class VectorDB:
 
     def add_document(self, text, document_id):
         """Add document to index"""
+        return self.add_documents([{'id': document_id, 'text': text}]) == 1
+
+    @_exclusive
+    def add_documents(self, documents, batch_size=32, save=True):
+        """
+        Add a batch of documents to the index.
+
+        Each document is a dict with 'id' and 'text'; any other keys (page,
+        paragraph, source, ...) are stored alongside as metadata. Near-duplicates
+        of stored chunks (or of earlier chunks in the batch) are not embedded:
+        their metadata is attached to the existing chunk under 'aliases'. The
+        remaining texts are encoded in one pass and the database is saved once
+        (or not at all with save=False, when the caller checkpoints itself).
+        Returns the number of documents added, collapsed ones included.
+        """
+        previous_count = len(self.documents)
         try:
-            if not text or not isinstance(text, str):
-                logger.error(f"Invalid text for document {document_id}")
-                return False
+            valid = []
+            for doc in documents:
+                if not doc.get('text') or not isinstance(doc['text'], str):
+                    logger.error(f"Invalid text for document {doc.get('id')}")
+                    continue
+                valid.append(doc)
+            if not valid:
+                return 0
+
+            unique, aliases = self._collapse_duplicates(valid)
+
+            embedding_array = np.zeros((0, self.embedding_dim), dtype='float32')
+            if unique:
+                # Создаем embeddings одним проходом модели
+                with span('ingest_embedding'):
+                    embeddings = self.model.encode([doc['text'] for doc in unique], batch_size=batch_size)
+                embedding_array = np.asarray(embeddings, dtype='float32')
+
+                # Проверяем размерность embedding
+                if embedding_array.ndim != 2 or embedding_array.shape[1] != self.embedding_dim:
+                    logger.error(f"Wrong embedding shape: {embedding_array.shape}, expected (n, {self.embedding_dim})")
+                    self.dedup.truncate(previous_count)
+                    return 0
+
+            added = self._append(unique, embedding_array, save=save, aliases=aliases)
+            if not added:
+                return 0
+            collapsed = len(valid) - len(unique)
+            if collapsed:
+                logger.info(f"Collapsed {collapsed} near-duplicate chunks into existing ones")
+            return len(valid)
 
-            # Создаем embedding
-            embedding = self.model.encode([text])[0]
-            if embedding is None:
-                logger.error(f"Failed to create embedding for document {document_id}")
-                return False
+        except Exception as e:
+            self.dedup.truncate(previous_count)
+            logger.error(f"Error adding documents: {e}\n{traceback.format_exc()}")
+            return 0
+
+    def _collapse_duplicates(self, documents):
+        """
+        Split documents into ones to embed and near-duplicates of stored chunks.
+
+        Returns (unique, aliases): unique are copies to append (duplicates inside
+        the batch are already attached to them), aliases are (position, entry)
+        pairs for chunks that duplicate documents already in the index.
+        """
+        base = len(self.documents)
+        unique = []
+        aliases = []
+        for doc in documents:
+            if not DEDUP_ENABLED:
+                unique.append(dict(doc))
+                continue
+            signature = minhash_signature(doc['text'])
+            match = self.dedup.find(signature)
+            entry = {key: value for key, value in doc.items() if key not in ('text', 'aliases')}
+            if match is None:
+                self.dedup.add(base + len(unique), signature)
+                unique.append(dict(doc))
+            elif match >= base:
+                unique[match - base].setdefault('aliases', []).append(entry)
+            else:
+                aliases.append((match, entry))
+        return unique, aliases
 
-            # Проверяем размерность embedding
-            if embedding.shape[0] != self.embedding_dim:
-                logger.error(f"Wrong embedding dimension: {embedding.shape[0]}, expected {self.embedding_dim}")
-                return False
+    @_exclusive
+    def _append(self, documents, embedding_array, save=True, aliases=()):
+        """Append documents with precomputed embeddings (and duplicate references) and persist them"""
+        previous_count = len(self.documents)
+        try:
+            # Добавляем embedding в индекс
+            if len(documents):
+                self.index.add(embedding_array)
+        except Exception as e:
+            self.dedup.truncate(previous_count)
+            logger.error(f"Error adding embeddings to index: {e}\n{traceback.format_exc()}")
+            return 0
+
+        self.documents.extend(dict(doc) for doc in documents)
+        self.lexical.add_many(
+            (position, self.documents[position]['text'])
+            for position in range(previous_count, len(self.documents))
+        )
+        for position, entry in aliases:
+            self.documents[position].setdefault('aliases', []).append(entry)
+
+        # Сохраняем изменения
+        if save and not self.save():
+            # Если не удалось сохранить, откатываем изменения
+            for position, entry in aliases:
+                self.documents[position]['aliases'].remove(entry)
+                if not self.documents[position]['aliases']:
+                    del self.documents[position]['aliases']
+            for position in range(previous_count, len(self.documents)):
+                self.lexical.remove(position, self.documents[position]['text'])
+            del self.documents[previous_count:]
+            self.dedup.truncate(previous_count)
+            self.index.remove_ids(np.arange(previous_count, self.index.ntotal, dtype='int64'))
+            return 0
+
+        touched = [position for position, _ in aliases] + list(range(previous_count, len(self.documents)))
+        for position in touched:
+            for entry in _entries(self.documents[position]):
+                content_hash = entry.get('content_hash')
+                if content_hash:
+                    positions = self.content_index.setdefault(content_hash, [])
+                    if position not in positions:
+                        positions.append(position)
+
+        logger.info(f"Added {len(documents)} documents and {len(aliases)} duplicate references to database")
+        return len(documents) + len(aliases)
+
+    def reading(self):
+        """Hold the shared lock across several calls (e.g. select() and then search())"""
+        return self.lock.shared()
+
+    def _vector_positions(self, query, top_k, selected=None):
+        """Positions of the top_k live chunks nearest to the query embedding"""
+        # Создаем embedding запроса (повторные запросы берутся из кеша)
+        with span('embedding'):
+            query_embedding = encode_query(query)
+        if query_embedding is None:
+            logger.error("Failed to create embedding for query")
+            return []
 
-            # Добавляем документ в список
-            self.documents.append({
-                'id': document_id,
-                'text': text
-            })
+        return self._nearest(query_embedding.reshape(1, -1), top_k, selected)[0]
+
+    def _selector(self, selected):
+        """
+        FAISS ID selector restricting a search to the selected positions.
+
+        Sparse selections use a hashed ID batch, dense ones a bitmap over the
+        whole index (one bit per vector), so the cost of building the filter
+        stays proportional to the smaller of the two.
+        """
+        if len(selected) * 64 < self.index.ntotal:
+            return faiss.IDSelectorBatch(selected), None
+        mask = np.zeros(self.index.ntotal, dtype=bool)
+        mask[selected] = True
+        bitmap = np.packbits(mask, bitorder='little')
+        # Битовая маска должна жить, пока идет поиск - возвращаем ее вместе с селектором
+        return faiss.IDSelectorBitmap(bitmap), bitmap
+
+    def _nearest(self, query_embeddings, top_k, selected=None):
+        """
+        Search the FAISS index for each row of query_embeddings.
+
+        With selected (an array of positions), only those vectors are compared
+        with the queries. Returns a list of position lists, one per query.
+        """
+        try:
+            if selected is not None:
+                if not len(selected):
+                    return [[] for _ in range(len(query_embeddings))]
+                # Выбранные позиции всегда живые, запас на удаленные чанки не нужен
+                selector, _bitmap = self._selector(selected)
+                fetch_k = min(top_k, len(selected))
+                with span('faiss'):
+                    distances, indices = self.index.search(
+                        query_embeddings, fetch_k, params=faiss.SearchParameters(sel=selector)
+                    )
+            else:
+                # Ищем похожие документы (с запасом на удаленные чанки)
+                fetch_k = min(top_k + self.tombstone_count, self.index.ntotal)
+                with span('faiss'):
+                    distances, indices = self.index.search(query_embeddings, fetch_k)
+            logger.info(f"Found {indices.shape[1]} documents for {len(indices)} queries")
+        except Exception as e:
+            logger.error(f"Error searching in index: {e}\n{traceback.format_exc()}")
+            return [[] for _ in range(len(query_embeddings))]
+
+        results = []
+        for row in indices:
+            positions = []
+            for idx in row:
+                if idx >= 0 and idx < len(self.documents) and not self.documents[idx].get('deleted'):
+                    positions.append(int(idx))
+                    if len(positions) >= top_k:
+                        break
+            results.append(positions)
+        return results
+
+    @_shared
+    def select(self, content_hashes, pages=None):
+        """
+        Positions of live chunks of the given files, for filtered search.
+
+        content_hashes identify the files (a course, a material or one file,
+        see app.services.search_scope). pages is an optional (first, last)
+        range matched against each chunk's page range (paragraph range for
+        DOCX). Returns a sorted int64 array usable as `selected`.
+        """
+        selected = set()
+        for content_hash in content_hashes:
+            for position in self.content_index.get(content_hash, []):
+                if pages is None or any(
+                    entry.get('content_hash') == content_hash and _overlaps(entry, pages)
+                    for entry in _entries(self.documents[position])
+                ):
+                    selected.add(position)
+        return np.fromiter(sorted(selected), dtype='int64', count=len(selected))
+
+    def _filter_stats(self, selected):
+        if selected is None:
+            return {}
+        live = max(1, len(self.documents) - self.tombstone_count)
+        return {'selected': int(len(selected)), 'selectivity': round(len(selected) / live, 4)}
+
+    def _timed(self, func, *args):
+        start = time.perf_counter()
+        result = func(*args)
+        return result, (time.perf_counter() - start) * 1000
+
+    @_shared
+    def search(self, query, top_k=3, selected=None):
+        """Search for similar documents (only among `selected` positions, if given)"""
+        try:
+            if not query or not isinstance(query, str):
+                logger.error("Invalid query for search")
+                return []
 
-            try:
-                # Добавляем embedding в индекс
-                embedding_array = np.array([embedding]).astype('float32')
-                self.index.add(embedding_array)
-            except Exception as e:
-                logger.error(f"Error adding embedding to index: {e}\n{traceback.format_exc()}")
-                # Удаляем документ из списка, так как не удалось добавить в индекс
-                self.documents.pop()
-                return False
+            if self.index.ntotal - self.tombstone_count <= 0:
+                logger.warning("Database is empty")
+                return []
 
-            # Сохраняем изменения
-            if not self.save():
-                # Если не удалось сохранить, откатываем изменения
-                self.documents.pop()
-                return False
+            positions, vector_ms = self._timed(self._vector_positions, query, top_k, selected)
+            self.last_search_stats = {'mode': 'vector', 'vector_ms': round(vector_ms, 1),
+                                      **self._filter_stats(selected)}
+            return [self.documents[position] for position in positions]
+        except Exception as e:
+            logger.error(f"Error during search: {e}\n{traceback.format_exc()}")
+            return []
 
-            logger.info(f"Document {document_id} successfully added to database")
-            return True
+    @_shared
+    def search_batch(self, queries, top_k=3, selected=None, batch_size=64):
+        """
+        Search for many queries at once.
 
+        All queries are encoded in one model pass and matched with a single
+        FAISS matrix search. Returns one result list per query, in order; invalid
+        (empty or non-string) queries get an empty list.
+        """
+        results = [[] for _ in queries]
+        try:
+            valid = [idx for idx, query in enumerate(queries) if query and isinstance(query, str)]
+            if not valid or self.index.ntotal - self.tombstone_count <= 0:
+                return results
+
+            start = time.perf_counter()
+            with span('embedding'):
+                embeddings = self.model.encode([queries[idx] for idx in valid], batch_size=batch_size)
+            query_embeddings = np.asarray(embeddings, dtype='float32')
+            encode_ms = (time.perf_counter() - start) * 1000
+
+            positions = self._nearest(query_embeddings, top_k, selected)
+            for idx, row in zip(valid, positions):
+                results[idx] = [self.documents[position] for position in row]
+
+            self.last_search_stats = {
+                'mode': 'batch',
+                'queries': len(valid),
+                'encode_ms': round(encode_ms, 1),
+                'total_ms': round((time.perf_counter() - start) * 1000, 1),
+                **self._filter_stats(selected)
+            }
+            logger.info(f"Batch search: {self.last_search_stats}")
+            return results
         except Exception as e:
-            logger.error(f"Error adding document: {e}\n{traceback.format_exc()}")
-            return False
+            logger.error(f"Error during batch search: {e}\n{traceback.format_exc()}")
+            return results
 
-    def search(self, query, top_k=3):
-        """Search for similar documents"""
+    @_shared
+    def hybrid_search(self, query, top_k=3, candidates=HYBRID_CANDIDATES, selected=None):
+        """
+        Search with FAISS and the BM25 index in parallel and fuse the rankings.
+
+        Each index returns up to `candidates` chunks; the lists are merged by
+        reciprocal rank fusion, so exact terms (names, codes, numbers) found by
+        BM25 are not lost when the embedding misses them. Falls back to vector
+        order if the lexical search fails. With `selected`, both indexes only
+        consider those positions.
+        """
         try:
             if not query or not isinstance(query, str):
                 logger.error("Invalid query for search")
                 return []
 
-            if self.index.ntotal == 0:
+            if self.index.ntotal - self.tombstone_count <= 0:
                 logger.warning("Database is empty")
                 return []
 
-            # Создаем embedding запроса
-            query_embedding = self.model.encode([query])[0]
-            if query_embedding is None:
-                logger.error("Failed to create embedding for query")
-                return []
-
-            query_embedding = np.array([query_embedding]).astype('float32')
+            start = time.perf_counter()
+            candidates = max(candidates, top_k)
+            allowed = set(selected.tolist()) if selected is not None else None
+            vector_future = submit_in_context(_search_pool, self._timed, self._vector_positions, query, candidates, selected)
+            lexical_future = submit_in_context(_search_pool, self._timed, self.lexical.search, query, candidates, allowed)
 
-            # Ищем похожие документы
+            vector_positions, vector_ms = vector_future.result()
             try:
-                distances, indices = self.index.search(query_embedding, min(top_k, self.index.ntotal))
-                logger.info(f"Found {len(indices[0])} documents for query")
+                lexical_hits, lexical_ms = lexical_future.result()
             except Exception as e:
-                logger.error(f"Error searching in index: {e}\n{traceback.format_exc()}")
-                return []
-
-            results = []
-            for idx in indices[0]:
-                if idx >= 0 and idx < len(self.documents):
-                    results.append(self.documents[idx])
-            return results
+                # Индекс мог измениться во время поиска - используем только векторный результат
+                logger.error(f"Error during lexical search: {e}")
+                lexical_hits, lexical_ms = [], 0.0
+            record('bm25', lexical_ms)
+
+            lexical_positions = [position for position, _ in lexical_hits
+                                 if position < len(self.documents) and not self.documents[position].get('deleted')]
+            fused = reciprocal_rank_fusion([vector_positions, lexical_positions], k=RRF_K)
+
+            self.last_search_stats = {
+                'mode': 'hybrid',
+                'vector_ms': round(vector_ms, 1),
+                'lexical_ms': round(lexical_ms, 1),
+                'total_ms': round((time.perf_counter() - start) * 1000, 1),
+                'vector_hits': len(vector_positions),
+                'lexical_hits': len(lexical_positions),
+                **self._filter_stats(selected)
+            }
+            logger.info(f"Hybrid search: {self.last_search_stats}")
+            return [self.documents[position] for position, _ in fused[:top_k]]
         except Exception as e:
-            logger.error(f"Error during search: {e}\n{traceback.format_exc()}")
+            logger.error(f"Error during hybrid search: {e}\n{traceback.format_exc()}")
             return []
 
+    @_shared
+    def stats(self):
+        """Size of the vector and lexical indexes, for comparing both retrieval paths"""
+        ntotal = self.index.ntotal if self.index is not None else 0
+        return {
+            'vector': {
+                'vectors': ntotal,
+                'live_chunks': len(self.documents) - self.tombstone_count,
+                'tombstones': self.tombstone_count,
+                'approx_bytes': ntotal * self.embedding_dim * 4
+            },
+            'lexical': self.lexical.stats(),
+            'dedup': {
+                'chunks': sum(len(_entries(doc)) for doc in self.documents if not doc.get('deleted')),
+                'stored': len(self.documents) - self.tombstone_count
+            }
+        }
+
+    def _tombstone(self, positions):
+        """Mark chunks as deleted without touching the FAISS index"""
+        removed = 0
+        for position in positions:
+            doc = self.documents[position]
+            if doc.get('deleted'):
+                continue
+            self._unlink(position, _entries(doc), [])
+            self.lexical.remove(position, doc.get('text', ''))
+            self.dedup.remove(position)
+            # Текст удаленного чанка больше не нужен, вектор остается до компактации
+            self.documents[position] = {'id': doc['id'], 'deleted': True}
+            self.tombstone_count += 1
+            removed += 1
+        return removed
+
+    def _unlink(self, position, entries, kept):
+        """Remove a position from content_index for content hashes no longer present in it"""
+        kept_hashes = {entry.get('content_hash') for entry in kept}
+        for content_hash in {entry.get('content_hash') for entry in entries} - kept_hashes:
+            positions = self.content_index.get(content_hash)
+            if positions and position in positions:
+                positions.remove(position)
+                if not positions:
+                    del self.content_index[content_hash]
+
+    def _release(self, position, predicate):
+        """
+        Drop the chunk entries matching predicate from a stored document.
+
+        If collapsed duplicates from other files remain, the first of them takes
+        over the stored text and vector; otherwise the document is tombstoned.
+        Returns 1 if the document changed.
+        """
+        doc = self.documents[position]
+        if doc.get('deleted'):
+            return 0
+        entries = _entries(doc)
+        kept = [entry for entry in entries if not predicate(entry)]
+        if len(kept) == len(entries):
+            return 0
+        if not kept:
+            return self._tombstone([position])
+        head = dict(kept[0], text=doc['text'])
+        if len(kept) > 1:
+            head['aliases'] = kept[1:]
+        self.documents[position] = head
+        self._unlink(position, entries, kept)
+        return 1
+
+    def _maybe_compact(self):
+        """Compact the index when tombstones take up a large share of it"""
+        if (self.tombstone_count >= COMPACT_MIN_TOMBSTONES
+                and self.tombstone_count > COMPACT_TOMBSTONE_RATIO * self.index.ntotal):
+            self.compact()
+
+    @_exclusive
+    def compact(self):
+        """
+        Drop tombstoned chunks from the index.
+
+        Vectors of live chunks are read back from the flat index, so nothing
+        is re-encoded.
+        """
+        live = [position for position, doc in enumerate(self.documents) if not doc.get('deleted')]
+        new_index = faiss.IndexFlatL2(self.embedding_dim)
+        if live:
+            vectors = self.index.reconstruct_n(0, self.index.ntotal)
+            new_index.add(np.ascontiguousarray(vectors[live], dtype='float32'))
+        removed = len(self.documents) - len(live)
+        self.index = new_index
+        self.documents = [self.documents[position] for position in live]
+        self._rebuild_content_index()
+        self._rebuild_lexical()  # Позиции чанков сдвинулись
+        self.dedup = self.dedup.remapped(live)
+        logger.info(f"Index compacted, {removed} tombstones dropped")
+        return self.save()
+
+    @_exclusive
     def remove_document(self, document_id):
         """Удаление документа из индекса"""
         try:
-            # Находим индекс документа в списке
-            doc_idx = None
-            for idx, doc in enumerate(self.documents):
-                if doc['id'] == document_id:
-                    doc_idx = idx
-                    break
-
-            if doc_idx is not None:
-                # Удаляем документ из списка
-                self.documents.pop(doc_idx)
-
-                # Создаем новый индекс
-                new_index = faiss.IndexFlatL2(self.embedding_dim)
-
-                # Переиндексируем оставшиеся документы
-                for doc in self.documents:
-                    embedding = self.model.encode([doc['text']])[0]
-                    embedding_array = np.array([embedding]).astype('float32')
-                    new_index.add(embedding_array)
-
-                # Заменяем старый индекс новым
-                self.index = new_index
-                self.save()
+            positions = [idx for idx, doc in enumerate(self.documents)
+                         if not doc.get('deleted') and any(entry.get('id') == document_id for entry in _entries(doc))]
+            if not positions:
+                return False
 
-                logger.info(f"Документ {document_id} успешно удален из базы")
-                return True
-            return False
+            for position in positions:
+                self._release(position, lambda entry: entry.get('id') == document_id)
+            self._maybe_compact()
+            self.save()
+            logger.info(f"Документ {document_id} успешно удален из базы")
+            return True
         except Exception as e:
             logger.error(f"Ошибка при удалении документа: {e}")
-            return False
\ No newline at end of file
+            return False
+
+    @_exclusive
+    def remove_content(self, content_hash):
+        """Remove all chunks of a file by its content hash"""
+        try:
+            removed = sum(
+                self._release(position, lambda entry: entry.get('content_hash') == content_hash)
+                for position in list(self.content_index.get(content_hash, []))
+            )
+            if removed:
+                self._maybe_compact()
+                self.save()
+                logger.info(f"Removed {removed} chunks of content {content_hash}")
+            return removed
+        except Exception as e:
+            logger.error(f"Error removing content {content_hash}: {e}\n{traceback.format_exc()}")
+            return 0
+
+    @_exclusive
+    def remove_source(self, source):
+        """Remove chunks indexed without a content hash (before the content store) by their source path"""
+        def legacy(entry):
+            return entry.get('source') == source and not entry.get('content_hash')
+
+        try:
+            positions = [position for position, doc in enumerate(self.documents)
+                         if not doc.get('deleted') and any(legacy(entry) for entry in _entries(doc))]
+            removed = sum(self._release(position, legacy) for position in positions)
+            if removed:
+                self._maybe_compact()
+                self.save()
+                logger.info(f"Removed {removed} legacy chunks of {source}")
+            return removed
+        except Exception as e:
+            logger.error(f"Error removing chunks of {source}: {e}\n{traceback.format_exc()}")
+            return 0
+
+    @_exclusive
+    def reindex_content(self, old_hash, new_hash, chunks, exclusive=True, batch_size=32):
+        """
+        Re-index a file whose content changed from old_hash to new_hash.
+
+        chunks are the freshly extracted chunks of the new version, each with a
+        'chunk_hash'. Chunks whose hash is already stored under old_hash are
+        reused: updated in place when the old content belongs only to this file
+        (exclusive), otherwise attached to the stored chunk as a duplicate. Only
+        new or changed chunks are embedded, before anything old is touched; old
+        chunks that disappeared are released when exclusive. Returns counts of
+        reused, recomputed and removed chunks, or None if the new chunks could
+        not be embedded or saved.
+        """
+        stats = {'reused': 0, 'recomputed': 0, 'removed': 0}
+        old_positions = {}
+        for position in self.content_index.get(old_hash, []):
+            doc = self.documents[position]
+            if doc.get('content_hash') == old_hash and doc.get('chunk_hash'):
+                old_positions.setdefault(doc['chunk_hash'], []).append(position)
+
+        in_place = []
+        copied = []
+        to_embed = []
+        for chunk in chunks:
+            positions = old_positions.get(chunk['chunk_hash'])
+            if positions:
+                position = positions.pop(0)
+                (in_place if exclusive else copied).append((position, chunk))
+            else:
+                to_embed.append(chunk)
+
+        # Новые и изменившиеся чанки добавляются первыми: если эмбеддинги не получились,
+        # старая версия файла остается в индексе нетронутой
+        if to_embed:
+            stats['recomputed'] = self.add_documents(to_embed, batch_size=batch_size, save=False)
+            if not stats['recomputed']:
+                logger.error(f"Re-indexing {old_hash} -> {new_hash} failed: no chunks added, old chunks kept")
+                return None
+
+        if exclusive:
+            matched = {position for position, _ in in_place}
+            released = [position for position in self.content_index.get(old_hash, []) if position not in matched]
+
+            # Неизменившиеся чанки: обновляем метаданные без пересчета векторов.
+            # Дубликаты из старой версии файла будут заново привязаны при добавлении
+            for position, chunk in in_place:
+                aliases = [entry for entry in self.documents[position].get('aliases', [])
+                           if entry.get('content_hash') != old_hash]
+                self.documents[position] = dict(chunk, aliases=aliases) if aliases else dict(chunk)
+            stats['reused'] += len(in_place)
+
+            stats['removed'] = sum(
+                self._release(position, lambda entry: entry.get('content_hash') == old_hash)
+                for position in released
+            )
+            if in_place:
+                self._rebuild_content_index()
+
+        if copied:
+            # Тот же текст уже хранится - ссылаемся на него без копирования вектора
+            aliases = [(position, {key: value for key, value in chunk.items() if key != 'text'})
+                       for position, chunk in copied]
+            stats['reused'] += self._append([], None, save=False, aliases=aliases)
+
+        if not self.save():
+            return None
+
+        self._maybe_compact()
+        logger.info(f"Re-indexed content {old_hash} -> {new_hash}: {stats}")
+        return stats
+
+    @_shared
+    def dedup_report(self, content_hashes):
+        """
+        Chunks referenced by the given files vs. chunks actually stored for them.
+
+        Returns {'chunks', 'stored'}; 1 - stored / chunks is the index size
+        reduction from collapsing near-duplicates.
+        """
+        content_hashes = set(content_hashes)
+        chunks = 0
+        stored = set()
+        for content_hash in content_hashes:
+            for position in self.content_index.get(content_hash, []):
+                stored.add(position)
+                chunks += sum(1 for entry in _entries(self.documents[position])
+                              if entry.get('content_hash') == content_hash)
+        return {'chunks': chunks, 'stored': len(stored)}
+
+    @_shared
+    def owned_count(self, content_hash):
+        """Vectors stored for a file itself, i.e. chunks that did not collapse into another file's"""
+        return sum(1 for position in self.content_index.get(content_hash, [])
+                   if self.documents[position].get('content_hash') == content_hash)
+
+
+def resolve_index_dir(base_path):
+    """Return the directory of the active index generation (or base_path for the legacy layout)"""
+    pointer = os.path.join(base_path, CURRENT_POINTER)
+    if os.path.exists(pointer):
+        with open(pointer, 'r', encoding='utf-8') as f:
+            name = f.read().strip()
+        if name:
+            return os.path.join(base_path, GENERATIONS_DIR, name)
+    return base_path
+
+
+def open_vector_db(index_dir):
+    """Open the vector database stored in a directory"""
+    return VectorDB(
+        os.path.join(index_dir, INDEX_FILENAME),
+        os.path.join(index_dir, DOCUMENTS_FILENAME)
+    )
+
+
+def publish_generation(base_path, name, keep=1):
+    """
+    Atomically make a built generation the active index.
+
+    The CURRENT pointer is replaced with os.replace, so readers see either the
+    old or the new generation. Older generations beyond `keep` previous ones
+    are deleted.
+    """
+    pointer = os.path.join(base_path, CURRENT_POINTER)
+    previous = resolve_index_dir(base_path)
+    with open(pointer + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(name)
+    os.replace(pointer + '.tmp', pointer)
+    logger.info(f"Index generation {name} published")
+
+    generations_root = os.path.join(base_path, GENERATIONS_DIR)
+    protected = {name, os.path.basename(previous)}
+    stale = sorted(
+        entry for entry in os.listdir(generations_root)
+        if entry not in protected and os.path.isdir(os.path.join(generations_root, entry))
+        and not entry.startswith('.')
+    )
+    for entry in stale[:max(0, len(stale) - max(0, keep - 1))]:
+        shutil.rmtree(os.path.join(generations_root, entry), ignore_errors=True)
+
+
+_instances = {}
+_instances_lock = threading.Lock()
+
+
+def get_vector_db(base_path):
+    """
+    Return a process-wide VectorDB for base_path.
+
+    The instance follows generation swaps and reloads itself when another
+    process (web app, bot, CLI) has saved newer documents.
+    """
+    index_dir = resolve_index_dir(base_path)
+    with _instances_lock:
+        cached = _instances.get(base_path)
+        if cached is None or cached[0] != index_dir:
+            cached = (index_dir, open_vector_db(index_dir))
+            _instances[base_path] = cached
+        else:
+            vector_db = cached[1]
+            documents_path = vector_db.documents_path
+            if os.path.exists(documents_path) and os.path.getmtime(documents_path) != vector_db.saved_mtime:
+                vector_db.reload()
+        return cached[1]
@@ -1,6 +1,5 @@
 import numpy as np
 import logging
-from app.models import Material
 from app.ai import get_embedding, add_file_to_vector_db, answer_question
 import os
 
@@ -34,28 +33,24 @@ class VectorSearch:
             logger.error(f"Error adding file to index: {e}")
             return False
 
-    def search(self, query, k=5):
-        """Поиск похожих материалов"""
+    def search(self, query, k=5, course_id=None, material_id=None, file_id=None, pages=None):
+        """Поиск похожих материалов (с фильтром по курсу, материалу, файлу и страницам)"""
         try:
-            response = answer_question(query, self.vector_db_path)
+            response = answer_question(query, self.vector_db_path, course_id=course_id,
+                                       material_id=material_id, file_id=file_id, pages=pages)
             return [{'content': response}] if response else []
         except Exception as e:
             logger.error(f"Error during vector search: {e}")
             return []
 
-    def rebuild_index(self):
-        """Перестроение индекса из базы данных"""
+    def rebuild_index(self, workers=None):
+        """Перестроение индекса из файлов материалов (MaterialFile) в новое поколение"""
         try:
-            materials = Material.query.all()
-            success_count = 0
-
-            for material in materials:
-                if material.file_path and os.path.exists(material.file_path):
-                    if self.add_to_index(material.file_path):
-                        success_count += 1
-
-            logger.info(f"Index rebuilt successfully. Processed {success_count} out of {len(materials)} materials")
+            from app.services.ingestion import rebuild_index
+            stats = rebuild_index(self.vector_db_path, workers=workers)
+            logger.info(f"Index rebuilt successfully. Processed {stats['files_done']} files, "
+                        f"{stats['chunks']} chunks, {stats['failed']} failed")
             return True
         except Exception as e:
             logger.error(f"Error rebuilding index: {e}")
-            return False
\ No newline at end of file
+            return False
@@ -0,0 +1,6 @@
+"""
+Retrieval and load benchmarks for the course assistant.
+
+    python -m benchmarks.retrieval --sizes 1000,10000 --configs flat,hybrid,hnsw,ivf
+    python -m benchmarks.compare benchmarks/results/old.json benchmarks/results/new.json
+"""
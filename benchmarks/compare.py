@@ -0,0 +1,59 @@
+"""
+Compare two benchmark result files and flag regressions.
+
+    python -m benchmarks.compare baseline.json candidate.json [--max-recall-drop 0.01] [--max-latency-increase 0.2]
+
+Runs are matched by (size, config). Exits with status 1 if any matched run
+lost more recall@5 / MRR than allowed or its p95 latency grew by more than
+the allowed fraction.
+"""
+import sys
+import json
+import argparse
+from typing import Dict, Tuple
+
+
+def _load_runs(path: str) -> Dict[Tuple[int, str], Dict]:
+    with open(path, 'r', encoding='utf-8') as f:
+        report = json.load(f)
+    return {(run['size'], run['config']): run for run in report.get('runs', [])}
+
+
+def compare(baseline: Dict, candidate: Dict, max_recall_drop: float, max_latency_increase: float):
+    """Yield (key, metric, old, new, regressed) for every matched run"""
+    for key in sorted(set(baseline) & set(candidate)):
+        old, new = baseline[key], candidate[key]
+        for metric in ('recall@5', 'mrr@10'):
+            if metric in old and metric in new:
+                yield key, metric, old[metric], new[metric], old[metric] - new[metric] > max_recall_drop
+        old_p95 = old.get('latency_ms', {}).get('p95')
+        new_p95 = new.get('latency_ms', {}).get('p95')
+        if old_p95 and new_p95:
+            yield key, 'p95_ms', old_p95, new_p95, new_p95 > old_p95 * (1 + max_latency_increase)
+        if old.get('build_s') and new.get('build_s'):
+            yield key, 'build_s', old['build_s'], new['build_s'], False
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Compare two retrieval benchmark results')
+    parser.add_argument('baseline')
+    parser.add_argument('candidate')
+    parser.add_argument('--max-recall-drop', type=float, default=0.01)
+    parser.add_argument('--max-latency-increase', type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    regressions = 0
+    for (size, config), metric, old, new, regressed in compare(
+            _load_runs(args.baseline), _load_runs(args.candidate),
+            args.max_recall_drop, args.max_latency_increase):
+        regressions += regressed
+        marker = 'REGRESSION' if regressed else ''
+        print(f"{size:>8} {config:<8} {metric:<10} {old:>10} -> {new:<10} {marker}")
+
+    if regressions:
+        print(f"{regressions} regression(s)", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
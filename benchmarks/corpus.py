@@ -0,0 +1,166 @@
+"""Synthetic course corpus with labelled question -> chunk pairs."""
+import json
+import random
+import hashlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Слоги для псевдотерминов: у каждого чанка свой уникальный термин, как названия
+# теорем, алгоритмов и персоналий в реальных курсах
+_SYLLABLES = ['ка', 'ро', 'ми', 'ле', 'ту', 'ва', 'но', 'зе', 'пли', 'дор', 'стан', 'вер', 'гал', 'тин',
+              'мор', 'сел', 'бра', 'кви', 'фер', 'лот', 'нис', 'дум', 'рак', 'жен']
+
+TOPICS = {
+    'Линейная алгебра': {
+        'kinds': ['теорема', 'метод', 'критерий', 'разложение'],
+        'purposes': ['решения систем линейных уравнений', 'вычисления определителей',
+                     'поиска собственных значений', 'ортогонализации базиса'],
+        'properties': ['сохраняет ранг матрицы', 'работает только для квадратных матриц',
+                       'устойчив к ошибкам округления', 'требует невырожденности матрицы'],
+        'filler': ['Матрица называется симметричной, если она совпадает со своей транспонированной.',
+                   'Ранг матрицы равен максимальному числу линейно независимых строк.',
+                   'Определитель произведения матриц равен произведению их определителей.']
+    },
+    'История России': {
+        'kinds': ['реформа', 'указ', 'договор', 'съезд'],
+        'purposes': ['укрепления центральной власти', 'реорганизации армии',
+                     'развития торговли', 'изменения системы налогов'],
+        'properties': ['была отменена через десять лет', 'вызвала массовые протесты',
+                       'действовала только в столицах', 'была поддержана дворянством'],
+        'filler': ['Исторические источники того периода сохранились лишь частично.',
+                   'Историки до сих пор спорят о последствиях этих событий.',
+                   'Реформы проводились в условиях затяжной войны.']
+    },
+    'Программирование на Python': {
+        'kinds': ['модуль', 'паттерн', 'алгоритм', 'декоратор'],
+        'purposes': ['кеширования результатов функций', 'параллельной обработки данных',
+                     'сериализации объектов', 'обхода графов'],
+        'properties': ['не блокирует цикл событий', 'потребляет память линейно от размера входа',
+                       'является потокобезопасным', 'работает только с хешируемыми объектами'],
+        'filler': ['Списки в Python изменяемы, а кортежи нет.',
+                   'Генераторы позволяют обрабатывать данные лениво.',
+                   'Исключения перехватываются конструкцией try/except.']
+    },
+    'Микроэкономика': {
+        'kinds': ['модель', 'закон', 'эффект', 'показатель'],
+        'purposes': ['оценки эластичности спроса', 'анализа рыночного равновесия',
+                     'расчета издержек фирмы', 'описания поведения потребителя'],
+        'properties': ['предполагает совершенную конкуренцию', 'не учитывает внешние эффекты',
+                       'справедлив только в краткосрочном периоде', 'основан на убывающей предельной полезности'],
+        'filler': ['Спрос обычно снижается при росте цены товара.',
+                   'Предельные издержки показывают затраты на выпуск дополнительной единицы.',
+                   'Монополия устанавливает цену выше предельных издержек.']
+    }
+}
+
+# Доля англоязычных чанков: в курсах встречаются материалы на английском
+ENGLISH_SHARE = 0.1
+_EN_TEMPLATE = "{entity} is a {kind} from the course \"{topic}\", first introduced in {year}."
+_EN_KIND = {'теорема': 'theorem', 'метод': 'method', 'критерий': 'criterion', 'разложение': 'decomposition',
+            'реформа': 'reform', 'указ': 'decree', 'договор': 'treaty', 'съезд': 'congress',
+            'модуль': 'module', 'паттерн': 'pattern', 'алгоритм': 'algorithm', 'декоратор': 'decorator',
+            'модель': 'model', 'закон': 'law', 'эффект': 'effect', 'показатель': 'indicator'}
+
+_QUESTIONS = [
+    ('purpose', 'Для чего применяется {entity}?'),
+    ('year', 'В каком году был предложен {entity}?'),
+    ('property', 'Какое основное свойство у {entity}?'),
+    ('kind', 'Что такое {entity} в курсе «{topic}»?')
+]
+
+
+def _entity_name(index: int, rng: random.Random) -> str:
+    """Unique pseudo-term: the index in base len(_SYLLABLES) plus a random syllable"""
+    parts = [rng.choice(_SYLLABLES)]
+    n = index
+    while True:
+        parts.append(_SYLLABLES[n % len(_SYLLABLES)])
+        n //= len(_SYLLABLES)
+        if not n:
+            break
+    return ''.join(parts).capitalize()
+
+
+def generate_corpus(size: int, seed: int = 42, question_count: int = 500) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Generate `size` chunks and `question_count` questions, each labelled with the chunk that answers it.
+
+    Chunks are shaped like chunker output (id, text, content_hash, chunk_index,
+    page); every 20 chunks form one "file". Questions are phrased differently
+    from the chunk text and share only the term and topic with it.
+    """
+    rng = random.Random(seed)
+    topics = list(TOPICS)
+    chunks = []
+    facts = []
+    for index in range(size):
+        topic = topics[index % len(topics)]
+        spec = TOPICS[topic]
+        entity = _entity_name(index, rng)
+        fact = {
+            'entity': entity,
+            'topic': topic,
+            'kind': rng.choice(spec['kinds']),
+            'purpose': rng.choice(spec['purposes']),
+            'property': rng.choice(spec['properties']),
+            'year': rng.randint(1700, 2020)
+        }
+        fact['english'] = rng.random() < ENGLISH_SHARE
+        if fact['english']:
+            text = _EN_TEMPLATE.format(**dict(fact, kind=_EN_KIND[fact['kind']]))
+        else:
+            text = (f"{topic}. {entity} ({fact['kind']}) впервые описан в {fact['year']} году. "
+                    f"Применяется для {fact['purpose']}. Основное свойство: {fact['property']}. "
+                    + ' '.join(rng.sample(spec['filler'], 2)))
+        file_index = index // 20
+        content_hash = hashlib.sha256(f"{seed}:{file_index}".encode()).hexdigest()
+        chunks.append({
+            'id': f"{content_hash}:{index % 20}",
+            'text': text,
+            'content_hash': content_hash,
+            'chunk_index': index % 20,
+            'page': index % 20 + 1
+        })
+        facts.append(fact)
+
+    questions = []
+    for index in rng.sample(range(size), min(question_count, size)):
+        # В англоязычных чанках есть только год и тип термина
+        options = _QUESTIONS[1::3] if facts[index]['english'] else _QUESTIONS
+        kind, template = rng.choice(options)
+        questions.append({
+            'question': template.format(**facts[index]),
+            'chunk_id': chunks[index]['id'],
+            'kind': kind
+        })
+    return chunks, questions
+
+
+def corpus_fingerprint(chunks: List[Dict]) -> str:
+    """Short hash identifying a corpus (used to cache its embeddings)"""
+    digest = hashlib.sha1()
+    for chunk in chunks:
+        digest.update(chunk['id'].encode())
+        digest.update(chunk['text'].encode())
+    return digest.hexdigest()[:16]
+
+
+def save_jsonl(path: str, rows: List[Dict]) -> None:
+    with open(path, 'w', encoding='utf-8') as f:
+        for row in rows:
+            f.write(json.dumps(row, ensure_ascii=False) + '\n')
+
+
+def load_jsonl(path: str, limit: Optional[int] = None) -> List[Dict]:
+    rows = []
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                rows.append(json.loads(line))
+                if limit and len(rows) >= limit:
+                    break
+    return rows
+
+
+def iter_batches(rows: List, batch_size: int) -> Iterator[List]:
+    for start in range(0, len(rows), batch_size):
+        yield rows[start:start + batch_size]
@@ -0,0 +1,343 @@
+"""
+End-to-end load test of the question-answering pipeline.
+
+    # Web: replay questions against a running app (/chat/ask) at rising concurrency
+    python -m benchmarks.load_test web --url http://127.0.0.1:5000 --course-id 1 --concurrency 1,2,4,8,16
+
+    # Bot: feed fake Telegram updates into CourseBot in-process (no network)
+    python -m benchmarks.load_test bot --course-id 1 --concurrency 1,2,4,8 --questions-per-user 5 --start-mock
+
+--start-mock runs benchmarks.mock_gigachat in this process. For the bot it
+is used directly. For the web mode, start the app with the printed
+GIGACHAT_* variables. Each concurrency level reports throughput, error
+rate, end-to-end p50/p95/p99 and the tail latency of every pipeline stage
+(search, rerank, GigaChat token/completion, Telegram API). The saturation
+point is the level after which throughput stops growing or p95 doubles.
+
+All web requests come from one address, so start the app with
+QUESTION_RATE_PER_MINUTE=0 and QUESTION_MAX_QUEUED_PER_USER=0 or the
+per-user limits of the question scheduler reject most of the load. The
+requests are anonymous: set STAGE_TIMINGS_PUBLIC=1 as well, otherwise
+/chat/ask returns no stage timings.
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks.corpus import generate_corpus, load_jsonl
+from benchmarks.mock_gigachat import MockSettings, start_mock_server
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+ERROR_ANSWER_PREFIX = 'Извините'  # answer_question так начинает ответы об ошибках
+SATURATION_GAIN = 0.1  # Рост пропускной способности меньше 10% - насыщение
+SATURATION_P95_FACTOR = 2.0
+
+
+def _percentile(values: List[float], q: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q / 100
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    return {
+        'p50': round(_percentile(values, 50), 1),
+        'p95': round(_percentile(values, 95), 1),
+        'p99': round(_percentile(values, 99), 1),
+        'max': round(max(values), 1),
+        'count': len(values)
+    }
+
+
+def summarize_level(concurrency: int, samples: List[Dict], elapsed_s: float,
+                    stages: Optional[Dict[str, List[float]]] = None) -> Dict:
+    """Aggregate request samples {latency_ms, ok, stages} of one concurrency level"""
+    stages = stages if stages is not None else {}
+    for sample in samples:
+        for stage, ms in sample.get('stages', {}).items():
+            stages.setdefault(stage, []).append(ms)
+    failed = sum(1 for sample in samples if not sample['ok'])
+    return {
+        'concurrency': concurrency,
+        'requests': len(samples),
+        'elapsed_s': round(elapsed_s, 2),
+        'throughput_rps': round(len(samples) / elapsed_s, 2) if elapsed_s else 0.0,
+        'error_rate': round(failed / len(samples), 4) if samples else 0.0,
+        'latency_ms': latency_summary([sample['latency_ms'] for sample in samples]),
+        'stages': {stage: latency_summary(values) for stage, values in sorted(stages.items())}
+    }
+
+
+def find_saturation(levels: List[Dict]) -> Optional[Dict]:
+    """First concurrency level beyond which adding clients no longer helps"""
+    if not levels:
+        return None
+    base_p95 = levels[0]['latency_ms'].get('p95', 0)
+    for previous, current in zip(levels, levels[1:]):
+        gain = (current['throughput_rps'] - previous['throughput_rps']) / max(previous['throughput_rps'], 1e-9)
+        if gain < SATURATION_GAIN:
+            return {'concurrency': previous['concurrency'], 'reason': f'throughput +{gain:.0%} at {current["concurrency"]}'}
+        if base_p95 and current['latency_ms'].get('p95', 0) > base_p95 * SATURATION_P95_FACTOR:
+            return {'concurrency': previous['concurrency'], 'reason': f'p95 x{SATURATION_P95_FACTOR:g} at {current["concurrency"]}'}
+    return None
+
+
+def load_questions(path: Optional[str], count: int, seed: int) -> List[str]:
+    """Questions from a JSONL file ({"question": ...}) or from the synthetic benchmark corpus"""
+    if path:
+        questions = [row['question'] for row in load_jsonl(path)]
+    else:
+        _, labelled = generate_corpus(max(count, 100), seed=seed, question_count=count)
+        questions = [row['question'] for row in labelled]
+    random.Random(seed).shuffle(questions)
+    return questions
+
+
+def _print_level(mode: str, level: Dict) -> None:
+    latency = level['latency_ms']
+    stages = ', '.join(f"{stage} p95={summary['p95']}" for stage, summary in level['stages'].items())
+    print(f"[{mode}] c={level['concurrency']:<3} {level['throughput_rps']:>7.2f} req/s  "
+          f"p50={latency.get('p50')} p95={latency.get('p95')} p99={latency.get('p99')} ms  "
+          f"errors={level['error_rate']:.1%}  {stages}", file=sys.stderr)
+
+
+# --- Web: /chat/ask ---------------------------------------------------------
+
+def run_web(args, questions: List[str]) -> List[Dict]:
+    import requests
+
+    url = args.url.rstrip('/') + '/chat/ask'
+    session_local = threading.local()
+
+    def ask(question: str) -> Dict:
+        session = getattr(session_local, 'session', None)
+        if session is None:
+            session = session_local.session = requests.Session()
+        start = time.perf_counter()
+        try:
+            response = session.post(url, data={'course_id': args.course_id, 'question': question},
+                                    headers={'X-Stage-Timings': '1'}, timeout=args.timeout)
+            latency = (time.perf_counter() - start) * 1000
+            data = response.json() if response.ok else {}
+            ok = bool(data.get('success')) and not str(data.get('answer', '')).startswith(ERROR_ANSWER_PREFIX)
+            return {'latency_ms': latency, 'ok': ok, 'stages': data.get('timings', {})}
+        except Exception:
+            return {'latency_ms': (time.perf_counter() - start) * 1000, 'ok': False, 'stages': {}}
+
+    for question in questions[:2]:
+        ask(question)  # Прогрев: модели загружаются при первом запросе
+
+    levels = []
+    for concurrency in args.concurrency:
+        batch = [questions[i % len(questions)] for i in range(args.requests)]
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            samples = list(pool.map(ask, batch))
+        level = summarize_level(concurrency, samples, time.perf_counter() - start)
+        _print_level('web', level)
+        levels.append(level)
+    return levels
+
+
+# --- Bot: fake Telegram update feed into CourseBot --------------------------
+
+def _make_fake_session(latency_ms: float):
+    from aiogram.client.session.base import BaseSession
+    from aiogram.types import Chat, Message
+    from app.services.timing import record
+
+    class FakeTelegramSession(BaseSession):
+        """Answers Bot API calls locally after a fixed delay instead of calling Telegram"""
+
+        def __init__(self):
+            super().__init__()
+            self.calls: Dict[str, int] = {}
+            self.answers: Dict[int, str] = {}  # Последнее отправленное сообщение по чату
+            self.message_id = 0
+
+        async def make_request(self, bot, method, timeout=None):
+            start = time.perf_counter()
+            await asyncio.sleep(latency_ms / 1000)
+            name = type(method).__name__
+            self.calls[name] = self.calls.get(name, 0) + 1
+            record('telegram_api', (time.perf_counter() - start) * 1000)
+            if name == 'SendMessage':
+                self.message_id += 1
+                self.answers[int(method.chat_id)] = method.text
+                return Message(message_id=self.message_id, date=datetime.now(),
+                               chat=Chat(id=int(method.chat_id), type='private'), text=method.text)
+            return True
+
+        async def stream_content(self, url, headers=None, timeout=30, chunk_size=65536, raise_for_status=True):
+            if False:
+                yield b''
+
+        async def close(self):
+            pass
+
+    return FakeTelegramSession()
+
+
+def _user(user_id: int) -> Dict:
+    return {'id': user_id, 'is_bot': False, 'first_name': f'Load{user_id}'}
+
+
+def _chat(user_id: int) -> Dict:
+    return {'id': user_id, 'type': 'private'}
+
+
+async def _bot_levels(args, questions: List[str]) -> Tuple[List[Dict], Dict[str, int]]:
+    # Лимиты частоты вопросов измерению пропускной способности не нужны (задаются до импорта приложения)
+    os.environ.setdefault('QUESTION_RATE_PER_MINUTE', '0')
+    from aiogram import Bot
+    from aiogram.types import Update
+    from app import create_app
+    from app.bot.bot import CourseBot
+    from app.services.timing import add_listener, remove_listener
+
+    os.environ.setdefault('TELEGRAM_BOT_TOKEN', '123456:LOADTEST')
+    course_bot = CourseBot(create_app())
+    session = _make_fake_session(args.telegram_latency_ms)
+    session.middleware(course_bot.outbox)
+    course_bot.bot = Bot(token=course_bot.token, session=session)
+    bot = course_bot.bot
+
+    counter = {'update': 0, 'question': 0}
+
+    async def feed(payload: Dict) -> None:
+        counter['update'] += 1
+        payload['update_id'] = counter['update']
+        update = Update.model_validate(payload, context={'bot': bot})
+        await course_bot.dp.feed_update(bot, update)
+
+    levels = []
+    for level_number, concurrency in enumerate(args.concurrency):
+        samples: List[Dict] = []
+        stage_values: Dict[str, List[float]] = {}
+
+        async def user_flow(user_id: int):
+            # Выбор курса, затем серия вопросов от одного пользователя
+            await feed({'callback_query': {
+                'id': f'cb{user_id}', 'from': _user(user_id), 'chat_instance': 'load',
+                'data': f'ask_course_{args.course_id}',
+                'message': {'message_id': 1, 'date': int(time.time()), 'chat': _chat(user_id), 'text': 'Курсы'}
+            }})
+            for _ in range(args.questions_per_user):
+                question = questions[counter['question'] % len(questions)]
+                counter['question'] += 1
+                start = time.perf_counter()
+                await feed({'message': {
+                    'message_id': counter['update'] + 1, 'date': int(time.time()), 'chat': _chat(user_id),
+                    'from': _user(user_id), 'text': question
+                }})
+                answer = session.answers.get(user_id, '')
+                samples.append({'latency_ms': (time.perf_counter() - start) * 1000,
+                                'ok': bool(answer) and not answer.startswith('❌') and ERROR_ANSWER_PREFIX not in answer})
+
+        # Обработчики могут выполняться в других потоках, поэтому этапы сводятся по уровню целиком
+        def listener(stage: str, ms: float) -> None:
+            stage_values.setdefault(stage, []).append(ms)
+
+        add_listener(listener)
+        try:
+            base_id = 1_000_000 + level_number * 10_000
+            start = time.perf_counter()
+            await asyncio.gather(*(user_flow(base_id + i) for i in range(concurrency)))
+            elapsed = time.perf_counter() - start
+        finally:
+            remove_listener(listener)
+
+        level = summarize_level(concurrency, samples, elapsed, stage_values)
+        _print_level('bot', level)
+        levels.append(level)
+
+    await bot.session.close()
+    return levels, session.calls
+
+
+def run_bot(args, questions: List[str]) -> Tuple[List[Dict], Dict[str, int]]:
+    return asyncio.run(_bot_levels(args, questions))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Load-test the question answering pipeline')
+    parser.add_argument('mode', choices=['web', 'bot'])
+    parser.add_argument('--course-id', type=int, required=True)
+    parser.add_argument('--concurrency', default='1,2,4,8,16', help='Concurrency levels, comma-separated')
+    parser.add_argument('--questions', help='JSONL file with {"question": ...} per line (default: synthetic)')
+    parser.add_argument('--seed', type=int, default=7)
+    parser.add_argument('--url', default='http://127.0.0.1:5000', help='Web app base URL (web mode)')
+    parser.add_argument('--requests', type=int, default=100, help='Requests per concurrency level (web mode)')
+    parser.add_argument('--timeout', type=float, default=120)
+    parser.add_argument('--questions-per-user', type=int, default=5, help='Questions per fake user (bot mode)')
+    parser.add_argument('--telegram-latency-ms', type=float, default=40, help='Fake Bot API latency (bot mode)')
+    parser.add_argument('--start-mock', action='store_true', help='Run the mock GigaChat server in this process')
+    parser.add_argument('--mock-port', type=int, default=8090)
+    parser.add_argument('--mock-latency-ms', type=float, default=800)
+    parser.add_argument('--mock-jitter-ms', type=float, default=300)
+    parser.add_argument('--mock-error-rate', type=float, default=0.0)
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/load-<mode>-<timestamp>.json)')
+    args = parser.parse_args(argv)
+    args.concurrency = [int(level) for level in args.concurrency.split(',') if level.strip()]
+
+    mock = None
+    settings = None
+    if args.start_mock:
+        settings = MockSettings(args.mock_latency_ms, args.mock_jitter_ms, error_rate=args.mock_error_rate)
+        mock = start_mock_server(settings, port=args.mock_port)
+        env = settings.env('127.0.0.1', args.mock_port)
+        if args.mode == 'bot':
+            os.environ.update(env)
+        else:
+            env['STAGE_TIMINGS_PUBLIC'] = '1'
+            print('Start the web app with:\n' + '\n'.join(f'  {k}={v}' for k, v in env.items()), file=sys.stderr)
+
+    total = args.requests if args.mode == 'web' else args.questions_per_user * max(args.concurrency)
+    questions = load_questions(args.questions, max(total, 50), args.seed)
+
+    report = {
+        'meta': {
+            'mode': args.mode,
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'course_id': args.course_id,
+            'mock_gigachat': {key: value for key, value in vars(settings).items()
+                              if key not in ('lock', 'counters')} if settings else None
+        }
+    }
+    try:
+        if args.mode == 'web':
+            report['levels'] = run_web(args, questions)
+        else:
+            report['levels'], report['telegram_calls'] = run_bot(args, questions)
+    finally:
+        if mock:
+            report['mock_counters'] = settings.counters
+            mock.shutdown()
+
+    report['saturation'] = find_saturation(report['levels'])
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"load-{args.mode}-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"saturation: {report['saturation']}", file=sys.stderr)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
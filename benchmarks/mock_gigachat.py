@@ -0,0 +1,132 @@
+"""
+Local stand-in for the GigaChat API with configurable latency and error rate.
+
+    python -m benchmarks.mock_gigachat --port 8090 --latency-ms 800 --jitter-ms 300 --error-rate 0.05
+
+Point the application at it with
+    GIGACHAT_TOKEN_URL=http://127.0.0.1:8090/api/v2/oauth
+    GIGACHAT_BASE_URL=http://127.0.0.1:8090/api/v1
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict
+
+
+class MockSettings:
+    def __init__(self, latency_ms: float = 800, jitter_ms: float = 300, token_latency_ms: float = 50,
+                 error_rate: float = 0.0, rate_limit_share: float = 0.5):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.token_latency_ms = token_latency_ms
+        self.error_rate = error_rate
+        self.rate_limit_share = rate_limit_share  # Доля ошибок, отдаваемых как 429, остальные - 500
+        self.lock = threading.Lock()
+        self.counters = {'token': 0, 'completions': 0, 'errors': 0}
+
+    def count(self, key: str) -> None:
+        with self.lock:
+            self.counters[key] += 1
+
+    def env(self, host: str, port: int) -> Dict[str, str]:
+        """Environment variables that point GigaChatAPI at this server"""
+        return {
+            'GIGACHAT_TOKEN_URL': f'http://{host}:{port}/api/v2/oauth',
+            'GIGACHAT_BASE_URL': f'http://{host}:{port}/api/v1',
+            'GIGACHAT_CREDENTIALS': 'mock'
+        }
+
+
+def _make_handler(settings: MockSettings):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            pass
+
+        def _reply(self, status: int, payload: Dict, headers: Dict[str, str] = None):
+            body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            for key, value in (headers or {}).items():
+                self.send_header(key, value)
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            length = int(self.headers.get('Content-Length') or 0)
+            raw = self.rfile.read(length) if length else b''
+
+            if self.path.endswith('/oauth'):
+                settings.count('token')
+                time.sleep(settings.token_latency_ms / 1000)
+                self._reply(200, {'access_token': 'mock-token',
+                                  'expires_at': int((time.time() + 1800) * 1000)})
+                return
+
+            if self.path.endswith('/chat/completions'):
+                settings.count('completions')
+                delay = max(0.0, random.gauss(settings.latency_ms, settings.jitter_ms / 2)) / 1000
+                time.sleep(delay)
+                if random.random() < settings.error_rate:
+                    settings.count('errors')
+                    if random.random() < settings.rate_limit_share:
+                        self._reply(429, {'message': 'Too Many Requests'}, {'Retry-After': '1'})
+                    else:
+                        self._reply(500, {'message': 'Internal Server Error'})
+                    return
+                try:
+                    prompt = json.loads(raw or b'{}')['messages'][-1]['content']
+                except (ValueError, KeyError, IndexError):
+                    prompt = ''
+                self._reply(200, {
+                    'choices': [{'message': {
+                        'role': 'assistant',
+                        'content': f"Тестовый ответ на основе контекста ({len(prompt)} символов промпта)."
+                    }}],
+                    'usage': {'prompt_tokens': len(prompt) // 4, 'completion_tokens': 20}
+                })
+                return
+
+            self._reply(404, {'message': 'Not found'})
+
+    return Handler
+
+
+def start_mock_server(settings: MockSettings, host: str = '127.0.0.1', port: int = 8090) -> ThreadingHTTPServer:
+    """Start the mock in a background thread; call .shutdown() to stop it"""
+    server = ThreadingHTTPServer((host, port), _make_handler(settings))
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='mock-gigachat', daemon=True).start()
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Mock GigaChat API server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8090)
+    parser.add_argument('--latency-ms', type=float, default=800, help='Mean completion latency')
+    parser.add_argument('--jitter-ms', type=float, default=300, help='Spread of completion latency')
+    parser.add_argument('--token-latency-ms', type=float, default=50)
+    parser.add_argument('--error-rate', type=float, default=0.0, help='Share of failed completions (429/500)')
+    args = parser.parse_args(argv)
+
+    settings = MockSettings(args.latency_ms, args.jitter_ms, args.token_latency_ms, args.error_rate)
+    server = ThreadingHTTPServer((args.host, args.port), _make_handler(settings))
+    server.daemon_threads = True
+    for key, value in settings.env(args.host, args.port).items():
+        print(f"{key}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        print(json.dumps(settings.counters))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,319 @@
+"""
+Retrieval quality and latency benchmark.
+
+For each corpus size and index configuration it measures recall@k, MRR@10,
+p50/p95/p99 query latency, index build time and process RSS, and writes
+everything to a JSON file under benchmarks/results/ for later comparison
+(python -m benchmarks.compare).
+
+    python -m benchmarks.retrieval --sizes 1000,10000,100000 --configs flat,hybrid,hnsw,ivf
+    python -m benchmarks.retrieval --corpus chunks.jsonl --questions-file questions.jsonl
+
+Configurations:
+    flat    VectorDB.search (IndexFlatL2, as used in production), end to end
+    hybrid  VectorDB.hybrid_search (FAISS + BM25 with RRF), end to end
+    hnsw    faiss.IndexHNSWFlat (M=32, efSearch=64) over the same embeddings
+    ivf     faiss.IndexIVFFlat (nlist=4*sqrt(n), nprobe=16)
+
+Corpus embeddings are cached in benchmarks/.cache, keyed by corpus content,
+so the model is run once per corpus. Query latency always includes encoding
+the query; for the raw FAISS configs the encode time is measured separately
+and added.
+"""
+import os
+import sys
+import json
+import math
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import logging
+from datetime import datetime
+from typing import Callable, Dict, List
+
+import numpy as np
+
+from benchmarks.corpus import generate_corpus, load_jsonl, corpus_fingerprint
+
+logger = logging.getLogger(__name__)
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+CACHE_DIR = os.path.join(BENCH_DIR, '.cache')
+RESULTS_DIR = os.path.join(BENCH_DIR, 'results')
+
+DEFAULT_SIZES = [1000, 10000, 100000]
+CONFIGS = ('flat', 'hybrid', 'hnsw', 'ivf')
+KS = (1, 3, 5, 10)
+WARMUP_QUERIES = 5
+APPEND_BATCH = 10000
+
+
+def rss_mb() -> float:
+    """Current resident set size of the process in MB"""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    import resource
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def latency_summary(values: List[float]) -> Dict[str, float]:
+    if not values:
+        return {}
+    array = np.asarray(values)
+    return {
+        'p50': round(float(np.percentile(array, 50)), 2),
+        'p95': round(float(np.percentile(array, 95)), 2),
+        'p99': round(float(np.percentile(array, 99)), 2),
+        'mean': round(float(array.mean()), 2)
+    }
+
+
+def quality_metrics(ranked: List[List[str]], expected: List[str]) -> Dict[str, float]:
+    """recall@k for KS and MRR@10 of ranked chunk ids against the labelled chunk"""
+    metrics = {f'recall@{k}': 0.0 for k in KS}
+    reciprocal_ranks = 0.0
+    for ids, target in zip(ranked, expected):
+        rank = ids.index(target) + 1 if target in ids else None
+        for k in KS:
+            if rank is not None and rank <= k:
+                metrics[f'recall@{k}'] += 1
+        if rank is not None and rank <= 10:
+            reciprocal_ranks += 1 / rank
+    count = max(1, len(expected))
+    metrics = {key: round(value / count, 4) for key, value in metrics.items()}
+    metrics['mrr@10'] = round(reciprocal_ranks / count, 4)
+    return metrics
+
+
+def embed_corpus(model, model_name: str, chunks: List[Dict], batch_size: int) -> (np.ndarray, float):
+    """Embed all chunk texts, reusing the cached matrix for the same corpus and model"""
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    key = corpus_fingerprint(chunks) + '-' + model_name.replace('/', '_')
+    path = os.path.join(CACHE_DIR, f'{key}.npy')
+    if os.path.exists(path):
+        return np.load(path), 0.0
+    start = time.perf_counter()
+    embeddings = np.asarray(model.encode([chunk['text'] for chunk in chunks], batch_size=batch_size,
+                                         show_progress_bar=len(chunks) > 10000), dtype='float32')
+    elapsed = time.perf_counter() - start
+    np.save(path, embeddings)
+    return embeddings, elapsed
+
+
+def encode_queries(model, questions: List[Dict]) -> (np.ndarray, List[float]):
+    """Encode questions one at a time (as at query time), recording each encode latency"""
+    vectors = []
+    timings = []
+    for question in questions:
+        start = time.perf_counter()
+        vectors.append(model.encode([question['question']])[0])
+        timings.append((time.perf_counter() - start) * 1000)
+    return np.asarray(vectors, dtype='float32'), timings
+
+
+def run_queries(search: Callable[[int], List[str]], questions: List[Dict],
+                extra_ms: List[float] = None) -> Dict:
+    """Run every question through search(i) -> ranked chunk ids, collecting quality and latency"""
+    for i in range(min(WARMUP_QUERIES, len(questions))):
+        search(i)
+    ranked = []
+    latencies = []
+    for i in range(len(questions)):
+        start = time.perf_counter()
+        ranked.append(search(i))
+        elapsed = (time.perf_counter() - start) * 1000
+        latencies.append(elapsed + (extra_ms[i] if extra_ms else 0.0))
+    result = quality_metrics(ranked, [question['chunk_id'] for question in questions])
+    result['latency_ms'] = latency_summary(latencies)
+    return result
+
+
+def bench_vectordb(chunks, embeddings, questions, configs) -> List[Dict]:
+    """flat / hybrid: the production VectorDB, filled with precomputed embeddings"""
+    from app.services.vector_db import VectorDB
+
+    work_dir = tempfile.mkdtemp(prefix='bench-vectordb-')
+    try:
+        rss_before = rss_mb()
+        vector_db = VectorDB(os.path.join(work_dir, 'vector_index.faiss'),
+                             os.path.join(work_dir, 'documents.json'))
+        start = time.perf_counter()
+        for offset in range(0, len(chunks), APPEND_BATCH):
+            vector_db._append(chunks[offset:offset + APPEND_BATCH],
+                              embeddings[offset:offset + APPEND_BATCH], save=False)
+        build_s = time.perf_counter() - start
+        lexical_s = vector_db.lexical.build_ms / 1000
+        rss_after = rss_mb()
+
+        runs = []
+        for config in configs:
+            search = vector_db.search if config == 'flat' else vector_db.hybrid_search
+            result = run_queries(
+                lambda i: [doc['id'] for doc in search(questions[i]['question'], top_k=max(KS))],
+                questions
+            )
+            result.update({
+                'config': config,
+                'build_s': round(build_s - (lexical_s if config == 'flat' else 0.0), 3),
+                'lexical_build_s': round(lexical_s, 3) if config == 'hybrid' else None,
+                'rss_mb': round(rss_after, 1),
+                'rss_delta_mb': round(rss_after - rss_before, 1),
+                'index_bytes': vector_db.stats()['vector']['approx_bytes']
+                + (vector_db.lexical.stats()['approx_bytes'] if config == 'hybrid' else 0)
+            })
+            runs.append(result)
+        return runs
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def bench_faiss(config, chunks, embeddings, questions, query_vectors, encode_ms) -> Dict:
+    """hnsw / ivf: alternative FAISS indexes over the same embeddings"""
+    import faiss
+
+    dim = embeddings.shape[1]
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    if config == 'hnsw':
+        index = faiss.IndexHNSWFlat(dim, 32)
+        index.hnsw.efConstruction = 80
+        index.add(embeddings)
+        index.hnsw.efSearch = 64
+        params = {'M': 32, 'efConstruction': 80, 'efSearch': 64}
+    else:
+        nlist = max(16, int(4 * math.sqrt(len(chunks))))
+        quantizer = faiss.IndexFlatL2(dim)
+        index = faiss.IndexIVFFlat(quantizer, dim, nlist)
+        sample = embeddings[np.random.RandomState(0).choice(len(embeddings), min(len(embeddings), nlist * 40),
+                                                            replace=False)]
+        index.train(sample)
+        index.add(embeddings)
+        index.nprobe = 16
+        params = {'nlist': nlist, 'nprobe': 16}
+    build_s = time.perf_counter() - start
+    rss_after = rss_mb()
+
+    ids = [chunk['id'] for chunk in chunks]
+    top_k = max(KS)
+
+    def search(i):
+        _, indices = index.search(query_vectors[i:i + 1], top_k)
+        return [ids[idx] for idx in indices[0] if idx >= 0]
+
+    result = run_queries(search, questions, extra_ms=encode_ms)
+    result.update({
+        'config': config,
+        'params': params,
+        'build_s': round(build_s, 3),
+        'rss_mb': round(rss_after, 1),
+        'rss_delta_mb': round(rss_after - rss_before, 1)
+    })
+    del index
+    return result
+
+
+def run(sizes: List[int], configs: List[str], question_count: int, seed: int, batch_size: int,
+        corpus_path: str = None, questions_path: str = None) -> Dict:
+    from app.services.embeddings import get_embedding_model, EMBEDDING_MODEL_NAME
+
+    # Логи поиска на каждый запрос искажают замеры задержки
+    logging.getLogger().setLevel(logging.WARNING)
+
+    model = get_embedding_model()
+    report = {
+        'meta': {
+            'timestamp': datetime.utcnow().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'model': EMBEDDING_MODEL_NAME,
+            'seed': seed,
+            'questions': question_count
+        },
+        'runs': []
+    }
+
+    if corpus_path:
+        # Готовый корпус: размеры берутся как префиксы файла
+        all_chunks = load_jsonl(corpus_path, limit=max(sizes))
+        all_questions = load_jsonl(questions_path)
+
+    for size in sizes:
+        if corpus_path:
+            chunks = all_chunks[:size]
+            known = {chunk['id'] for chunk in chunks}
+            questions = [q for q in all_questions if q['chunk_id'] in known][:question_count]
+        else:
+            chunks, questions = generate_corpus(size, seed=seed, question_count=question_count)
+        print(f"[{size}] corpus: {len(chunks)} chunks, {len(questions)} questions", file=sys.stderr)
+
+        embeddings, embed_s = embed_corpus(model, EMBEDDING_MODEL_NAME, chunks, batch_size)
+        query_vectors, encode_ms = encode_queries(model, questions)
+        common = {
+            'size': len(chunks),
+            'questions': len(questions),
+            'corpus_embed_s': round(embed_s, 2) if embed_s else None,
+            'encode_ms': latency_summary(encode_ms)
+        }
+
+        vectordb_configs = [config for config in configs if config in ('flat', 'hybrid')]
+        if vectordb_configs:
+            for result in bench_vectordb(chunks, embeddings, questions, vectordb_configs):
+                report['runs'].append({**common, **result})
+                print(f"[{size}] {result['config']}: {json.dumps(result, ensure_ascii=False)}", file=sys.stderr)
+        for config in configs:
+            if config in ('hnsw', 'ivf'):
+                result = bench_faiss(config, chunks, embeddings, questions, query_vectors, encode_ms)
+                report['runs'].append({**common, **result})
+                print(f"[{size}] {config}: {json.dumps(result, ensure_ascii=False)}", file=sys.stderr)
+    return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmark retrieval quality and latency')
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help='Corpus sizes in chunks, comma-separated (up to 1000000)')
+    parser.add_argument('--configs', default=','.join(CONFIGS), help='Index configurations: ' + ', '.join(CONFIGS))
+    parser.add_argument('--questions', type=int, default=500, help='Labelled questions per size')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--batch-size', type=int, default=256, help='Embedding batch size for the corpus')
+    parser.add_argument('--corpus', help='JSONL file of chunks {"id", "text"} instead of the synthetic corpus')
+    parser.add_argument('--questions-file', help='JSONL file of {"question", "chunk_id"} for --corpus')
+    parser.add_argument('--output', help='Result file (default: benchmarks/results/retrieval-<timestamp>.json)')
+    args = parser.parse_args(argv)
+
+    configs = [config.strip() for config in args.configs.split(',') if config.strip()]
+    unknown = set(configs) - set(CONFIGS)
+    if unknown:
+        parser.error(f"unknown configs: {', '.join(sorted(unknown))}")
+    if args.corpus and not args.questions_file:
+        parser.error('--corpus requires --questions-file')
+
+    report = run(
+        sorted(int(size) for size in args.sizes.split(',')),
+        configs,
+        args.questions,
+        args.seed,
+        args.batch_size,
+        corpus_path=args.corpus,
+        questions_path=args.questions_file
+    )
+
+    output = args.output or os.path.join(
+        RESULTS_DIR, f"retrieval-{datetime.utcnow().strftime('%Y%m%d-%H%M%S')}.json"
+    )
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(output)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,39 +1,32 @@
 import os
-from PyPDF2 import PdfReader
-from docx import Document as DocxDocument
 from langchain_core.documents import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from zipfile import BadZipFile
+from app.file_processing import process_pdf as extract_pdf, process_docx as extract_docx
+from app.services.chunking import chunk_segments, DEFAULT_OVERLAP_TOKENS
 
-def process_pdf(file_path, chunk_size=500, chunk_overlap=100):
-    reader = PdfReader(file_path)
-    text = ""
-    for page in reader.pages:
-        text += page.extract_text() + "\n"
-    documents = [Document(page_content=text)]
-    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_documents(documents)
+def _to_documents(segments, file_path, chunk_size, chunk_overlap):
+    chunks = chunk_segments(segments, source=file_path, max_tokens=chunk_size, overlap_tokens=chunk_overlap)
+    return [
+        Document(page_content=chunk.pop('text'), metadata=chunk)
+        for chunk in chunks
+    ]
 
-def process_docx(file_path, chunk_size=500, chunk_overlap=100):
-    try:
-        doc = DocxDocument(file_path)  # Используем правильный класс
-        full_text = []
-        for para in doc.paragraphs:
-            full_text.append(para.text)
-        text = '\n'.join(full_text)
-        documents = [Document(page_content=text)]  # Создаем объект Document из langchain
-        return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_documents(documents)
-    except BadZipFile:
-        raise ValueError("The DOCX file is corrupted or not a valid DOCX file.")
-    except KeyError as e:
-        raise ValueError(f"There is no item named '{e.args[0]}' in the archive")
+def process_pdf(file_path, chunk_size=None, chunk_overlap=DEFAULT_OVERLAP_TOKENS):
+    return _to_documents(extract_pdf(file_path), file_path, chunk_size, chunk_overlap)
+
+def process_docx(file_path, chunk_size=None, chunk_overlap=DEFAULT_OVERLAP_TOKENS):
+    return _to_documents(extract_docx(file_path), file_path, chunk_size, chunk_overlap)
 
-def process_txt(file_path, chunk_size=500, chunk_overlap=100):
+def process_txt(file_path, chunk_size=None, chunk_overlap=DEFAULT_OVERLAP_TOKENS):
     with open(file_path, "r", encoding="utf-8") as file:
-        text = file.read()
-    documents = [Document(page_content=text)]
-    return RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap).split_documents(documents)
+        paragraphs = file.read().split("\n\n")
+    segments = [
+        {'text': text.strip(), 'paragraph': num}
+        for num, text in enumerate(paragraphs, 1) if text.strip()
+    ]
+    return _to_documents(segments, file_path, chunk_size, chunk_overlap)
 
-def process_file(file_path, chunk_size=500, chunk_overlap=100):
+def process_file(file_path, chunk_size=None, chunk_overlap=DEFAULT_OVERLAP_TOKENS):
+    """chunk_size и chunk_overlap задаются в токенах модели эмбеддингов (по умолчанию - её лимит)"""
     file_extension = os.path.splitext(file_path)[-1].lower()
     if file_extension == ".pdf":
         return process_pdf(file_path, chunk_size, chunk_overlap)
@@ -46,7 +39,7 @@ def process_file(file_path, chunk_size=500, chunk_overlap=100):
 
 if __name__ == "__main__":
     try:
-        result = process_file("/Users/leonidstepanov/Desktop/site 2/Uploads/4.pdf", 500, 100)
+        result = process_file("/Users/leonidstepanov/Desktop/site 2/Uploads/4.pdf")
         if result:
             print(result[0].page_content)
         else:
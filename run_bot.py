@@ -2,6 +2,7 @@ import asyncio
 import logging
 from app import create_app
 from app.bot.bot import CourseBot
+from app.services.metrics import start_metrics_server
 
 # Настройка логирования
 logging.basicConfig(
@@ -16,6 +17,9 @@ async def main():
         # Создаем Flask приложение
         app = create_app()
 
+        # Метрики времени этапов (порт BOT_METRICS_PORT, 0 - отключить)
+        start_metrics_server()
+
         # Создаем и запускаем бота
         bot = CourseBot(app)
         logger.info("Bot instance created successfully")
@@ -0,0 +1,52 @@
+import sys
+import asyncio
+import logging
+import argparse
+from app.bot.webhook import (WebhookServer, replay_updates, WEBHOOK_HOST, WEBHOOK_PORT,
+                             WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_WORKERS,
+                             WEBHOOK_ALLOW_INSECURE)
+
+# Настройка логирования
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+)
+logger = logging.getLogger(__name__)
+
+
+def main():
+    """Запуск бота в режиме вебхука (альтернатива run_bot.py с long polling)"""
+    parser = argparse.ArgumentParser(description='Telegram bot webhook server')
+    subparsers = parser.add_subparsers(dest='command')
+
+    serve = subparsers.add_parser('serve', help='Run the webhook server (default)')
+    serve.add_argument('--host', default=WEBHOOK_HOST)
+    serve.add_argument('--port', type=int, default=WEBHOOK_PORT)
+    serve.add_argument('--workers', type=int, default=WEBHOOK_WORKERS)
+    serve.add_argument('--public-url', default=WEBHOOK_URL,
+                       help='Public base URL to register in Telegram (skipped when empty)')
+    serve.add_argument('--allow-insecure', action='store_true', default=WEBHOOK_ALLOW_INSECURE,
+                       help='Accept updates without WEBHOOK_SECRET on a non-loopback address')
+
+    replay = subparsers.add_parser('replay', help='POST recorded updates (JSON lines) to a local server')
+    replay.add_argument('updates')
+    replay.add_argument('--url', default=f'http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}')
+
+    args = parser.parse_args()
+
+    if args.command == 'replay':
+        print(replay_updates(args.updates, args.url))
+        return
+
+    server = WebhookServer(workers=getattr(args, 'workers', WEBHOOK_WORKERS),
+                           allow_insecure=getattr(args, 'allow_insecure', WEBHOOK_ALLOW_INSECURE))
+    try:
+        asyncio.run(server.serve(getattr(args, 'host', WEBHOOK_HOST), getattr(args, 'port', WEBHOOK_PORT),
+                                 getattr(args, 'public_url', WEBHOOK_URL)))
+    except Exception as e:
+        logger.error(f"Critical error in webhook server: {e}")
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
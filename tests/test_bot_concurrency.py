@@ -0,0 +1,79 @@
+import time
+import asyncio
+from contextlib import contextmanager
+
+from app.bot.workers import WorkerPool
+
+QUESTION_SECONDS = 0.2
+
+
+class FakeApp:
+    """Stands in for the Flask app: WorkerPool only needs app_context()"""
+
+    @contextmanager
+    def app_context(self):
+        yield
+
+
+def slow_answer(question):
+    time.sleep(QUESTION_SECONDS)  # Блокирующий RAG-конвейер (поиск + GigaChat)
+    return f"answer to {question}"
+
+
+async def ask(pool, user_id):
+    assert pool.begin_question(user_id)
+    try:
+        return await pool.answer(slow_answer, f"q{user_id}")
+    finally:
+        pool.end_question(user_id)
+
+
+def test_simultaneous_users_are_served_in_parallel():
+    users = 16
+
+    async def scenario():
+        pool = WorkerPool(FakeApp(), max_workers=users, max_questions=users)
+        ticks = 0
+
+        async def heartbeat():
+            # Цикл событий должен оставаться свободным, пока идут вопросы
+            nonlocal ticks
+            while True:
+                await asyncio.sleep(0.01)
+                ticks += 1
+
+        beat = asyncio.create_task(heartbeat())
+        start = time.perf_counter()
+        answers = await asyncio.gather(*(ask(pool, user_id) for user_id in range(users)))
+        elapsed = time.perf_counter() - start
+        beat.cancel()
+        pool.shutdown()
+        return answers, elapsed, ticks
+
+    answers, elapsed, ticks = asyncio.run(scenario())
+    assert answers == [f"answer to q{user_id}" for user_id in range(users)]
+    # Последовательно это заняло бы users * QUESTION_SECONDS = 3.2 с
+    assert elapsed < QUESTION_SECONDS * 4
+    assert ticks >= 5
+
+
+def test_global_cap_limits_concurrent_questions():
+    async def scenario():
+        pool = WorkerPool(FakeApp(), max_workers=8, max_questions=2)
+        start = time.perf_counter()
+        await asyncio.gather(*(ask(pool, user_id) for user_id in range(4)))
+        pool.shutdown()
+        return time.perf_counter() - start
+
+    # 4 вопроса при лимите 2 выполняются в две волны
+    assert asyncio.run(scenario()) >= QUESTION_SECONDS * 2
+
+
+def test_one_question_in_flight_per_user():
+    pool = WorkerPool(FakeApp(), max_workers=1, max_questions=1)
+    assert pool.begin_question(42)
+    assert not pool.begin_question(42)
+    assert pool.begin_question(7)
+    pool.end_question(42)
+    assert pool.begin_question(42)
+    pool.shutdown()